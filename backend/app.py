@@ -3,18 +3,41 @@ Flask 主程序
 这是后端服务器的入口文件
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, get_jwt_identity, verify_jwt_in_request
 from dotenv import load_dotenv
+from werkzeug.exceptions import RequestEntityTooLarge
+import hmac
+import json
 import os
+import time
 from datetime import timedelta
+from functools import wraps
+from itertools import chain
 
 # 导入数据库模型
-from models import Database, User, Comment
+from models import get_database, User, Comment, Roster, GenerationJob, GenerationCacheEntry
 
 # 导入 AI 客户端
-from utils.ai_client import get_ai_client
+from utils.ai_client import (
+    get_ai_client, generate_comments, CommentStream, fallback_enabled, fallback_reason, template_client
+)
+from utils.export import CONTENT_TYPES as EXPORT_CONTENT_TYPES, export_comments as export_comment_rows
+from utils.generation_cache import GenerationCache
+from utils.passwords import PasswordHasherBusy
+from utils.health_probe import HealthProber
+from utils.metrics import (
+    ai_fallback_generations, http_request_duration, http_requests_in_flight, registry as metrics_registry
+)
+from utils.profiling import RequestProfiler
+from utils import request_timing
+from utils.provider_stats import provider_health, usage_stats
+from utils.rate_limit import RateLimitTimeout, get_all_stats as get_rate_limit_stats
+from utils.roster import RosterFormatError, RosterReader, validate_student
+
+# 导入后台任务
+from jobs import JobWorkerPool
 
 # 加载环境变量（从 .env 文件）
 load_dotenv()
@@ -28,6 +51,37 @@ app = Flask(__name__)
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=7)  # Token 有效期7天
 
+# 评语历史每页最大数量（防止一次请求读取过多数据）
+app.config['HISTORY_MAX_LIMIT'] = int(os.getenv('HISTORY_MAX_LIMIT', 100))
+
+# 全文检索的检索词最大长度（字符）
+app.config['SEARCH_MAX_QUERY_LENGTH'] = int(os.getenv('SEARCH_MAX_QUERY_LENGTH', 100))
+# 只有短词（少于 3 个字符，无法走全文索引）时，最多在最近多少条评语中查找
+app.config['SEARCH_SHORT_TERM_SCAN_LIMIT'] = int(os.getenv('SEARCH_SHORT_TERM_SCAN_LIMIT', 5000))
+
+# 班级名称最大长度（字符）
+app.config['CLASS_NAME_MAX_LENGTH'] = int(os.getenv('CLASS_NAME_MAX_LENGTH', 50))
+
+# 批量生成评语时一次最多提交的学生数
+app.config['BATCH_MAX_SIZE'] = int(os.getenv('BATCH_MAX_SIZE', 60))
+
+# 导入学生名单：上传文件大小上限（MB）、最多读取的行数
+app.config['ROSTER_MAX_UPLOAD_MB'] = float(os.getenv('ROSTER_MAX_UPLOAD_MB', 5))
+app.config['ROSTER_MAX_ROWS'] = int(os.getenv('ROSTER_MAX_ROWS', 10000))
+
+# 请求体大小上限：名单文件上限再留 1 MB 给 multipart 的其他字段。
+# 分块上传（没有 Content-Length）时读取超过上限即停止，返回 413
+app.config['MAX_CONTENT_LENGTH'] = int((app.config['ROSTER_MAX_UPLOAD_MB'] + 1) * 1024 * 1024)
+
+# 后台任务失败后的最大尝试次数
+app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+
+# 用量统计最多回溯的天数
+app.config['USAGE_MAX_DAYS'] = int(os.getenv('USAGE_MAX_DAYS', 366))
+
+# 登录、注册因哈希计算排队已满被拒绝时，建议客户端等待的秒数（Retry-After）
+app.config['PASSWORD_HASH_RETRY_AFTER'] = int(os.getenv('PASSWORD_HASH_RETRY_AFTER', 1))
+
 # 初始化 JWT
 jwt = JWTManager(app)
 
@@ -48,8 +102,126 @@ CORS(app, resources={
     }
 })
 
-# 初始化数据库
-db = Database()
+# /metrics 访问令牌（为空时不校验，生产环境建议设置或只在内网开放）
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN', '')
+
+# 是否返回 Server-Timing 响应头（分阶段耗时）
+app.config['SERVER_TIMING'] = os.getenv('SERVER_TIMING', 'true').lower() == 'true'
+
+# 耗时超过多少毫秒的请求输出一行 [TIMING] 日志（0 表示全部输出，负数表示关闭）
+app.config['REQUEST_LOG_SLOW_MS'] = float(os.getenv('REQUEST_LOG_SLOW_MS', 1000))
+
+# 采样性能分析（PROFILE_SAMPLE_RATE / PROFILE_DIR / PROFILE_TOKEN）
+request_profiler = RequestProfiler()
+
+
+def jwt_required(*args, **kwargs):
+    """
+    与 flask_jwt_extended.jwt_required 相同，额外把 JWT 校验耗时记为 Server-Timing 的 jwt 阶段
+    """
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*view_args, **view_kwargs):
+            with request_timing.timed('jwt'):
+                verify_jwt_in_request(*args, **kwargs)
+            return app.ensure_sync(fn)(*view_args, **view_kwargs)
+        return decorator
+    return wrapper
+
+
+def request_route():
+    """当前请求匹配的路由模板（未匹配时为 unmatched）"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@app.before_request
+def start_request_timer():
+    """记录请求开始时间（/metrics、Server-Timing），按需启动性能分析"""
+    g.request_start = time.perf_counter()
+    g.request_timing_token = request_timing.start()
+    http_requests_in_flight.inc()
+    if request_profiler.enabled:
+        g.profile = request_profiler.start(request.headers.get('X-Profile'))
+
+
+@app.after_request
+def observe_request(response):
+    """按路由模板和状态码记录请求耗时，并附上 Server-Timing 响应头"""
+    start = g.get('request_start')
+    if start is not None:
+        http_request_duration.observe(
+            time.perf_counter() - start,
+            request.method,
+            request_route(),
+            response.status_code
+        )
+    timings = request_timing.current()
+    if timings is not None and app.config['SERVER_TIMING']:
+        # 流式响应在返回第一段数据之前就发送了响应头，只包含到此为止的耗时
+        response.headers['Server-Timing'] = timings.server_timing()
+    return response
+
+
+@app.teardown_request
+def finish_request_timer(exc):
+    """请求结束（包括异常退出、流式响应发送完毕）时输出慢请求日志和性能分析结果"""
+    if g.pop('request_start', None) is None:
+        return
+    http_requests_in_flight.dec()
+    timings = request_timing.finish(g.pop('request_timing_token'))
+    elapsed_ms = timings.elapsed() * 1000
+
+    name = f'{request.method} {request_route()}'
+    profile = g.pop('profile', None)
+    profile_path = None
+    if profile is not None:
+        profile_path = request_profiler.stop(profile, name, elapsed_ms)
+
+    slow_ms = app.config['REQUEST_LOG_SLOW_MS']
+    if (slow_ms >= 0 and elapsed_ms >= slow_ms) or profile_path:
+        print('[TIMING] ' + json.dumps({
+            'method': request.method,
+            'route': request_route(),
+            'path': request.path,
+            'total_ms': round(elapsed_ms, 2),
+            'phases': timings.phases(),
+            'error': type(exc).__name__ if exc is not None else None,
+            'profile': profile_path
+        }, ensure_ascii=False), flush=True)
+
+
+# 初始化数据库（全局共享连接池）
+db = get_database()
+
+
+@app.before_request
+def bind_db_connection():
+    """请求开始：本请求用到的数据库连接在请求期间复用"""
+    db.begin_request()
+
+
+# 评语生成缓存（内存 LRU + SQLite 持久层）
+generation_cache = GenerationCache(store=GenerationCacheEntry)
+
+# 后台评语生成工作线程（按进程启动）
+job_workers = JobWorkerPool(cache=generation_cache)
+
+
+# 熔断服务商的后台探测线程（按进程启动）
+health_prober = HealthProber()
+
+
+@app.before_request
+def start_background_threads():
+    """确保当前进程的后台工作线程和探测线程已启动（兼容多进程部署）"""
+    job_workers.ensure_started()
+    health_prober.ensure_started()
+
+
+@app.teardown_request
+def release_db_connection(exc):
+    """请求结束：把连接归还到连接池"""
+    db.end_request()
 
 # ===== 路由部分 =====
 
@@ -66,6 +238,22 @@ def index():
     })
 
 
+def request_class_name(data):
+    """请求中的班级名称（可选，去掉首尾空白，最多保留 CLASS_NAME_MAX_LENGTH 个字符）"""
+    class_name = data.get('class_name')
+    if not isinstance(class_name, str):
+        return None
+    return class_name.strip()[:app.config['CLASS_NAME_MAX_LENGTH']] or None
+
+
+def password_hasher_busy(error):
+    """哈希计算排队已满：立即返回 503，让客户端稍后重试，而不是让请求排长队"""
+    return jsonify({
+        'success': False,
+        'message': str(error)
+    }), 503, {'Retry-After': str(app.config['PASSWORD_HASH_RETRY_AFTER'])}
+
+
 @app.route('/api/register', methods=['POST'])
 def register():
     """
@@ -114,7 +302,10 @@ def register():
             }), 400
 
         # 创建用户
-        user_id = User.create(username, password, email)
+        try:
+            user_id = User.create(username, password, email)
+        except PasswordHasherBusy as e:
+            return password_hasher_busy(e)
 
         if user_id:
             return jsonify({
@@ -168,7 +359,10 @@ def login():
             }), 400
 
         # 验证密码
-        user = User.verify_password(username, password)
+        try:
+            user = User.verify_password(username, password)
+        except PasswordHasherBusy as e:
+            return password_hasher_busy(e)
 
         if user:
             # 生成 JWT token（identity 必须是字符串）
@@ -245,13 +439,23 @@ def generate_comment():
     请求体: {
         "student_name": "学生姓名",
         "student_info": "学生信息（性格、成绩等）",
-        "ai_model": "AI模型名称（可选，默认deepseek）"
+        "ai_model": "AI模型名称（可选，默认deepseek；auto 表示自动选择最快的可用服务商）",
+        "force_fresh": true/false（可选，为 true 时跳过缓存重新生成）,
+        "class_name": "班级（可选，导出时可按班级分组）",
+        "async": true/false（可选，为 true 时加入后台队列，立即返回任务ID）
     }
 
     返回: {
         "success": true/false,
         "comment": "生成的评语",
-        "comment_id": 评语ID
+        "comment_id": 评语ID,
+        "ai_model": "实际生成评语的服务商（降级模式下为 template）",
+        "needs_regeneration": 是否为降级模式的模板评语（服务商恢复后可调用 /api/comment/regenerate）
+    }
+    任务模式返回（状态码 202）: {
+        "success": true,
+        "job_id": 任务ID,
+        "status": "pending"
     }
     """
     try:
@@ -263,24 +467,67 @@ def generate_comment():
         student_name = data.get('student_name')
         student_info = data.get('student_info')
         ai_model = data.get('ai_model', 'deepseek')
+        force_fresh = bool(data.get('force_fresh'))
+        class_name = request_class_name(data)
 
-        # 验证必填字段
-        if not student_name or not student_info:
+        # 验证必填字段和长度
+        error = validate_student(student_name, student_info)
+        if error:
             return jsonify({
                 'success': False,
-                'message': '学生姓名和信息不能为空'
+                'message': error
             }), 400
 
-        # 使用 AI 生成评语
+        # 任务模式：加入队列后立即返回，由后台线程生成
+        if data.get('async'):
+            try:
+                get_ai_client(ai_model)
+            except ValueError as e:
+                # API Key 未配置
+                return jsonify({
+                    'success': False,
+                    'message': str(e)
+                }), 400
+
+            job_id = GenerationJob.create(
+                user_id=user_id,
+                student_name=student_name,
+                student_info=student_info,
+                ai_model=ai_model,
+                max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+                force_fresh=force_fresh,
+                class_name=class_name
+            )
+            job_workers.notify()
+
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status': 'pending'
+            }), 202
+
+        # 使用 AI 生成评语（配置了 AI_HEDGE_PROVIDER 时主服务商过慢会同时请求备用服务商；
+        # 服务商熔断、排队超时或调用失败时改用模板评语）
         try:
-            ai_client = get_ai_client(ai_model)
-            generated_comment = ai_client.generate_comment(student_name, student_info)
+            ai_client = get_ai_client(ai_model, hedge=True, fallback=True)
+            result = generation_cache.generate(
+                ai_client,
+                student_name,
+                student_info,
+                force_fresh=force_fresh
+            )
         except ValueError as e:
             # API Key 未配置
             return jsonify({
                 'success': False,
                 'message': str(e)
             }), 400
+        except RateLimitTimeout as e:
+            # 限流排队超时
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 429
         except Exception as e:
             # AI API 调用失败
             return jsonify({
@@ -288,19 +535,25 @@ def generate_comment():
                 'message': f'AI 生成失败: {str(e)}'
             }), 500
 
-        # 保存到数据库
+        # 保存到数据库（ai_model 记录实际生成评语的服务商）
         comment_id = Comment.create(
             user_id=user_id,
             student_name=student_name,
             student_info=student_info,
-            generated_comment=generated_comment,
-            ai_model=ai_model
+            generated_comment=result.comment,
+            ai_model=result.provider,
+            usage=result.accounting(),
+            needs_regeneration=result.fallback,
+            class_name=class_name
         )
 
         return jsonify({
             'success': True,
-            'comment': generated_comment,
-            'comment_id': comment_id
+            'comment': result.comment,
+            'comment_id': comment_id,
+            'ai_model': result.provider,
+            'usage': result.accounting(),
+            'needs_regeneration': result.fallback
         }), 200
 
     except Exception as e:
@@ -310,34 +563,298 @@ def generate_comment():
         }), 500
 
 
-@app.route('/api/comment/history', methods=['GET'])
+def sse_event(event, data):
+    """格式化一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/api/comment/generate/stream', methods=['POST'])
 @jwt_required()
-def get_comment_history():
+def stream_comment():
+    """
+    流式生成学生评语接口（Server-Sent Events）
+
+    请求方法: POST
+    请求地址: /api/comment/generate/stream
+    请求头: Authorization: Bearer <token>
+    请求体: 与 /api/comment/generate 相同（支持 force_fresh、class_name）
+
+    返回: text/event-stream，事件类型:
+        token: {"text": "新生成的文本"}
+        done:  {"comment": "完整评语", "comment_id": 评语ID, "ai_model": "服务商",
+                "needs_regeneration": 是否为模板评语}
+        error: {"message": "错误信息"}
+
+    降级只发生在第一段文本之前：服务商在输出第一段文本之前失败时改用模板评语；
+    已经输出文本之后再失败时发送 error 事件、不保存评语，前端应丢弃已经显示的部分文本。
+    服务商的输出在服务端缓冲，浏览器读取得慢不会一直占用服务商的并发名额
+    """
+    try:
+        # 从 token 中获取用户ID（转换为整数）
+        user_id = int(get_jwt_identity())
+
+        # 获取请求数据
+        data = request.get_json()
+        student_name = data.get('student_name')
+        student_info = data.get('student_info')
+        ai_model = data.get('ai_model', 'deepseek')
+        force_fresh = bool(data.get('force_fresh'))
+        class_name = request_class_name(data)
+
+        # 验证必填字段和长度
+        error = validate_student(student_name, student_info)
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+
+        try:
+            ai_client = get_ai_client(ai_model)
+        except ValueError as e:
+            # API Key 未配置
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+
+        def generate():
+            """把服务商的增量输出转发给浏览器，结束后保存完整评语"""
+            cache_key = generation_cache.make_key(ai_client, student_name, student_info)
+            cached = None if force_fresh else generation_cache.lookup(cache_key)
+
+            if cached is not None:
+                # 缓存命中：一次性发送完整评语
+                result = cached
+                generated_comment = cached.comment
+                provider = cached.provider
+                yield sse_event('token', {'text': generated_comment})
+            else:
+                stream = CommentStream(ai_client.stream_comment(student_name, student_info))
+                started = False
+                try:
+                    for text in stream:
+                        started = True
+                        yield sse_event('token', {'text': text})
+                    # 流式结果带有服务商最后返回的 token 用量
+                    result = stream.result
+                except Exception as e:
+                    if started or not fallback_enabled():
+                        yield sse_event('error', {'message': f'AI 生成失败: {str(e)}'})
+                        return
+                    ai_fallback_generations.inc(ai_client.provider, fallback_reason(e))
+                    result = template_client.generate(student_name, student_info)
+                    yield sse_event('token', {'text': result.comment})
+
+                generated_comment = result.comment
+                if not generated_comment:
+                    yield sse_event('error', {'message': 'AI 生成失败: 返回内容为空'})
+                    return
+                provider = result.provider
+                generation_cache.put(cache_key, result)
+
+            try:
+                comment_id = Comment.create(
+                    user_id=user_id,
+                    student_name=student_name,
+                    student_info=student_info,
+                    generated_comment=generated_comment,
+                    ai_model=provider,
+                    usage=result.accounting(),
+                    needs_regeneration=result.fallback,
+                    class_name=class_name
+                )
+            except Exception as e:
+                yield sse_event('error', {'message': f'服务器错误: {str(e)}'})
+                return
+
+            yield sse_event('done', {
+                'comment': generated_comment,
+                'comment_id': comment_id,
+                'ai_model': provider,
+                'needs_regeneration': result.fallback
+            })
+
+        return Response(
+            stream_with_context(generate()),
+            status=200,
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'  # 关闭反向代理缓冲，保证逐段送达
+            }
+        )
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/comment/jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_comment_job(job_id):
     """
-    获取评语历史记录
+    查询评语生成任务状态（客户端轮询）
 
     请求方法: GET
-    请求地址: /api/comment/history?limit=20
+    请求地址: /api/comment/jobs/<job_id>
     请求头: Authorization: Bearer <token>
 
     返回: {
         "success": true/false,
-        "comments": [评语列表]
+        "job": {
+            "id": 任务ID,
+            "status": "pending/running/succeeded/failed",
+            "attempts": 已尝试次数,
+            "comment": "生成的评语"（成功时）,
+            "comment_id": 评语ID（成功时）,
+            "error": "失败原因"（失败时）
+        }
     }
     """
     try:
         # 从 token 中获取用户ID（转换为整数）
         user_id = int(get_jwt_identity())
 
-        # 获取查询参数
-        limit = request.args.get('limit', 20, type=int)
+        job = GenerationJob.get(job_id, user_id)
+
+        if job:
+            return jsonify({
+                'success': True,
+                'job': job
+            }), 200
+        else:
+            return jsonify({
+                'success': False,
+                'message': '任务不存在'
+            }), 404
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/comment/batch', methods=['POST'])
+@jwt_required()
+def batch_generate_comments():
+    """
+    批量生成学生评语接口（整个班级一次提交）
+
+    请求方法: POST
+    请求地址: /api/comment/batch
+    请求头: Authorization: Bearer <token>
+    请求体: {
+        "students": [
+            {"student_name": "学生姓名", "student_info": "学生信息"},
+            ...
+        ],
+        "ai_model": "AI模型名称（可选，默认deepseek）",
+        "force_fresh": true/false（可选，为 true 时跳过缓存重新生成）,
+        "class_name": "班级（可选，整批学生所在的班级）"
+    }
+
+    返回: {
+        "success": true/false,
+        "results": [
+            {"student_name": ..., "success": true, "comment": ..., "comment_id": ...,
+             "needs_regeneration": 是否为降级模式的模板评语}
+            或 {"student_name": ..., "success": false, "message": "失败原因"}
+        ],
+        "succeeded": 成功数量,
+        "failed": 失败数量
+    }
+    """
+    try:
+        # 从 token 中获取用户ID（转换为整数）
+        user_id = int(get_jwt_identity())
+
+        # 获取请求数据
+        data = request.get_json()
+        students = data.get('students')
+        ai_model = data.get('ai_model', 'deepseek')
+        force_fresh = bool(data.get('force_fresh'))
+        class_name = request_class_name(data)
+
+        # 验证学生列表
+        if not isinstance(students, list) or not students:
+            return jsonify({
+                'success': False,
+                'message': '学生列表不能为空'
+            }), 400
+
+        if len(students) > app.config['BATCH_MAX_SIZE']:
+            return jsonify({
+                'success': False,
+                'message': f"一次最多提交 {app.config['BATCH_MAX_SIZE']} 名学生"
+            }), 400
+
+        # 逐条验证，不合格的直接标记失败，不调用 AI
+        results = []
+        valid = []
+        for student in students:
+            student = student if isinstance(student, dict) else {}
+            student_name = student.get('student_name')
+            student_info = student.get('student_info')
+            error = validate_student(student_name, student_info)
+            if error:
+                results.append({
+                    'student_name': student_name,
+                    'success': False,
+                    'message': error
+                })
+            else:
+                result = {'student_name': student_name, 'student_info': student_info}
+                results.append(result)
+                valid.append(result)
+
+        # 并发调用 AI 生成评语
+        try:
+            generated = generate_comments(
+                ai_model,
+                valid,
+                cache=generation_cache,
+                force_fresh=force_fresh,
+                hedge=True,
+                fallback=True
+            )
+        except ValueError as e:
+            # API Key 未配置
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
 
-        # 获取评语历史
-        comments = Comment.get_by_user(user_id, limit)
+        succeeded = []
+        for result, outcome in zip(valid, generated):
+            if 'comment' in outcome:
+                result['generated_comment'] = outcome['comment']
+                result['ai_model'] = outcome['provider']
+                result['usage'] = outcome['usage']
+                result['needs_regeneration'] = outcome['fallback']
+                succeeded.append(result)
+            else:
+                result['success'] = False
+                result['message'] = f"AI 生成失败: {outcome['error']}"
+
+        # 成功的评语在一个事务中保存
+        comment_ids = Comment.create_many(user_id, succeeded, ai_model, class_name) if succeeded else []
+        for result, comment_id in zip(succeeded, comment_ids):
+            result['success'] = True
+            result['comment'] = result.pop('generated_comment')
+            result['comment_id'] = comment_id
+
+        for result in valid:
+            result.pop('student_info', None)
 
         return jsonify({
             'success': True,
-            'comments': comments
+            'results': results,
+            'succeeded': len(succeeded),
+            'failed': len(results) - len(succeeded)
         }), 200
 
     except Exception as e:
@@ -347,38 +864,101 @@ def get_comment_history():
         }), 500
 
 
-@app.route('/api/comment/<int:comment_id>', methods=['DELETE'])
+@app.route('/api/comment/regenerate', methods=['POST'])
 @jwt_required()
-def delete_comment(comment_id):
+def regenerate_comments():
     """
-    删除评语
+    重新生成降级模式下的模板评语（服务商恢复后调用）
 
-    请求方法: DELETE
-    请求地址: /api/comment/<comment_id>
+    请求方法: POST
+    请求地址: /api/comment/regenerate
     请求头: Authorization: Bearer <token>
+    请求体: {
+        "comment_ids": [评语ID, ...]（可选，默认为所有待重新生成的评语，一次最多 BATCH_MAX_SIZE 条）,
+        "ai_model": "AI模型名称（可选，默认deepseek）"
+    }
 
     返回: {
         "success": true/false,
-        "message": "提示信息"
+        "results": [
+            {"comment_id": ..., "success": true, "comment": ..., "ai_model": ...}
+            或 {"comment_id": ..., "success": false, "message": "失败原因"}
+        ],
+        "succeeded": 成功数量,
+        "failed": 失败数量,
+        "remaining": 是否还有待重新生成的评语
     }
+    服务商仍然失败的评语保持原样，不会再次降级成模板评语。
     """
     try:
         # 从 token 中获取用户ID（转换为整数）
         user_id = int(get_jwt_identity())
 
-        # 删除评语
-        success = Comment.delete(comment_id, user_id)
+        data = request.get_json(silent=True) or {}
+        comment_ids = data.get('comment_ids')
+        ai_model = data.get('ai_model', 'deepseek')
 
-        if success:
+        if comment_ids is not None and not isinstance(comment_ids, list):
             return jsonify({
-                'success': True,
-                'message': '删除成功'
-            }), 200
-        else:
+                'success': False,
+                'message': 'comment_ids 必须是评语ID列表'
+            }), 400
+
+        batch_size = app.config['BATCH_MAX_SIZE']
+        try:
+            pending = Comment.get_needing_regeneration(user_id, comment_ids, limit=batch_size + 1)
+        except (TypeError, ValueError):
             return jsonify({
                 'success': False,
-                'message': '评语不存在或无权删除'
-            }), 404
+                'message': 'comment_ids 必须是评语ID列表'
+            }), 400
+        remaining = len(pending) > batch_size
+        pending = pending[:batch_size]
+
+        try:
+            generated = generate_comments(ai_model, pending, cache=generation_cache, hedge=True)
+        except ValueError as e:
+            # API Key 未配置
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+
+        results = []
+        succeeded = []
+        for comment, outcome in zip(pending, generated):
+            if 'comment' in outcome:
+                succeeded.append({
+                    'id': comment['id'],
+                    'generated_comment': outcome['comment'],
+                    'ai_model': outcome['provider'],
+                    'usage': outcome['usage']
+                })
+            else:
+                results.append({
+                    'comment_id': comment['id'],
+                    'success': False,
+                    'message': f"AI 生成失败: {outcome['error']}"
+                })
+
+        updated = set(Comment.regenerate_many(user_id, succeeded)) if succeeded else set()
+        for comment in succeeded:
+            if comment['id'] in updated:
+                results.append({
+                    'comment_id': comment['id'],
+                    'success': True,
+                    'comment': comment['generated_comment'],
+                    'ai_model': comment['ai_model']
+                })
+        results.sort(key=lambda result: result['comment_id'])
+
+        return jsonify({
+            'success': True,
+            'results': results,
+            'succeeded': len(updated),
+            'failed': len(results) - len(updated),
+            'remaining': remaining
+        }), 200
 
     except Exception as e:
         return jsonify({
@@ -387,15 +967,726 @@ def delete_comment(comment_id):
         }), 500
 
 
-# ===== 错误处理 =====
+@app.route('/api/comment/history', methods=['GET'])
+@jwt_required()
+def get_comment_history():
+    """
+    获取评语历史记录（键集分页，流式输出）
 
-@app.errorhandler(404)
-def not_found(error):
-    """处理 404 错误"""
-    return jsonify({
-        'success': False,
-        'message': '接口不存在'
-    }), 404
+    请求方法: GET
+    请求地址: /api/comment/history?limit=20&before_ts=...&before_id=...
+    请求头: Authorization: Bearer <token>
+
+    参数:
+        limit: 每页数量，最大不超过 HISTORY_MAX_LIMIT
+        before_ts / before_id: 上一页返回的 next_cursor，第一页不传（必须同时提供，否则返回 400）
+
+    返回: {
+        "success": true/false,
+        "comments": [评语列表],
+        "next_cursor": {"before_ts": ..., "before_id": ...}（没有更多时为 null）
+    }
+    """
+    try:
+        # 从 token 中获取用户ID（转换为整数）
+        user_id = int(get_jwt_identity())
+
+        # 获取查询参数（页大小限制在服务端上限以内）
+        limit = request.args.get('limit', 20, type=int)
+        limit = max(1, min(limit, app.config['HISTORY_MAX_LIMIT']))
+        before_ts = request.args.get('before_ts') or None
+        before_id = request.args.get('before_id') or None
+        # 只有一半或格式不对的游标不能当作第一页处理，否则一直跟随 next_cursor 的客户端会无限循环
+        if (before_ts is None) != (before_id is None) or (before_id is not None and not before_id.isdigit()):
+            return jsonify({
+                'success': False,
+                'message': '分页游标无效：before_ts 和 before_id 必须同时提供，before_id 为整数'
+            }), 400
+        before_id = int(before_id) if before_id is not None else None
+
+        # 多取一条，用来判断是否还有下一页
+        rows = Comment.iter_by_user(user_id, limit + 1, before_ts, before_id)
+        # 在返回响应之前执行查询并取出第一条：数据库出错时还能返回 500，
+        # 而不是在已经发出 200 之后中断响应
+        try:
+            first = next(rows, None)
+        except Exception:
+            rows.close()
+            raise
+
+        def generate():
+            """边读边序列化，不在内存中拼出整个列表"""
+            try:
+                yield '{"success": true, "comments": ['
+                last = None
+                count = 0
+                next_cursor = None
+                for row in chain([first], rows) if first is not None else ():
+                    if count == limit:
+                        next_cursor = {
+                            'before_ts': last['created_at'],
+                            'before_id': last['id']
+                        }
+                        break
+                    yield (',' if count else '') + app.json.dumps(row)
+                    last = row
+                    count += 1
+                yield '], "next_cursor": ' + app.json.dumps(next_cursor) + '}'
+            finally:
+                rows.close()
+
+        return Response(
+            stream_with_context(generate()),
+            status=200,
+            mimetype='application/json'
+        )
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/comment/search', methods=['GET'])
+@jwt_required()
+def search_comments():
+    """
+    全文检索评语历史（学生姓名、学生信息、评语正文）
+
+    请求方法: GET
+    请求地址: /api/comment/search?q=开朗 数学&limit=20&offset=0
+    请求头: Authorization: Bearer <token>
+
+    参数:
+        q: 检索词，空白分隔多个词，全部命中才返回
+        limit: 每页数量，最大不超过 HISTORY_MAX_LIMIT
+        offset: 上一页返回的 next_offset，第一页不传
+
+    返回: {
+        "success": true/false,
+        "comments": [评语列表，按相关度排序，每条带 "score" 和 "highlights"],
+        "next_offset": 下一页的 offset（没有更多时为 null）
+    }
+    限制: 少于 3 个字符的词（如两个字的姓名）无法走全文索引。和长词一起检索时只在长词命中的评语中过滤；
+    只有短词时只查找最近的 SEARCH_SHORT_TERM_SCAN_LIMIT 条评语（按时间倒序，score 为 null），
+    更早的评语需要加上更长的检索词才能找到。
+    """
+    try:
+        user_id = int(get_jwt_identity())
+
+        text = (request.args.get('q') or '').strip()
+        if not text:
+            return jsonify({
+                'success': False,
+                'message': '请输入检索词'
+            }), 400
+        if len(text) > app.config['SEARCH_MAX_QUERY_LENGTH']:
+            return jsonify({
+                'success': False,
+                'message': f"检索词不能超过 {app.config['SEARCH_MAX_QUERY_LENGTH']} 个字符"
+            }), 400
+
+        limit = request.args.get('limit', 20, type=int)
+        limit = max(1, min(limit, app.config['HISTORY_MAX_LIMIT']))
+        offset = max(0, request.args.get('offset', 0, type=int))
+
+        comments, has_more = Comment.search(user_id, text, limit, offset,
+                                            short_scan_limit=app.config['SEARCH_SHORT_TERM_SCAN_LIMIT'])
+        return jsonify({
+            'success': True,
+            'comments': comments,
+            'next_offset': offset + len(comments) if has_more else None
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/comment/export', methods=['GET'])
+@jwt_required()
+def export_comments():
+    """
+    导出全部评语（流式下载）
+
+    请求方法: GET
+    请求地址: /api/comment/export?format=xlsx&group_by=class&class_name=三年级二班
+    请求头: Authorization: Bearer <token>
+
+    参数:
+        format: csv / xlsx / docx（默认 xlsx）
+        group_by: 为 class 时按班级分组（XLSX 每个班级一个工作表，DOCX 每个班级从新的一页开始，
+                  CSV 按班级排序）
+        class_name: 只导出该班级（可选）
+
+    返回: 文件下载（分块传输，边读数据库边发送）
+    """
+    try:
+        user_id = int(get_jwt_identity())
+
+        file_format = request.args.get('format', 'xlsx').lower()
+        if file_format not in EXPORT_CONTENT_TYPES:
+            return jsonify({
+                'success': False,
+                'message': f"不支持的导出格式: {file_format}（可选: {', '.join(EXPORT_CONTENT_TYPES)}）"
+            }), 400
+        group_by_class = request.args.get('group_by') == 'class'
+        class_name = request_class_name(request.args)
+
+        rows = Comment.iter_for_export(user_id, group_by_class, class_name)
+        chunks = export_comment_rows(file_format, rows, group_by_class)
+
+        def generate():
+            try:
+                yield from chunks
+            finally:
+                rows.close()
+
+        filename = f"comments-{time.strftime('%Y%m%d')}.{file_format}"
+        return Response(
+            stream_with_context(generate()),
+            status=200,
+            mimetype=EXPORT_CONTENT_TYPES[file_format],
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/comment/<int:comment_id>', methods=['DELETE'])
+@jwt_required()
+def delete_comment(comment_id):
+    """
+    删除评语
+
+    请求方法: DELETE
+    请求地址: /api/comment/<comment_id>
+    请求头: Authorization: Bearer <token>
+
+    返回: {
+        "success": true/false,
+        "message": "提示信息"
+    }
+    """
+    try:
+        # 从 token 中获取用户ID（转换为整数）
+        user_id = int(get_jwt_identity())
+
+        # 删除评语
+        success = Comment.delete(comment_id, user_id)
+
+        if success:
+            return jsonify({
+                'success': True,
+                'message': '删除成功'
+            }), 200
+        else:
+            return jsonify({
+                'success': False,
+                'message': '评语不存在或无权删除'
+            }), 404
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/roster/import', methods=['POST'])
+@jwt_required()
+def import_roster():
+    """
+    导入学生名单（CSV / XLSX）
+
+    请求方法: POST
+    请求地址: /api/roster/import
+    请求头: Authorization: Bearer <token>
+    请求体: multipart/form-data
+        file: 名单文件（.csv 或 .xlsx，第一行可以是表头：姓名、学生信息、班级；
+              没有"学生信息"列时其余各列拼成学生信息）
+        name: 名单名称（可选，默认为文件名）
+        class_name: 班级（可选，名单中没有班级列时使用）
+
+    返回（状态码 201）: {
+        "success": true,
+        "roster_id": 名单ID,
+        "imported": 导入人数,
+        "duplicates": 重复的行数（姓名和信息完全相同，只保留一条）,
+        "invalid": 不合格的行数,
+        "errors": [{"row": 行号, "message": "原因"}, ...]（最多 50 条）
+    }
+    文件逐行读取、每 500 行提交一次，不会把整个文件读进内存，也不会在读取时长时间占用数据库写锁；
+    导入完成前名单不会出现在列表中，读取出错时已写入的部分会被删除。
+    """
+    def too_large():
+        return jsonify({
+            'success': False,
+            'message': f"文件不能超过 {app.config['ROSTER_MAX_UPLOAD_MB']:g} MB"
+        }), 413
+
+    try:
+        user_id = int(get_jwt_identity())
+
+        max_bytes = app.config['ROSTER_MAX_UPLOAD_MB'] * 1024 * 1024
+        if request.content_length is not None and request.content_length > max_bytes:
+            return too_large()
+
+        try:
+            upload = request.files.get('file')
+        except RequestEntityTooLarge:
+            # 分块上传，读取时超过 MAX_CONTENT_LENGTH
+            return too_large()
+        if upload is None or not upload.filename:
+            return jsonify({
+                'success': False,
+                'message': '请上传名单文件'
+            }), 400
+
+        name = (request.form.get('name') or os.path.splitext(upload.filename)[0]).strip()[:100] or '学生名单'
+        class_name = request_class_name(request.form)
+
+        try:
+            reader = RosterReader(upload.filename, upload.stream, max_rows=app.config['ROSTER_MAX_ROWS'],
+                                  max_class_length=app.config['CLASS_NAME_MAX_LENGTH'])
+            roster_id, imported, duplicates = Roster.create(user_id, name, reader, class_name)
+        except RosterFormatError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+
+        if roster_id is None:
+            return jsonify({
+                'success': False,
+                'message': '名单中没有可以导入的学生',
+                'invalid': reader.invalid,
+                'errors': reader.errors
+            }), 400
+
+        return jsonify({
+            'success': True,
+            'roster_id': roster_id,
+            'imported': imported,
+            'duplicates': duplicates,
+            'invalid': reader.invalid,
+            'errors': reader.errors
+        }), 201
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/roster', methods=['GET'])
+@jwt_required()
+def list_rosters():
+    """
+    获取名单列表
+
+    请求方法: GET
+    请求地址: /api/roster
+    请求头: Authorization: Bearer <token>
+
+    返回: {
+        "success": true/false,
+        "rosters": [{"id", "name", "class_name", "student_count", "generated", "created_at"}, ...]
+    }
+    """
+    try:
+        user_id = int(get_jwt_identity())
+        return jsonify({
+            'success': True,
+            'rosters': Roster.list_by_user(user_id)
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/roster/<int:roster_id>', methods=['GET'])
+@jwt_required()
+def get_roster(roster_id):
+    """
+    获取名单中的学生（键集分页）
+
+    请求方法: GET
+    请求地址: /api/roster/<roster_id>?limit=100&after_id=...
+    请求头: Authorization: Bearer <token>
+
+    返回: {
+        "success": true/false,
+        "roster": {"id", "name", "class_name", "student_count", "created_at"},
+        "students": [{"id", "student_name", "student_info", "class_name", "comment_id"}, ...],
+        "next_after_id": 下一页的 after_id（没有更多时为 null）
+    }
+    """
+    try:
+        user_id = int(get_jwt_identity())
+
+        roster = Roster.get(roster_id, user_id)
+        if roster is None:
+            return jsonify({
+                'success': False,
+                'message': '名单不存在'
+            }), 404
+
+        limit = request.args.get('limit', 100, type=int)
+        limit = max(1, min(limit, app.config['HISTORY_MAX_LIMIT']))
+        after_id = request.args.get('after_id', type=int)
+
+        # 多取一条，用来判断是否还有下一页
+        students = Roster.get_students(roster_id, limit + 1, after_id)
+        next_after_id = students[limit - 1]['id'] if len(students) > limit else None
+
+        return jsonify({
+            'success': True,
+            'roster': roster,
+            'students': students[:limit],
+            'next_after_id': next_after_id
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/roster/<int:roster_id>', methods=['DELETE'])
+@jwt_required()
+def delete_roster(roster_id):
+    """
+    删除名单（已经生成的评语保留）
+
+    请求方法: DELETE
+    请求地址: /api/roster/<roster_id>
+    请求头: Authorization: Bearer <token>
+    """
+    try:
+        user_id = int(get_jwt_identity())
+
+        if Roster.delete(roster_id, user_id):
+            return jsonify({
+                'success': True,
+                'message': '删除成功'
+            }), 200
+        else:
+            return jsonify({
+                'success': False,
+                'message': '名单不存在或无权删除'
+            }), 404
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/roster/<int:roster_id>/generate', methods=['POST'])
+@jwt_required()
+def generate_roster_comments(roster_id):
+    """
+    为名单中还没有评语的学生批量生成评语（每次最多 BATCH_MAX_SIZE 名，按导入顺序）
+
+    请求方法: POST
+    请求地址: /api/roster/<roster_id>/generate
+    请求头: Authorization: Bearer <token>
+    请求体: {
+        "ai_model": "AI模型名称（可选，默认deepseek）",
+        "force_fresh": true/false（可选，为 true 时跳过缓存重新生成）
+    }
+
+    返回: {
+        "success": true/false,
+        "results": [与 /api/comment/batch 相同],
+        "succeeded": 成功数量,
+        "failed": 失败数量,
+        "remaining": 是否还有没有生成评语的学生（为 true 时再次调用继续生成）
+    }
+    失败的学生下次调用时重新生成；评语按学生的班级保存，可以按班级导出。
+    """
+    try:
+        user_id = int(get_jwt_identity())
+
+        data = request.get_json(silent=True) or {}
+        ai_model = data.get('ai_model', 'deepseek')
+        force_fresh = bool(data.get('force_fresh'))
+
+        roster = Roster.get(roster_id, user_id)
+        if roster is None:
+            return jsonify({
+                'success': False,
+                'message': '名单不存在'
+            }), 404
+
+        batch_size = app.config['BATCH_MAX_SIZE']
+        pending = Roster.get_pending(roster_id, limit=batch_size + 1)
+        remaining = len(pending) > batch_size
+        pending = pending[:batch_size]
+
+        try:
+            generated = generate_comments(
+                ai_model,
+                pending,
+                cache=generation_cache,
+                force_fresh=force_fresh,
+                hedge=True,
+                fallback=True
+            )
+        except ValueError as e:
+            # API Key 未配置
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+
+        results = []
+        succeeded = []
+        for student, outcome in zip(pending, generated):
+            result = {'student_name': student['student_name']}
+            results.append(result)
+            if 'comment' in outcome:
+                succeeded.append((student['id'], result, {
+                    'student_name': student['student_name'],
+                    'student_info': student['student_info'],
+                    'class_name': student['class_name'],
+                    'generated_comment': outcome['comment'],
+                    'ai_model': outcome['provider'],
+                    'usage': outcome['usage'],
+                    'needs_regeneration': outcome['fallback']
+                }))
+            else:
+                result['success'] = False
+                result['message'] = f"AI 生成失败: {outcome['error']}"
+
+        # 成功的评语在一个事务中保存，再记到名单上
+        comments = [comment for _, _, comment in succeeded]
+        comment_ids = Comment.create_many(user_id, comments, ai_model) if comments else []
+        Roster.mark_generated(roster_id, [(student_id, comment_id) for (student_id, _, _), comment_id
+                                          in zip(succeeded, comment_ids)])
+        for (_, result, comment), comment_id in zip(succeeded, comment_ids):
+            result['success'] = True
+            result['comment'] = comment['generated_comment']
+            result['comment_id'] = comment_id
+            result['needs_regeneration'] = comment['needs_regeneration']
+
+        return jsonify({
+            'success': True,
+            'results': results,
+            'succeeded': len(comment_ids),
+            'failed': len(results) - len(comment_ids),
+            'remaining': remaining
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@app.route('/api/comment/cache/stats', methods=['GET'])
+@jwt_required()
+def get_cache_stats():
+    """
+    查看评语生成缓存的命中情况
+
+    请求方法: GET
+    请求地址: /api/comment/cache/stats
+    请求头: Authorization: Bearer <token>
+
+    返回: {
+        "success": true,
+        "stats": {"hits": ..., "misses": ..., "hit_rate": ..., ...},
+        "user_cache": 用户信息缓存的命中情况（本进程）
+    }
+    """
+    return jsonify({
+        'success': True,
+        'stats': generation_cache.stats(),
+        'user_cache': User.cache_stats()
+    }), 200
+
+
+@app.route('/api/ai/status', methods=['GET'])
+@jwt_required()
+def get_ai_status():
+    """
+    查看 AI 服务商状态
+
+    请求方法: GET
+    请求地址: /api/ai/status
+    请求头: Authorization: Bearer <token>
+
+    返回: {
+        "success": true,
+        "providers": {服务商: 熔断状态、EWMA 耗时和错误率},
+        "rate_limits": {服务商: 排队次数、排队等待时间、排队超时次数、当前并发数},
+        "usage": {服务商: 累计输入/输出 token 数、命中前缀缓存的输入 token 数}
+    }
+    """
+    return jsonify({
+        'success': True,
+        'providers': provider_health.snapshot(),
+        'rate_limits': get_rate_limit_stats(),
+        'usage': usage_stats.snapshot()
+    }), 200
+
+
+def parse_usage_days():
+    """读取用量统计的 days 参数（默认 30 天，限制在 1 到 USAGE_MAX_DAYS 之间）"""
+    days = request.args.get('days', 30, type=int)
+    return max(1, min(days, app.config['USAGE_MAX_DAYS']))
+
+
+@app.route('/api/usage', methods=['GET'])
+@jwt_required()
+def get_my_usage():
+    """
+    查看当前用户的 token 用量和生成耗时
+
+    请求方法: GET
+    请求地址: /api/usage?days=30
+    请求头: Authorization: Bearer <token>
+
+    返回: {
+        "success": true,
+        "days": 统计天数,
+        "by_provider": [{"key": 服务商, "comments", "prompt_tokens", "completion_tokens",
+                         "cached_tokens", "retries", "avg_latency_ms", "max_latency_ms"}, ...],
+        "by_day": [{"key": "YYYY-MM-DD", ...}, ...]
+    }
+    """
+    user_id = int(get_jwt_identity())
+    days = parse_usage_days()
+    return jsonify({
+        'success': True,
+        'days': days,
+        'by_provider': Comment.usage_summary('provider', user_id, days),
+        'by_day': Comment.usage_summary('day', user_id, days)
+    }), 200
+
+
+def check_metrics_token():
+    """
+    校验运维接口的访问令牌（请求头 Authorization: Bearer <METRICS_TOKEN>）
+
+    未配置 METRICS_TOKEN 时运维接口关闭（返回 403）：指标中包含路由、服务商和错误信息，
+    用量统计包含其他用户的数据，不能默认公开
+
+    返回:
+        校验不通过时返回错误响应，通过时返回 None
+    """
+    token = app.config['METRICS_TOKEN']
+    if not token:
+        return jsonify({
+            'success': False,
+            'message': '未配置 METRICS_TOKEN，接口不可用'
+        }), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({
+            'success': False,
+            'message': '无权访问'
+        }), 401
+    return None
+
+
+@app.route('/api/usage/stats', methods=['GET'])
+def get_usage_stats():
+    """
+    查看全站的 token 用量和生成耗时（用于分析成本和延迟来源，运维接口）
+
+    请求方法: GET
+    请求地址: /api/usage/stats?group_by=provider&days=30
+    请求头: Authorization: Bearer <METRICS_TOKEN>（未配置 METRICS_TOKEN 时接口关闭，返回 403；
+            结果包含所有用户的数据，不接受用户登录 token）
+    参数:
+        group_by: user / provider / day（默认 provider）
+        days: 统计最近多少天（默认 30）
+
+    返回: {
+        "success": true,
+        "group_by": 分组方式,
+        "days": 统计天数,
+        "results": [{"key": 分组值, "comments", "prompt_tokens", ...}, ...]
+    }
+    """
+    error = check_metrics_token()
+    if error is not None:
+        return error
+
+    group_by = request.args.get('group_by', 'provider')
+    days = parse_usage_days()
+    try:
+        results = Comment.usage_summary(group_by, days=days)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+
+    return jsonify({
+        'success': True,
+        'group_by': group_by,
+        'days': days,
+        'results': results
+    }), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus 监控指标
+
+    请求方法: GET
+    请求地址: /metrics
+    请求头: Authorization: Bearer <METRICS_TOKEN>（未配置 METRICS_TOKEN 时接口关闭，返回 403）
+
+    返回: Prometheus 文本格式，包括
+        http_request_duration_seconds: 按路由、状态码的请求耗时
+        ai_provider_request_duration_seconds / ai_provider_errors_total: 服务商调用耗时和失败次数
+        ai_generations_in_flight: 正在进行的 AI 生成数
+        sqlite_query_duration_seconds: SQLite 语句耗时
+    """
+    error = check_metrics_token()
+    if error is not None:
+        return error
+
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+# ===== 错误处理 =====
+
+@app.errorhandler(404)
+def not_found(error):
+    """处理 404 错误"""
+    return jsonify({
+        'success': False,
+        'message': '接口不存在'
+    }), 404
+
+
+@app.errorhandler(413)
+def request_too_large(error):
+    """处理 413 错误（请求体超过 MAX_CONTENT_LENGTH）"""
+    return jsonify({
+        'success': False,
+        'message': '请求内容过大'
+    }), 413
 
 
 @app.errorhandler(500)
@@ -0,0 +1,64 @@
+"""
+Gunicorn 生产环境配置
+启动: gunicorn -c gunicorn.conf.py wsgi:app
+
+默认使用 gevent 协程 worker：等待 AI 服务商返回的几秒到几十秒里只占用一个协程，
+每个 worker 进程可以同时挂起上千个请求，登录、历史记录等短请求不会被长请求堵住。
+SQLite 和 bcrypt 在 C 代码中的阻塞由 utils/cooperative.py 交给原生线程执行，不会卡住事件循环。
+调优说明见 RAILWAY_DEPLOYMENT.md 的“生产环境启动与 worker 调优”。
+"""
+
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+# 先加载 .env，下面的默认值不覆盖其中已配置的项
+load_dotenv()
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+
+if worker_class == 'gevent':
+    # preload_app 会在 master 进程中导入应用，必须在导入任何网络、线程相关模块之前打补丁
+    from gevent import monkey
+    monkey.patch_all()
+
+    # 协程模式下单个进程能承受的并发远高于线程模式，放宽每个服务商的并发上限（连接池随之放大）
+    # （环境变量和 .env 中已设置的值优先）
+    gevent_defaults = {'AI_MAX_INFLIGHT': 256, 'AI_MAX_CONCURRENCY': 64}
+    for name, default in gevent_defaults.items():
+        value = os.environ.setdefault(name, str(default))
+        # 从旧版 .env.example 复制来的 16 / 8 会让 gevent 的并发优势失效，提醒一下
+        if 0 < int(value) < default // 4:
+            print(f"[WARN] gevent worker 下 {name}={value} 偏小（默认 {default}），"
+                  f"每个服务商最多只有 {value} 个请求同时进行；如非有意限制，请从环境变量或 .env 中删除",
+                  flush=True)
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# 进程数：协程 worker 只需要按 CPU 核数开（bcrypt 和 JSON 处理占 CPU），默认 2
+workers = int(os.getenv('WEB_CONCURRENCY', min(2, multiprocessing.cpu_count())))
+
+# 每个 gevent worker 同时处理的最大连接数
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# 同步/线程 worker 时每个进程的线程数（gevent 模式下不使用）
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+
+# 在 master 中导入应用（执行数据库迁移）后再 fork，worker 启动更快、共享只读内存；
+# 连接池、HTTP 客户端和后台线程都按进程号在子进程中重新创建
+preload_app = True
+
+# 流式生成可能持续较长时间；gevent worker 的心跳不受请求阻塞影响
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# 定期重启 worker，避免长时间运行的内存增长（加随机抖动，不会同时重启）
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+# 访问日志（设为空字符串关闭）
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
@@ -0,0 +1,173 @@
+"""
+后台评语生成任务
+从 generation_jobs 队列中领取任务，调用 AI 生成评语并保存结果
+"""
+
+import os
+import random
+import threading
+import time
+
+from models import GenerationJob
+from utils.ai_client import fallback_enabled, fallback_reason, get_ai_client, template_client
+from utils.metrics import ai_fallback_generations
+
+
+class JobWorkerPool:
+    """后台工作线程池"""
+
+    def __init__(self, num_workers=None, poll_interval=None, lease_seconds=None,
+                 retry_base_delay=None, cache=None):
+        """
+        参数:
+            num_workers: 工作线程数（默认读取 JOB_WORKERS）
+            poll_interval: 队列为空时的轮询间隔（秒）
+            lease_seconds: 任务租约时长（秒），执行期间每 1/3 租约续约一次；
+                           进程退出后不再续约，租约过期即视为执行中断，可被重新领取
+            retry_base_delay: 重试退避的基础时长（秒），第 n 次失败后等待 base * 2^(n-1)
+            cache: 生成缓存（GenerationCache，可选）
+        """
+        self.num_workers = num_workers if num_workers is not None else int(os.getenv('JOB_WORKERS', 2))
+        self.poll_interval = poll_interval or float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+        self.lease_seconds = lease_seconds or float(os.getenv('JOB_LEASE_SECONDS', 120))
+        self.retry_base_delay = retry_base_delay or float(os.getenv('JOB_RETRY_BASE_DELAY', 2.0))
+        self.cache = cache
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        # 正在执行的任务（任务ID -> 任务字典），由续约线程定期续约
+        self._running = {}
+        self._running_lock = threading.Lock()
+
+    def ensure_started(self):
+        """
+        确保当前进程中的工作线程都在运行
+
+        fork 出来的子进程不会继承父进程的线程，所以按进程号判断；
+        同一进程中意外退出的线程也会在这里重新启动。
+        """
+        if self.num_workers <= 0:
+            return
+        if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._stop.clear()
+                self._threads = []
+            elif all(thread.is_alive() for thread in self._threads):
+                return
+
+            targets = [(self._run, f'job-worker-{i}') for i in range(self.num_workers)]
+            targets.append((self._heartbeat, 'job-lease-renewer'))
+            alive = {thread.name: thread for thread in self._threads if thread.is_alive()}
+            started = 0
+            for target, name in targets:
+                if name in alive:
+                    continue
+                alive[name] = threading.Thread(target=target, name=name, daemon=True)
+                alive[name].start()
+                started += 1
+            if started and len(alive) > started:
+                print(f"[WARN] 重新启动了 {started} 个退出的评语生成线程")
+            self._threads = list(alive.values())
+            if len(alive) == started:
+                print(f"[OK] 已启动 {self.num_workers} 个评语生成工作线程")
+
+    def notify(self):
+        """有新任务时唤醒等待中的工作线程"""
+        self._wakeup.set()
+
+    def stop(self, timeout=5):
+        """停止所有工作线程"""
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._pid = None
+
+    def _run(self):
+        """工作线程主循环"""
+        while not self._stop.is_set():
+            try:
+                job = GenerationJob.claim(self.lease_seconds)
+            except Exception as e:
+                print(f"[WARN] 领取任务失败: {str(e)}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            with self._running_lock:
+                self._running[job['id']] = job
+            try:
+                self.process(job)
+            except Exception as e:
+                # 保存结果失败（如数据库被锁）：不让线程退出，租约过期后任务会被重新领取
+                print(f"[WARN] 执行任务 {job['id']} 失败: {str(e)}")
+                self._stop.wait(self.poll_interval)
+            finally:
+                with self._running_lock:
+                    self._running.pop(job['id'], None)
+
+    def _heartbeat(self):
+        """
+        续约线程：每 1/3 租约为正在执行的任务续约
+
+        一次尝试的耗时（排队、超时重试、对冲）没有固定上限，不能靠加长租约覆盖；
+        只要进程还在执行，任务就不会被其他工作线程重复领取。
+        """
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._running_lock:
+                jobs = list(self._running.values())
+            try:
+                GenerationJob.renew(jobs, self.lease_seconds)
+            except Exception as e:
+                print(f"[WARN] 任务续约失败: {str(e)}")
+
+    def retry_delay(self, attempts):
+        """第 attempts 次失败后的等待时间（指数退避 + 随机抖动）"""
+        delay = self.retry_base_delay * (2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def process(self, job):
+        """执行一个任务"""
+        try:
+            ai_client = get_ai_client(job['ai_model'], hedge=True)
+            if self.cache is not None:
+                result = self.cache.generate(
+                    ai_client,
+                    job['student_name'],
+                    job['student_info'],
+                    force_fresh=bool(job['force_fresh'])
+                )
+            else:
+                result = ai_client.generate(
+                    job['student_name'],
+                    job['student_info']
+                )
+        except ValueError as e:
+            # API Key 未配置，重试也没有意义
+            GenerationJob.fail(job, str(e))
+            return
+        except Exception as e:
+            if job['attempts'] < job['max_attempts']:
+                retry_at = time.time() + self.retry_delay(job['attempts'])
+                GenerationJob.fail(job, f'AI 生成失败: {str(e)}', retry_at)
+                return
+            if not fallback_enabled():
+                GenerationJob.fail(job, f'AI 生成失败: {str(e)}')
+                return
+            # 重试用尽：保存模板评语（标记为待重新生成），老师不会拿到一个失败的任务
+            print(f"[WARN] 任务 {job['id']} 重试用尽，改用模板评语: {str(e)}")
+            ai_fallback_generations.inc(job['ai_model'], fallback_reason(e))
+            result = template_client.generate(job['student_name'], job['student_info'])
+
+        GenerationJob.complete(job, result.comment, result.provider, result.accounting(),
+                               needs_regeneration=result.fallback)
@@ -0,0 +1,132 @@
+"""
+部署方式并发对比
+分别用不同方式启动后端，同时发出大量评语生成请求（AI 服务商由模拟服务代替，固定延迟），
+期间持续请求评语历史，比较生成吞吐量和短请求的响应时间。
+
+用法（在 backend 目录下）:
+    python loadtest/bench_serving.py
+    python loadtest/bench_serving.py --modes dev,gevent --requests 400 --concurrency 200 --llm-latency 2
+
+模式:
+    dev     python app.py 的开发服务器（每个请求一个线程）
+    gthread gunicorn 线程 worker（WEB_CONCURRENCY 个进程 × GUNICORN_THREADS 个线程）
+    gevent  gunicorn gevent worker（生产环境默认配置）
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import backend_env, free_port, percentile, start_server, stop_server  # noqa: E402
+from mock_llm import start_mock_llm  # noqa: E402
+
+
+def run_mode(mode: str, args, mock) -> dict:
+    """启动一种模式的后端并压测"""
+    port = free_port()
+    # 各模式使用相同的服务商并发上限，只比较服务器模型本身
+    env = backend_env(
+        mock,
+        AI_MAX_INFLIGHT=args.concurrency * 2,
+        AI_MAX_CONCURRENCY=args.concurrency,
+        AI_RATE_LIMIT_MAX_WAIT=120
+    )
+    process = start_server(mode, port, env)
+    base_url = f'http://127.0.0.1:{port}'
+
+    try:
+        requests.post(base_url + '/api/register', json={'username': 'bench', 'password': 'bench123'})
+        token = requests.post(base_url + '/api/login',
+                              json={'username': 'bench', 'password': 'bench123'}).json()['token']
+        headers = {'Authorization': f'Bearer {token}'}
+
+        generate_latencies, history_latencies = [], []
+        errors = [0]
+        done = threading.Event()
+
+        def generate(i):
+            start = time.perf_counter()
+            try:
+                response = requests.post(base_url + '/api/comment/generate', headers=headers, timeout=300, json={
+                    'student_name': f'学生{i}',
+                    'student_info': f'第 {i} 位学生，性格开朗',  # 每个请求不同，不命中缓存
+                    'ai_model': 'deepseek'
+                })
+                if response.status_code != 200:
+                    errors[0] += 1
+                    return
+            except requests.RequestException:
+                errors[0] += 1
+                return
+            generate_latencies.append(time.perf_counter() - start)
+
+        def probe_history():
+            session = requests.Session()
+            while not done.is_set():
+                start = time.perf_counter()
+                try:
+                    session.get(base_url + '/api/comment/history?limit=20', headers=headers, timeout=60)
+                    history_latencies.append(time.perf_counter() - start)
+                except requests.RequestException:
+                    pass
+                time.sleep(0.1)
+
+        prober = threading.Thread(target=probe_history, daemon=True)
+        prober.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(generate, range(args.requests)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        prober.join()
+
+        return {
+            'mode': mode,
+            'elapsed': elapsed,
+            'throughput': len(generate_latencies) / elapsed,
+            'errors': errors[0],
+            'generate_p50': percentile(generate_latencies, 50),
+            'generate_p95': percentile(generate_latencies, 95),
+            'history_p50': percentile(history_latencies, 50),
+            'history_p95': percentile(history_latencies, 95),
+            'history_max': max(history_latencies, default=0.0),
+            'history_mean': statistics.mean(history_latencies) if history_latencies else 0.0
+        }
+    finally:
+        stop_server(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='部署方式并发对比')
+    parser.add_argument('--modes', default='dev,gthread,gevent')
+    parser.add_argument('--requests', type=int, default=400, help='评语生成请求总数')
+    parser.add_argument('--concurrency', type=int, default=200, help='客户端同时发出的请求数')
+    parser.add_argument('--llm-latency', type=float, default=2.0, help='模拟服务商的延迟（秒）')
+    args = parser.parse_args()
+
+    llm = start_mock_llm(latency=args.llm_latency)
+
+    results = []
+    for mode in args.modes.split(','):
+        print(f"[TEST] {mode}: {args.requests} 个生成请求，并发 {args.concurrency}，服务商延迟 {args.llm_latency}s ...")
+        results.append(run_mode(mode.strip(), args, llm))
+
+    print()
+    print(f"{'模式':<8}{'耗时(s)':>9}{'吞吐(次/s)':>12}{'失败':>6}"
+          f"{'生成p50':>9}{'生成p95':>9}{'历史p50(ms)':>13}{'历史p95(ms)':>13}{'历史max(ms)':>13}")
+    for r in results:
+        print(f"{r['mode']:<8}{r['elapsed']:>9.1f}{r['throughput']:>12.1f}{r['errors']:>6}"
+              f"{r['generate_p50']:>9.2f}{r['generate_p95']:>9.2f}"
+              f"{r['history_p50'] * 1000:>13.1f}{r['history_p95'] * 1000:>13.1f}{r['history_max'] * 1000:>13.1f}")
+    llm.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+压测脚本共用的工具：启动后端进程、统计分位数
+"""
+
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 后端启动方式
+SERVER_MODES = ('dev', 'gthread', 'gevent')
+
+
+def free_port() -> int:
+    """找一个空闲端口"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], p: float) -> float:
+    """第 p 百分位（最近秩法，values 为空时返回 0）"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def backend_env(mock, **overrides) -> Dict[str, str]:
+    """
+    压测用的后端环境变量：临时数据库，DeepSeek 和通义千问指向模拟服务
+
+    参数:
+        mock: 模拟服务（MockLLMServer）
+        overrides: 覆盖的环境变量
+    """
+    workdir = tempfile.mkdtemp(prefix='commentgenie-load-')
+    env = dict(
+        os.environ,
+        DATABASE_PATH=os.path.join(workdir, 'load.db'),
+        DEEPSEEK_API_KEY='load-test',
+        DEEPSEEK_BASE_URL=mock.openai_url,
+        QWEN_API_KEY='load-test',
+        QWEN_BASE_URL=mock.dashscope_url,
+        FLASK_ENV='production',
+        JOB_WORKERS='0',
+        REQUEST_LOG_SLOW_MS='-1',
+        GUNICORN_ACCESS_LOG='',
+        AI_READ_TIMEOUT='120'
+    )
+    env.update({name: str(value) for name, value in overrides.items()})
+    return env
+
+
+def start_server(mode: str, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    """
+    按模式启动后端进程，等待可以访问后返回
+
+    模式:
+        dev     python app.py 的开发服务器（每个请求一个线程）
+        gthread gunicorn 线程 worker（WEB_CONCURRENCY 个进程 × GUNICORN_THREADS 个线程）
+        gevent  gunicorn gevent worker（生产环境默认配置）
+    """
+    if mode == 'dev':
+        command = [sys.executable, '-c',
+                   f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    elif mode == 'gthread':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                   '--worker-class', 'gthread', '--bind', f'127.0.0.1:{port}', 'wsgi:app']
+        env = dict(env, GUNICORN_WORKER_CLASS='gthread', GUNICORN_THREADS=env.get('GUNICORN_THREADS', '8'))
+    elif mode == 'gevent':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                   '--bind', f'127.0.0.1:{port}', 'wsgi:app']
+    else:
+        raise ValueError(f'未知模式: {mode}')
+
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            requests.get(base_url + '/', timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} 模式启动失败')
+
+
+def stop_server(process: subprocess.Popen):
+    """停止后端进程"""
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
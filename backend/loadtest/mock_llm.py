@@ -0,0 +1,240 @@
+"""
+模拟 AI 服务商
+用于压测：按设定的延迟分布返回评语，可按比例注入 5xx 错误和 429 限流，不消耗真实的 API 额度。
+
+支持两种接口格式（按请求体自动识别）:
+    OpenAI Chat Completions（DeepSeek、智谱、Kimi）: {"model", "messages", "stream"}
+    DashScope（通义千问）: {"model", "input": {"messages"}, "parameters"}
+两种格式都支持流式（SSE）和非流式响应；流式响应与真实服务商一样给出 token 用量
+（OpenAI 格式在请求带 stream_options.include_usage 时最后多发一个带 usage 的数据块，
+DashScope 格式每个事件都带累计的 usage）。
+
+单独运行:
+    python loadtest/mock_llm.py --port 9000 --latency lognormal:1.5:0.5 --error-rate 0.02 --rate-limit-rate 0.05
+然后启动后端时设置
+    DEEPSEEK_BASE_URL=http://127.0.0.1:9000/v1/chat/completions
+    QWEN_BASE_URL=http://127.0.0.1:9000/api/v1/services/aigc/text-generation/generation
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+
+MOCK_COMMENT = '该生性格开朗，学习认真，乐于助人，希望继续保持。'
+
+
+def parse_latency(spec) -> Callable[[], float]:
+    """
+    解析延迟分布
+
+    格式:
+        2                   固定 2 秒
+        fixed:2             同上
+        uniform:0.5:3       0.5 到 3 秒均匀分布
+        lognormal:1.5:0.5   对数正态分布，中位数 1.5 秒，sigma 0.5（长尾，接近真实服务商）
+        exp:1               指数分布，均值 1 秒
+
+    返回:
+        每次调用返回一个延迟（秒）的函数
+    """
+    parts = str(spec).split(':')
+    kind = parts[0]
+    try:
+        if len(parts) == 1:
+            value = float(kind)
+            return lambda: value
+        values = [float(part) for part in parts[1:]]
+    except ValueError:
+        raise ValueError(f"延迟分布格式错误: {spec}")
+
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'lognormal':
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    if kind == 'exp':
+        return lambda: random.expovariate(1 / values[0])
+    raise ValueError(f"不支持的延迟分布: {kind}")
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """按服务器配置的延迟、错误率返回评语"""
+
+    protocol_version = 'HTTP/1.1'  # 支持 keep-alive，与真实服务商一致
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            body = {}
+        dashscope = 'input' in body
+        stream = bool(body.get('stream')) or self.headers.get('X-DashScope-SSE') == 'enable'
+
+        server.count('requests')
+        roll = random.random()
+        if roll < server.rate_limit_rate:
+            server.count('rate_limited')
+            self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit'}},
+                            {'Retry-After': str(server.retry_after)})
+            return
+
+        time.sleep(max(0.0, server.latency()))
+
+        if roll < server.rate_limit_rate + server.error_rate:
+            server.count('errors')
+            self._send_json(500, {'error': {'message': 'Internal error', 'type': 'server_error'}})
+            return
+
+        server.count('succeeded')
+        if stream:
+            include_usage = bool((body.get('stream_options') or {}).get('include_usage'))
+            self._send_stream(dashscope, server.stream_chunks, include_usage)
+        else:
+            self._send_json(200, self._completion(dashscope))
+
+    def _usage(self, dashscope: bool):
+        if dashscope:
+            return {'input_tokens': 220, 'output_tokens': 48, 'prompt_tokens_details': {'cached_tokens': 192}}
+        return {'prompt_tokens': 220, 'completion_tokens': 48, 'prompt_cache_hit_tokens': 192}
+
+    def _completion(self, dashscope: bool):
+        if dashscope:
+            return {'output': {'text': MOCK_COMMENT, 'finish_reason': 'stop'}, 'usage': self._usage(True)}
+        return {
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': MOCK_COMMENT},
+                         'finish_reason': 'stop'}],
+            'usage': self._usage(False)
+        }
+
+    def _send_json(self, status: int, data, headers=None):
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_stream(self, dashscope: bool, chunks: int, include_usage: bool = False):
+        """分 chunks 段发送（DashScope 为增量输出模式），段与段之间间隔 stream_interval 秒"""
+        size = max(1, math.ceil(len(MOCK_COMMENT) / chunks))
+        pieces = [MOCK_COMMENT[i:i + size] for i in range(0, len(MOCK_COMMENT), size)]
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for index, piece in enumerate(pieces, start=1):
+            if dashscope:
+                usage = self._usage(True)
+                usage['output_tokens'] = round(usage['output_tokens'] * index / len(pieces))
+                data = {'output': {'text': piece, 'finish_reason': 'null'}, 'usage': usage}
+            else:
+                data = {'choices': [{'index': 0, 'delta': {'content': piece}}]}
+            self.wfile.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.server.stream_interval)
+        if not dashscope:
+            if include_usage:
+                data = {'choices': [], 'usage': self._usage(False)}
+                self.wfile.write(f"data: {json.dumps(data)}\n\n".encode('utf-8'))
+            self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """每个连接一个线程，监听队列加长以承受突发的大量连接"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, latency='2', error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: float = 1, stream_chunks: int = 5, stream_interval: float = 0.05):
+        """
+        参数:
+            latency: 延迟分布（格式见 parse_latency）
+            error_rate: 返回 500 的比例（在延迟之后返回）
+            rate_limit_rate: 立即返回 429 的比例
+            retry_after: 429 响应的 Retry-After（秒）
+            stream_chunks: 流式响应分几段
+            stream_interval: 流式响应每段之间的间隔（秒）
+        """
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.stream_chunks = stream_chunks
+        self.stream_interval = stream_interval
+        self._stats = {'requests': 0, 'succeeded': 0, 'errors': 0, 'rate_limited': 0}
+        self._lock = threading.Lock()
+        super().__init__(address, MockLLMHandler)
+
+    def count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    @property
+    def openai_url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}/v1/chat/completions'
+
+    @property
+    def dashscope_url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}/api/v1/services/aigc/text-generation/generation'
+
+
+def start_mock_llm(port: int = 0, latency='2', **options) -> MockLLMServer:
+    """
+    在后台线程中启动模拟服务（参数见 MockLLMServer）
+
+    返回:
+        服务器对象（server.server_port 为实际端口，server.shutdown() 停止）
+    """
+    server = MockLLMServer(('127.0.0.1', port), latency, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    """模拟服务的命令行参数（压测脚本共用）"""
+    parser.add_argument('--latency', default='lognormal:1.5:0.5',
+                        help='延迟分布：秒数、fixed:s、uniform:a:b、lognormal:中位数:sigma、exp:均值')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 500 的比例')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='返回 429 的比例')
+    parser.add_argument('--retry-after', type=float, default=1, help='429 响应的 Retry-After（秒）')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='模拟 AI 服务商')
+    parser.add_argument('--port', type=int, default=9000)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_mock_llm(args.port, args.latency, error_rate=args.error_rate,
+                            rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after)
+    print(f"[OK] 模拟服务已启动")
+    print(f"     OpenAI 兼容格式: {server.openai_url}")
+    print(f"     DashScope 格式:  {server.dashscope_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(server.stats())
@@ -0,0 +1,242 @@
+"""
+端到端压测
+启动模拟 AI 服务商和后端，多个虚拟用户按比例混合发出注册、登录、生成评语、查询历史请求，
+统计每个接口的吞吐量和 p50/p95/p99 延迟。
+
+用法（在 backend 目录下）:
+    python loadtest/run_load.py
+    python loadtest/run_load.py --mode gevent --users 100 --duration 60 \\
+        --mix register=1,login=2,generate=4,history=6 --models deepseek,qwen \\
+        --latency lognormal:1.5:0.5 --error-rate 0.02 --rate-limit-rate 0.05 --json result.json
+
+压测已经在运行的后端（不启动模拟服务和后端，后端需自行配置 <PROVIDER>_BASE_URL）:
+    python loadtest/run_load.py --base-url http://127.0.0.1:5000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import SERVER_MODES, backend_env, free_port, percentile, start_server, stop_server  # noqa: E402
+from mock_llm import add_mock_arguments, start_mock_llm  # noqa: E402
+
+OPERATIONS = ('register', 'login', 'generate', 'history')
+
+
+class Recorder:
+    """按接口记录每个请求的耗时和状态码（线程安全）"""
+
+    def __init__(self):
+        self._latencies: Dict[str, List[float]] = {}
+        self._statuses: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, status):
+        with self._lock:
+            self._latencies.setdefault(endpoint, []).append(seconds)
+            self._statuses.setdefault(endpoint, Counter())[str(status)] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Dict]:
+        """每个接口的请求数、失败数、吞吐量和延迟分位数（毫秒）"""
+        with self._lock:
+            endpoints = {name: (list(values), Counter(self._statuses[name]))
+                         for name, values in self._latencies.items()}
+        result = {}
+        for name, (values, statuses) in sorted(endpoints.items()):
+            errors = sum(count for status, count in statuses.items() if not status.startswith('2'))
+            result[name] = {
+                'requests': len(values),
+                'errors': errors,
+                'rps': round(len(values) / elapsed, 2),
+                'p50_ms': round(percentile(values, 50) * 1000, 1),
+                'p95_ms': round(percentile(values, 95) * 1000, 1),
+                'p99_ms': round(percentile(values, 99) * 1000, 1),
+                'max_ms': round(max(values) * 1000, 1),
+                'statuses': dict(statuses)
+            }
+        return result
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """解析流量比例，如 register=1,login=2,generate=4,history=6"""
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f'未知的请求类型: {name}（可选: {", ".join(OPERATIONS)}）')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class VirtualUser(threading.Thread):
+    """一个虚拟用户：先注册并登录，然后按比例随机发出请求直到压测结束"""
+
+    def __init__(self, index: int, base_url: str, args, recorder: Recorder, deadline: float, run_id: str):
+        super().__init__(name=f'vu-{index}', daemon=True)
+        self.index = index
+        self.base_url = base_url
+        self.args = args
+        self.recorder = recorder
+        self.deadline = deadline
+        self.run_id = run_id
+        self.session = requests.Session()
+        self.username = f'lt{run_id}u{index}'
+        self.password = 'load-test-pw'
+        self.token = None
+        self.registered = 0
+        self.generated = 0
+        self.operations = list(args.mix.keys())
+        self.weights = list(args.mix.values())
+
+    def call(self, endpoint: str, method: str, path: str, **kwargs):
+        """发出请求并记录耗时；网络错误记为状态 error"""
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.args.timeout, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 'error'
+        self.recorder.record(endpoint, time.perf_counter() - start, status)
+        return response
+
+    def auth_headers(self):
+        return {'Authorization': f'Bearer {self.token}'}
+
+    def register(self):
+        self.registered += 1
+        username = self.username if self.registered == 1 else f'{self.username}r{self.registered}'
+        self.call('POST /api/register', 'POST', '/api/register',
+                  json={'username': username, 'password': self.password})
+
+    def login(self):
+        response = self.call('POST /api/login', 'POST', '/api/login',
+                             json={'username': self.username, 'password': self.password})
+        if response is not None and response.status_code == 200:
+            self.token = response.json()['token']
+
+    def generate(self):
+        self.generated += 1
+        if random.random() < self.args.repeat_rate:
+            # 重复的学生信息，会命中生成缓存
+            student_info = '性格开朗，成绩优秀，积极参加班级活动'
+        else:
+            student_info = f'{self.run_id}-{self.index}-{self.generated}：性格开朗，成绩优秀'
+        self.call('POST /api/comment/generate', 'POST', '/api/comment/generate',
+                  headers=self.auth_headers(),
+                  json={
+                      'student_name': f'学生{self.generated}',
+                      'student_info': student_info,
+                      'ai_model': random.choice(self.args.models)
+                  })
+
+    def history(self):
+        self.call('GET /api/comment/history', 'GET', '/api/comment/history?limit=20',
+                  headers=self.auth_headers())
+
+    def run(self):
+        self.register()
+        self.login()
+        while time.time() < self.deadline:
+            operation = random.choices(self.operations, self.weights)[0]
+            if operation in ('generate', 'history') and self.token is None:
+                operation = 'login'
+            getattr(self, operation)()
+            if self.args.think > 0:
+                time.sleep(random.uniform(0, 2 * self.args.think))
+
+
+def print_report(summary: Dict[str, Dict], elapsed: float, mock_stats=None):
+    print()
+    print(f"压测时长 {elapsed:.1f}s，总请求 {sum(s['requests'] for s in summary.values())}")
+    print(f"{'接口':<28}{'请求数':>8}{'失败':>6}{'次/秒':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}  状态码")
+    for name, s in summary.items():
+        statuses = ' '.join(f'{status}:{count}' for status, count in sorted(s['statuses'].items()))
+        print(f"{name:<28}{s['requests']:>8}{s['errors']:>6}{s['rps']:>8.1f}"
+              f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}  {statuses}")
+    if mock_stats:
+        print(f"模拟服务商: {mock_stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端压测')
+    parser.add_argument('--mode', default='gevent', choices=SERVER_MODES, help='后端启动方式')
+    parser.add_argument('--base-url', help='压测已经在运行的后端（不启动模拟服务和后端）')
+    parser.add_argument('--users', type=int, default=50, help='虚拟用户数')
+    parser.add_argument('--duration', type=float, default=30, help='压测时长（秒）')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('register=1,login=2,generate=4,history=6'),
+                        help='各类请求的比例')
+    parser.add_argument('--models', default='deepseek,qwen', type=lambda s: s.split(','),
+                        help='生成评语时随机使用的模型（deepseek 为 OpenAI 兼容格式，qwen 为 DashScope 格式）')
+    parser.add_argument('--repeat-rate', type=float, default=0.1, help='重复学生信息（命中缓存）的比例')
+    parser.add_argument('--think', type=float, default=0.0, help='每个虚拟用户两次请求之间的平均间隔（秒）')
+    parser.add_argument('--timeout', type=float, default=120, help='单个请求超时（秒）')
+    parser.add_argument('--json', help='把结果写入 JSON 文件')
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    mock = process = None
+    if args.base_url:
+        base_url = args.base_url.rstrip('/')
+    else:
+        mock = start_mock_llm(latency=args.latency, error_rate=args.error_rate,
+                              rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after)
+        port = free_port()
+        process = start_server(args.mode, port, backend_env(mock))
+        base_url = f'http://127.0.0.1:{port}'
+
+    try:
+        print(f"[TEST] {base_url}（{args.mode if process else '外部'}）: {args.users} 个虚拟用户，"
+              f"{args.duration:g}s，比例 {args.mix}，模型 {args.models}")
+        recorder = Recorder()
+        run_id = uuid.uuid4().hex[:6]
+        start = time.time()
+        users = [VirtualUser(i, base_url, args, recorder, start + args.duration, run_id)
+                 for i in range(args.users)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.time() - start
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    summary = recorder.summary(elapsed)
+    mock_stats = mock.stats() if mock else None
+    print_report(summary, elapsed, mock_stats)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'mode': args.mode if process else 'external',
+                'users': args.users,
+                'duration': elapsed,
+                'mix': args.mix,
+                'models': args.models,
+                'mock': {
+                    'latency': args.latency,
+                    'error_rate': args.error_rate,
+                    'rate_limit_rate': args.rate_limit_rate,
+                    'stats': mock_stats
+                },
+                'endpoints': summary
+            }, f, ensure_ascii=False, indent=2)
+        print(f"[OK] 结果已写入 {args.json}")
+
+    if mock is not None:
+        mock.shutdown()
+
+
+if __name__ == '__main__':
+    main()
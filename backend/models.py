@@ -4,64 +4,404 @@
 """
 
 import sqlite3
-import bcrypt
 from datetime import datetime
+from concurrent.futures import Future
+from contextlib import contextmanager
 import os
+import queue
+import threading
+import time
+
+from utils.lru_cache import LRUCache
+from utils.cooperative import connection_factory
+from utils.metrics import comment_write_group_size, user_cache_lookups
+from utils.passwords import PasswordHasherBusy, password_hasher
+from utils.search import Highlighter, like_pattern, parse_query
 
 
 class Database:
-    """数据库管理类"""
+    """
+    数据库管理类
+
+    内部维护一个连接池：每个连接只在创建时设置一次 PRAGMA，
+    用完后归还复用，避免每次查询都重新 connect/close。
+    在 Flask 请求中，同一线程第一次用到的连接会绑定到该请求，
+    请求结束时（teardown）统一归还。
+    """
 
-    def __init__(self, db_path='database.db'):
+    def __init__(self, db_path=None, pool_size=None):
         """
         初始化数据库连接
 
         参数:
-            db_path: 数据库文件路径
+            db_path: 数据库文件路径（默认读取环境变量 DATABASE_PATH）
+            pool_size: 连接池最多保留的空闲连接数（默认读取 DB_POOL_SIZE）
         """
-        self.db_path = db_path
-        self.init_database()
+        self.db_path = db_path or os.getenv('DATABASE_PATH', 'database.db')
+        self.pool_size = pool_size or int(os.getenv('DB_POOL_SIZE', 8))
+        self.busy_timeout = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+        self.cache_size_kb = int(os.getenv('DB_CACHE_SIZE_KB', 8192))
+
+        self._pool = queue.LifoQueue(maxsize=self.pool_size)
+        self._pid = os.getpid()
+        self._local = threading.local()
 
     def get_connection(self):
-        """获取数据库连接"""
-        conn = sqlite3.connect(self.db_path)
+        """创建一个新的数据库连接（已设置好 PRAGMA）"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,  # 连接会在线程间复用，但同一时刻只被一个线程持有
+            # 记录每条语句的耗时（/metrics）；gevent 下语句在原生线程中执行，不卡住其他协程
+            factory=connection_factory()
+        )
         # 让查询结果以字典形式返回，方便使用
         conn.row_factory = sqlite3.Row
+
+        # 每个连接只设置一次
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA busy_timeout={self.busy_timeout}')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{self.cache_size_kb}')  # 负数表示 KB
         return conn
 
-    def init_database(self):
-        """初始化数据库表结构"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def _reset_after_fork(self):
+        """进程 fork 之后，父进程的连接不能继续使用，重新建池"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pool = queue.LifoQueue(maxsize=self.pool_size)
+            self._local = threading.local()
 
-        # 创建用户表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                email TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # 创建评语表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS comments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                student_name TEXT NOT NULL,
-                student_info TEXT,
-                generated_comment TEXT NOT NULL,
-                ai_model TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
+    def checkout(self):
+        """从连接池取出一个连接，池为空时新建"""
+        self._reset_after_fork()
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self.get_connection()
+
+    def checkin(self, conn):
+        """把连接归还到连接池，池满或连接异常时直接关闭"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        获取一个连接（上下文管理器）
+
+        用法:
+            with db.connection() as conn:
+                conn.execute(...)
+
+        出现异常时会回滚未提交的事务。
+        """
+        self._reset_after_fork()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # 当前请求已经绑定了连接，直接复用
+            try:
+                yield conn
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            return
+
+        conn = self.checkout()
+        if getattr(self._local, 'scoped', False):
+            # 在请求作用域内：绑定到当前线程，请求结束时归还
+            self._local.conn = conn
+            try:
+                yield conn
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            return
+
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def begin_request(self):
+        """请求开始：之后本线程取到的连接在请求期间保持绑定"""
+        self._reset_after_fork()
+        self._local.scoped = True
+
+    def end_request(self):
+        """请求结束：归还本线程绑定的连接"""
+        self._local.scoped = False
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            self.checkin(conn)
+
+    def close_all(self):
+        """关闭连接池中所有空闲连接"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def get_schema_version(self):
+        """读取当前数据库结构版本（PRAGMA user_version）"""
+        with self.connection() as conn:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def migrate(self):
+        """
+        执行尚未应用的数据库迁移
+
+        每个迁移在一个 BEGIN IMMEDIATE 事务中执行，并把版本号写入
+        PRAGMA user_version；多个进程同时启动时只有一个会真正执行。
+
+        返回:
+            迁移后的版本号
+        """
+        with self.connection() as conn:
+            current = conn.execute('PRAGMA user_version').fetchone()[0]
+            for version, description, statements in MIGRATIONS:
+                if version <= current:
+                    continue
+
+                conn.execute('BEGIN IMMEDIATE')
+                # 拿到写锁后重新读取，可能已被其他进程迁移
+                current = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version <= current:
+                    conn.rollback()
+                    continue
+
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {version}')
+                conn.commit()
+                current = version
+                print(f"[OK] 数据库迁移到版本 {version}: {description}")
+
+            return current
+
+
+# 数据库迁移列表：(版本号, 说明, SQL 语句列表)
+# 只能在末尾追加新版本，已发布的迁移不要修改
+MIGRATIONS = [
+    (1, '创建用户表和评语表', [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            email TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            student_name TEXT NOT NULL,
+            student_info TEXT,
+            generated_comment TEXT NOT NULL,
+            ai_model TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+    ]),
+    (2, '评语历史按用户和时间倒序的索引', [
+        # get_by_user 按 user_id 过滤、按 created_at 倒序，id 用于同一秒内的稳定排序
+        '''
+        CREATE INDEX IF NOT EXISTS idx_comments_user_created
+        ON comments (user_id, created_at DESC, id DESC)
+        ''',
+    ]),
+    (3, '评语生成任务队列', [
+        '''
+        CREATE TABLE IF NOT EXISTS generation_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            student_name TEXT NOT NULL,
+            student_info TEXT,
+            ai_model TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            next_run_at REAL NOT NULL,
+            locked_until REAL,
+            comment_id INTEGER,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        # 工作线程按状态和可执行时间取任务
+        '''
+        CREATE INDEX IF NOT EXISTS idx_jobs_status_next_run
+        ON generation_jobs (status, next_run_at)
+        ''',
+    ]),
+    (4, '评语生成缓存', [
+        '''
+        CREATE TABLE IF NOT EXISTS generation_cache (
+            cache_key TEXT PRIMARY KEY,
+            provider TEXT NOT NULL,
+            generated_comment TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_generation_cache_created
+        ON generation_cache (created_at)
+        ''',
+        # 后台任务也可以要求跳过缓存
+        'ALTER TABLE generation_jobs ADD COLUMN force_fresh INTEGER NOT NULL DEFAULT 0',
+    ]),
+    (5, '评语的 token 用量、耗时和重试次数', [
+        'ALTER TABLE comments ADD COLUMN prompt_tokens INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE comments ADD COLUMN completion_tokens INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE comments ADD COLUMN cached_tokens INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE comments ADD COLUMN latency_ms INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE comments ADD COLUMN retries INTEGER NOT NULL DEFAULT 0',
+        # 按服务商、按天统计时按时间范围过滤
+        '''
+        CREATE INDEX IF NOT EXISTS idx_comments_created
+        ON comments (created_at)
+        ''',
+    ]),
+    (6, '降级模式生成的评语标记为待重新生成', [
+        'ALTER TABLE comments ADD COLUMN needs_regeneration INTEGER NOT NULL DEFAULT 0',
+        # 只索引待重新生成的评语，正常评语不占索引空间
+        '''
+        CREATE INDEX IF NOT EXISTS idx_comments_needs_regeneration
+        ON comments (user_id, id) WHERE needs_regeneration = 1
+        ''',
+    ]),
+    (7, '评语全文检索（FTS5 trigram 分词）', [
+        # 外部内容表：只存倒排索引，正文仍在 comments 中；trigram 分词适用于没有空格的中文
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS comments_fts USING fts5(
+            student_name, student_info, generated_comment,
+            content='comments', content_rowid='id', tokenize='trigram'
+        )
+        ''',
+        # 由触发器保持同步：插入、删除评语，以及重新生成（更新正文）时更新索引
+        '''
+        CREATE TRIGGER IF NOT EXISTS comments_fts_insert AFTER INSERT ON comments BEGIN
+            INSERT INTO comments_fts (rowid, student_name, student_info, generated_comment)
+            VALUES (new.id, new.student_name, new.student_info, new.generated_comment);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS comments_fts_delete AFTER DELETE ON comments BEGIN
+            INSERT INTO comments_fts (comments_fts, rowid, student_name, student_info, generated_comment)
+            VALUES ('delete', old.id, old.student_name, old.student_info, old.generated_comment);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS comments_fts_update
+        AFTER UPDATE OF student_name, student_info, generated_comment ON comments BEGIN
+            INSERT INTO comments_fts (comments_fts, rowid, student_name, student_info, generated_comment)
+            VALUES ('delete', old.id, old.student_name, old.student_info, old.generated_comment);
+            INSERT INTO comments_fts (rowid, student_name, student_info, generated_comment)
+            VALUES (new.id, new.student_name, new.student_info, new.generated_comment);
+        END
+        ''',
+        # 为已有的评语建立索引
+        "INSERT INTO comments_fts (comments_fts) VALUES ('rebuild')",
+    ]),
+    (8, '评语和生成任务记录班级', [
+        'ALTER TABLE comments ADD COLUMN class_name TEXT',
+        'ALTER TABLE generation_jobs ADD COLUMN class_name TEXT',
+        # 按班级分组导出时按班级、时间顺序读取，不需要临时排序
+        '''
+        CREATE INDEX IF NOT EXISTS idx_comments_user_class
+        ON comments (user_id, class_name, created_at, id)
+        ''',
+    ]),
+    (9, '学生名单', [
+        '''
+        CREATE TABLE IF NOT EXISTS rosters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            class_name TEXT,
+            student_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_rosters_user
+        ON rosters (user_id, id)
+        ''',
+        # 同一份名单中姓名和信息完全相同的行只保留一条（导入时 INSERT OR IGNORE 去重）
+        '''
+        CREATE TABLE IF NOT EXISTS roster_students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            roster_id INTEGER NOT NULL,
+            student_name TEXT NOT NULL,
+            student_info TEXT NOT NULL,
+            class_name TEXT,
+            comment_id INTEGER,
+            UNIQUE (roster_id, student_name, student_info),
+            FOREIGN KEY (roster_id) REFERENCES rosters (id)
+        )
+        ''',
+        # 批量生成时按顺序取还没有生成评语的学生
+        '''
+        CREATE INDEX IF NOT EXISTS idx_roster_students_pending
+        ON roster_students (roster_id, id) WHERE comment_id IS NULL
+        ''',
+    ]),
+    (10, '名单导入状态（分批提交）', [
+        # importing: 正在分批写入，列表和生成都看不到；ready: 导入完成（已有的名单都是完整的）
+        "ALTER TABLE rosters ADD COLUMN status TEXT NOT NULL DEFAULT 'ready'",
+        # 清理中断的导入时按创建时间查找
+        '''
+        CREATE INDEX IF NOT EXISTS idx_rosters_importing
+        ON rosters (created_at) WHERE status = 'importing'
+        ''',
+    ]),
+]
+
+
+_database = None
+_database_lock = threading.Lock()
+
+
+def get_database():
+    """
+    获取全局共享的 Database 实例（进程内只创建一次）
 
-        conn.commit()
-        conn.close()
-        print("[OK] 数据库表创建成功")
+    第一次创建时执行数据库迁移，之后的调用不再检查表结构。
+
+    返回:
+        Database 实例
+    """
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                database = Database()
+                database.migrate()
+                _database = database
+    return _database
+
+
+# 用户信息缓存（按用户ID）：用户名、邮箱注册后很少变化，已登录请求读取用户信息时不再查询数据库。
+# 修改用户信息的写操作必须调用 User.invalidate；多进程部署时各进程各自缓存，
+# 其他进程最多在 USER_CACHE_TTL 秒后看到新值
+user_cache = LRUCache(
+    int(os.getenv('USER_CACHE_SIZE', 10000)),
+    float(os.getenv('USER_CACHE_TTL', 300))
+)
 
 
 class User:
@@ -79,30 +419,28 @@ class User:
 
         返回:
             成功返回用户ID，失败返回None
+
+        异常:
+            PasswordHasherBusy: 哈希计算排队已满
         """
-        db = Database()
-        conn = db.get_connection()
-        cursor = conn.cursor()
+        # 使用 bcrypt 加密密码（放在取连接之前，避免占着连接做 CPU 计算；
+        # 在独立的进程池中计算，不占用请求线程）
+        password_hash = password_hasher.hash(password)
 
-        try:
-            # 使用 bcrypt 加密密码
-            password_hash = bcrypt.hashpw(
-                password.encode('utf-8'),
-                bcrypt.gensalt()
-            ).decode('utf-8')
-
-            cursor.execute(
-                'INSERT INTO users (username, password_hash, email) VALUES (?, ?, ?)',
-                (username, password_hash, email)
-            )
-            conn.commit()
-            user_id = cursor.lastrowid
-            conn.close()
-            return user_id
-        except sqlite3.IntegrityError:
-            # 用户名已存在
-            conn.close()
-            return None
+        with get_database().connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    'INSERT INTO users (username, password_hash, email) VALUES (?, ?, ?)',
+                    (username, password_hash, email)
+                )
+                conn.commit()
+                User.invalidate(cursor.lastrowid)
+                return cursor.lastrowid
+            except sqlite3.IntegrityError:
+                # 用户名已存在
+                conn.rollback()
+                return None
 
     @staticmethod
     def verify_password(username, password):
@@ -115,31 +453,53 @@ class User:
 
         返回:
             验证成功返回用户信息字典，失败返回None
+
+        异常:
+            PasswordHasherBusy: 哈希计算排队已满
         """
-        db = Database()
-        conn = db.get_connection()
-        cursor = conn.cursor()
+        with get_database().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT * FROM users WHERE username = ?',
+                (username,)
+            )
+            user = cursor.fetchone()
 
-        cursor.execute(
-            'SELECT * FROM users WHERE username = ?',
-            (username,)
-        )
-        user = cursor.fetchone()
-        conn.close()
-
-        if user and bcrypt.checkpw(
-            password.encode('utf-8'),
-            user['password_hash'].encode('utf-8')
-        ):
-            # 密码正确，返回用户信息（不包含密码）
-            return {
+        if not user:
+            return None
+
+        if password_hasher.verify(password, user['password_hash']):
+            if password_hasher.needs_rehash(user['password_hash']):
+                User._rehash(user['id'], password, user['password_hash'])
+            # 密码正确，返回用户信息（不包含密码），顺便放入缓存，之后的请求不用再查询
+            info = {
                 'id': user['id'],
                 'username': user['username'],
                 'email': user['email'],
                 'created_at': user['created_at']
             }
+            user_cache.set(user['id'], info)
+            return dict(info)
         return None
 
+    @staticmethod
+    def _rehash(user_id, password, old_hash):
+        """
+        用当前配置的 cost 重新计算密码哈希（BCRYPT_ROUNDS 调整后，用户登录时逐步升级）
+
+        哈希计算排队已满时跳过，下次登录再升级；期间密码被修改过则不覆盖
+        """
+        try:
+            new_hash = password_hasher.hash(password)
+        except PasswordHasherBusy:
+            return
+        with get_database().connection() as conn:
+            conn.execute(
+                'UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                (new_hash, user_id, old_hash)
+            )
+            conn.commit()
+
     @staticmethod
     def get_by_id(user_id):
         """
@@ -149,29 +509,219 @@ class User:
             user_id: 用户ID
 
         返回:
-            用户信息字典，不存在返回None
+            用户信息字典，不存在返回None（不存在的结果不缓存）
         """
-        db = Database()
-        conn = db.get_connection()
-        cursor = conn.cursor()
+        user = user_cache.get(user_id)
+        if user is not None:
+            user_cache_lookups.inc('hit')
+            return dict(user)
+        user_cache_lookups.inc('miss')
 
-        cursor.execute(
-            'SELECT id, username, email, created_at FROM users WHERE id = ?',
-            (user_id,)
-        )
-        user = cursor.fetchone()
-        conn.close()
+        with get_database().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT id, username, email, created_at FROM users WHERE id = ?',
+                (user_id,)
+            )
+            user = cursor.fetchone()
 
         if user:
+            user = dict(user)
+            user_cache.set(user_id, user)
             return dict(user)
         return None
 
+    @staticmethod
+    def invalidate(user_id):
+        """
+        用户信息被修改后调用，清除本进程中的缓存
+
+        参数:
+            user_id: 用户ID
+        """
+        user_cache.delete(user_id)
+
+    @staticmethod
+    def cache_stats():
+        """用户信息缓存的命中情况"""
+        return user_cache.stats()
+
+
+# 随评语保存的用量字段（与 GenerationResult.accounting() 的键一致）
+USAGE_COLUMNS = ('prompt_tokens', 'completion_tokens', 'cached_tokens', 'latency_ms', 'retries')
+
+# 用量统计支持的分组方式：分组名 -> SQL 表达式
+USAGE_GROUPS = {
+    'user': 'user_id',
+    'provider': 'ai_model',
+    'day': 'date(created_at)'
+}
+
+INSERT_COMMENT_SQL = '''INSERT INTO comments
+   (user_id, student_name, student_info, generated_comment, ai_model,
+    prompt_tokens, completion_tokens, cached_tokens, latency_ms, retries, needs_regeneration, class_name)
+   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+
+def _usage_values(usage):
+    """把用量字典转换成与 USAGE_COLUMNS 顺序一致的元组（缺少的字段记为 0）"""
+    usage = usage or {}
+    return tuple(int(usage.get(column) or 0) for column in USAGE_COLUMNS)
+
+
+class CommentWriter:
+    """
+    评语组提交写入器
+
+    所有评语插入交给一个后台写线程：调用方把要插入的行放进队列后等待结果，
+    写线程每次取出队列中已有的请求（最多 max_batch 个）合并到同一个事务中提交，
+    提交完成后才把行ID返回给调用方（返回即已落盘）。上一次提交（fsync）期间到达的请求
+    自然组成下一组；max_delay 大于 0 时还会再多等一会儿凑更大的组。
+    每个事务只需要一次 fsync，并发写入时也不会因为争抢写锁出现 database is locked。
+
+    每个进程一个写线程（fork 后在子进程中重新启动）。
+    """
+
+    def __init__(self, max_batch=None, max_delay=None, queue_size=None, synchronous=None):
+        """
+        参数:
+            max_batch: 一个事务最多合并的请求数（默认读取 COMMENT_WRITER_MAX_BATCH）
+            max_delay: 收到第一个请求后最多再等待多久凑齐一组（秒，默认读取 COMMENT_WRITER_MAX_DELAY_MS，
+                       0 表示只合并已经在排队的请求）
+            queue_size: 等待写入的请求上限，满了调用方会等待（默认读取 COMMENT_WRITER_QUEUE_SIZE）
+            synchronous: 写线程连接的 PRAGMA synchronous（默认读取 COMMENT_WRITER_SYNCHRONOUS，
+                         FULL 表示每次提交都 fsync，合并提交后代价很小）
+        """
+        self.max_batch = max_batch or int(os.getenv('COMMENT_WRITER_MAX_BATCH', 64))
+        self.max_delay = max_delay if max_delay is not None else \
+            float(os.getenv('COMMENT_WRITER_MAX_DELAY_MS', 0)) / 1000
+        self.queue_size = queue_size or int(os.getenv('COMMENT_WRITER_QUEUE_SIZE', 1024))
+        self.synchronous = (synchronous or os.getenv('COMMENT_WRITER_SYNCHRONOUS', 'FULL')).upper()
+
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {'groups': 0, 'requests': 0, 'rows': 0, 'errors': 0, 'max_group': 0}
+
+    def ensure_started(self):
+        """确保当前进程的写线程在运行（fork 出来的子进程不会继承父进程的线程）"""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='comment-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, rows):
+        """
+        提交一组要在同一个事务中插入的评语
+
+        参数:
+            rows: INSERT_COMMENT_SQL 的参数元组列表
+
+        返回:
+            Future，结果为与 rows 顺序一致的评语ID列表
+        """
+        self.ensure_started()
+        future = Future()
+        self._queue.put((list(rows), future))
+        return future
+
+    def write(self, rows):
+        """提交并等待写入完成，返回评语ID列表"""
+        return self.submit(rows).result()
+
+    def _run(self):
+        """写线程主循环：取出第一个请求后，带上已在排队（或 max_delay 内到达）的请求一起提交"""
+        conn = get_database().checkout()
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        try:
+            while True:
+                group = [self._queue.get()]
+                deadline = time.monotonic() + self.max_delay
+                while len(group) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        group.append(self._queue.get(timeout=remaining) if remaining > 0
+                                     else self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    self._commit(conn, group)
+                except BaseException as e:
+                    # 写线程意外退出：手上这一组的调用方不能一直等下去（下一次提交时重新启动写线程）
+                    error = RuntimeError(f'评语写入线程异常退出: {e!r}')
+                    for _, future in group:
+                        if not future.done():
+                            future.set_exception(error)
+                    raise
+        finally:
+            conn.close()
+
+    def _commit(self, conn, group):
+        """提交一组请求（调用方已取消的请求跳过）"""
+        group = [(rows, future) for rows, future in group if future.set_running_or_notify_cancel()]
+        if group:
+            self._write(conn, group)
+
+    def _write(self, conn, group):
+        """在一个事务中写入一组请求；失败时逐个请求单独重试，一个请求出错不影响其他请求"""
+        try:
+            results = [self._insert(conn, rows) for rows, _ in group]
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if len(group) > 1:
+                for item in group:
+                    self._write(conn, [item])
+                return
+            with self._lock:
+                self._stats['errors'] += 1
+            group[0][1].set_exception(e)
+            return
+
+        comment_write_group_size.observe(len(group))
+        with self._lock:
+            self._stats['groups'] += 1
+            self._stats['requests'] += len(group)
+            self._stats['rows'] += sum(len(rows) for rows, _ in group)
+            self._stats['max_group'] = max(self._stats['max_group'], len(group))
+        for (_, future), ids in zip(group, results):
+            future.set_result(ids)
+
+    @staticmethod
+    def _insert(conn, rows):
+        cursor = conn.cursor()
+        ids = []
+        for row in rows:
+            cursor.execute(INSERT_COMMENT_SQL, row)
+            ids.append(cursor.lastrowid)
+        return ids
+
+    def stats(self):
+        """已提交的事务数、请求数、行数、失败数和最大的一组请求数"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize() if self._queue is not None else 0
+        return stats
+
+
+# 全局共享的评语写入器
+comment_writer = CommentWriter()
+
 
 class Comment:
     """评语模型"""
 
     @staticmethod
-    def create(user_id, student_name, student_info, generated_comment, ai_model):
+    def create(user_id, student_name, student_info, generated_comment, ai_model, usage=None,
+               needs_regeneration=False, class_name=None):
         """
         保存生成的评语
 
@@ -181,52 +731,343 @@ class Comment:
             student_info: 学生信息（性格、成绩等）
             generated_comment: 生成的评语
             ai_model: 使用的AI模型名称
+            usage: 用量记录（键见 USAGE_COLUMNS，可选）
+            needs_regeneration: 是否为降级模式的模板评语（待服务商恢复后重新生成）
+            class_name: 班级（可选）
 
         返回:
-            评语ID
+            评语ID（由写线程与其他请求合并提交，返回时已经写入）
         """
-        db = Database()
-        conn = db.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            '''INSERT INTO comments
-               (user_id, student_name, student_info, generated_comment, ai_model)
-               VALUES (?, ?, ?, ?, ?)''',
+        return comment_writer.write([
             (user_id, student_name, student_info, generated_comment, ai_model)
-        )
-        conn.commit()
-        comment_id = cursor.lastrowid
-        conn.close()
-        return comment_id
+            + _usage_values(usage) + (int(bool(needs_regeneration)), class_name)
+        ])[0]
 
     @staticmethod
-    def get_by_user(user_id, limit=20):
+    def create_many(user_id, comments, ai_model, class_name=None):
+        """
+        在一个事务中批量保存评语
+
+        参数:
+            user_id: 用户ID
+            comments: [{"student_name", "student_info", "generated_comment"}, ...]
+                      每项可以带 "ai_model" 覆盖默认值（如对冲请求由备用服务商生成），
+                      "usage" 用量记录，"needs_regeneration" 待重新生成标记，以及 "class_name" 班级
+            ai_model: 使用的AI模型名称
+            class_name: 默认班级（可选）
+
+        返回:
+            与 comments 顺序一致的评语ID列表
+        """
+        return comment_writer.write([
+            (user_id, comment['student_name'], comment['student_info'],
+             comment['generated_comment'], comment.get('ai_model', ai_model))
+            + _usage_values(comment.get('usage'))
+            + (int(bool(comment.get('needs_regeneration'))), comment.get('class_name', class_name))
+            for comment in comments
+        ])
+
+    @staticmethod
+    def iter_by_user(user_id, limit=20, before_ts=None, before_id=None, batch_size=50):
+        """
+        按时间倒序逐批读取用户的评语（键集分页）
+
+        使用 (created_at, id) 作为游标，配合 idx_comments_user_created 索引，
+        每页只读取 limit 行，不依赖 OFFSET，也不会把结果一次性读进内存。
+
+        参数:
+            user_id: 用户ID
+            limit: 本页最多返回数量
+            before_ts: 游标时间（只返回比它更早的评语）
+            before_id: 游标ID（必须与 before_ts 一起使用，处理同一秒内的多条评语）
+            batch_size: 每次 fetchmany 的行数
+
+        返回:
+            生成器，逐条产出评语字典
+
+        异常:
+            ValueError: 只提供了 before_ts 和 before_id 中的一个
+        """
+        if (before_ts is None) != (before_id is None):
+            raise ValueError('before_ts 和 before_id 必须同时提供')
+        sql = '''SELECT * FROM comments
+                 WHERE user_id = ?'''
+        params = [user_id]
+        if before_ts is not None:
+            sql += ' AND (created_at, id) < (?, ?)'
+            params += [before_ts, before_id]
+        sql += '''
+                 ORDER BY created_at DESC, id DESC
+                 LIMIT ?'''
+        params.append(limit)
+
+        with get_database().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(row)
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def get_by_user(user_id, limit=20, before_ts=None, before_id=None):
         """
         获取用户的评语历史
 
         参数:
             user_id: 用户ID
             limit: 返回数量限制
+            before_ts: 游标时间（可选，与 before_id 同时提供）
+            before_id: 游标ID（可选，与 before_ts 同时提供）
 
         返回:
             评语列表
         """
-        db = Database()
-        conn = db.get_connection()
-        cursor = conn.cursor()
+        return list(Comment.iter_by_user(user_id, limit, before_ts, before_id))
 
-        cursor.execute(
-            '''SELECT * FROM comments
-               WHERE user_id = ?
-               ORDER BY created_at DESC
-               LIMIT ?''',
-            (user_id, limit)
-        )
-        comments = cursor.fetchall()
-        conn.close()
+    @staticmethod
+    def iter_for_export(user_id, group_by_class=False, class_name=None, batch_size=500):
+        """
+        按时间顺序逐批读取用户的全部评语（导出用）
+
+        按键集分页，每页单独从连接池取一个连接，读完立即归还：调用方边读边写文件，
+        下载很慢时也不会一直占着连接、让读事务（WAL 快照）保持打开，阻止检查点回收 WAL 文件。
+        导出期间新增的评语可能出现在导出结果的末尾。
+
+        参数:
+            user_id: 用户ID
+            group_by_class: 是否按班级排序（同一班级的评语相邻，没有班级的排在最前面），
+                            配合 idx_comments_user_class 索引，不需要临时排序
+            class_name: 只导出该班级的评语（可选）
+            batch_size: 每页读取的行数
+
+        返回:
+            生成器，逐条产出评语字典
+        """
+        # 分段读取：(过滤条件, 参数, 排序和游标列)；
+        # 没有班级（NULL）的评语单独一段，NULL 不能参与行值比较
+        if class_name is not None:
+            parts = [('class_name = ?', [class_name], ('created_at', 'id'))]
+        elif group_by_class:
+            parts = [('class_name IS NULL', [], ('created_at', 'id')),
+                     ('class_name IS NOT NULL', [], ('class_name', 'created_at', 'id'))]
+        else:
+            parts = [(None, [], ('created_at', 'id'))]
+
+        db = get_database()
+        for condition, params, keys in parts:
+            last = None
+            while True:
+                sql = '''SELECT id, student_name, class_name, student_info, generated_comment,
+                                ai_model, created_at
+                         FROM comments
+                         WHERE user_id = ?'''
+                args = [user_id] + params
+                if condition is not None:
+                    sql += f' AND {condition}'
+                if last is not None:
+                    sql += f" AND ({', '.join(keys)}) > ({', '.join('?' * len(keys))})"
+                    args += last
+                sql += f" ORDER BY {', '.join(keys)} LIMIT ?"
+                args.append(batch_size)
+
+                conn = db.checkout()
+                try:
+                    rows = conn.execute(sql, args).fetchall()
+                finally:
+                    db.checkin(conn)
+
+                for row in rows:
+                    yield dict(row)
+                if len(rows) < batch_size:
+                    break
+                last = [rows[-1][key] for key in keys]
+
+    @staticmethod
+    def search(user_id, text, limit=20, offset=0, short_scan_limit=5000):
+        """
+        在用户的评语中全文检索（学生姓名、学生信息、评语正文）
+
+        有不少于 3 个字符的检索词时走 comments_fts 全文索引，按 bm25 相关度排序
+        （姓名命中权重最高，其次是学生信息），同时有的短词只在全文索引命中的评语上用 LIKE 过滤；
+        只有短词时无法使用索引，只在该用户最近的 short_scan_limit 条评语中用 LIKE 过滤，按时间倒序。
+
+        参数:
+            user_id: 用户ID
+            text: 检索词（空白分隔，全部命中才返回）
+            limit: 本页最多返回数量
+            offset: 跳过前多少条（翻页）
+            short_scan_limit: 只有短词时最多扫描的评语条数（按时间倒序）
+
+        返回:
+            (评语列表, 是否还有下一页)；每条评语带 "highlights"：
+            {"student_name", "student_info", "generated_comment"}，命中的词用 <mark> 标出（已做 HTML 转义）
+        """
+        query = parse_query(text)
+        if not query.terms:
+            return [], False
+
+        params = []
+        if query.match:
+            # CROSS JOIN 固定连接顺序：先用全文索引找到命中的评语，LIKE 只检查这些行
+            sql = '''SELECT c.*, bm25(comments_fts, 4.0, 2.0, 1.0) AS score
+                     FROM comments_fts
+                     CROSS JOIN comments c ON c.id = comments_fts.rowid'''
+            conditions = ['comments_fts MATCH ?', 'c.user_id = ?']
+            params += [query.match, user_id]
+        else:
+            # 沿 idx_comments_user_created 取最近的若干条，扫描量与历史总量无关
+            sql = '''SELECT c.*, NULL AS score
+                     FROM (SELECT * FROM comments
+                           WHERE user_id = ?
+                           ORDER BY created_at DESC, id DESC
+                           LIMIT ?) c'''
+            conditions = []
+            params += [user_id, short_scan_limit]
+        for term in query.like_terms:
+            conditions.append('''(c.student_name LIKE ? ESCAPE '\\'
+                            OR c.student_info LIKE ? ESCAPE '\\'
+                            OR c.generated_comment LIKE ? ESCAPE '\\')''')
+            params += [like_pattern(term)] * 3
+        sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY score, c.created_at DESC, c.id DESC' if query.match else \
+            ' ORDER BY c.created_at DESC, c.id DESC'
+        # 多取一条，用来判断是否还有下一页
+        sql += ' LIMIT ? OFFSET ?'
+        params += [limit + 1, offset]
+
+        with get_database().connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        highlight = Highlighter(query.terms)
+        results = []
+        for row in rows[:limit]:
+            item = dict(row)
+            if item['score'] is not None:
+                # bm25 越小越相关，返回时取反（越大越相关）
+                item['score'] = round(-item['score'], 4)
+            item['highlights'] = {
+                column: highlight(item[column])
+                for column in ('student_name', 'student_info', 'generated_comment')
+            }
+            results.append(item)
+        return results, len(rows) > limit
+
+    @staticmethod
+    def usage_summary(group_by, user_id=None, days=30):
+        """
+        按用户、服务商或日期汇总用量
+
+        参数:
+            group_by: 分组方式（user / provider / day）
+            user_id: 只统计该用户的评语（可选）
+            days: 统计最近多少天（按 UTC 时间）
+
+        返回:
+            [{"key": 分组值, "comments": 评语数, "prompt_tokens", "completion_tokens",
+              "cached_tokens", "retries", "avg_latency_ms", "max_latency_ms"}, ...]
+            按天分组时按日期倒序，其他按总 token 数从高到低
+
+        异常:
+            ValueError: 不支持的分组方式
+        """
+        if group_by not in USAGE_GROUPS:
+            raise ValueError(f"不支持的分组方式: {group_by}")
+        expression = USAGE_GROUPS[group_by]
+
+        # 命中缓存的评语耗时为 0，不计入平均耗时
+        sql = f'''SELECT {expression} AS key,
+                         COUNT(*) AS comments,
+                         SUM(prompt_tokens) AS prompt_tokens,
+                         SUM(completion_tokens) AS completion_tokens,
+                         SUM(cached_tokens) AS cached_tokens,
+                         SUM(retries) AS retries,
+                         AVG(NULLIF(latency_ms, 0)) AS avg_latency_ms,
+                         MAX(latency_ms) AS max_latency_ms
+                  FROM comments
+                  WHERE created_at >= datetime('now', ?)'''
+        params = [f'-{int(days)} days']
+        if user_id is not None:
+            sql += ' AND user_id = ?'
+            params.append(user_id)
+        sql += f' GROUP BY {expression}'
+        if group_by == 'day':
+            sql += ' ORDER BY key DESC'
+        else:
+            sql += ' ORDER BY SUM(prompt_tokens) + SUM(completion_tokens) DESC'
+
+        with get_database().connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        summary = []
+        for row in rows:
+            item = dict(row)
+            item['avg_latency_ms'] = round(item['avg_latency_ms'] or 0)
+            summary.append(item)
+        return summary
+
+    @staticmethod
+    def get_needing_regeneration(user_id, comment_ids=None, limit=100):
+        """
+        获取用户待重新生成的评语（降级模式下的模板评语）
+
+        参数:
+            user_id: 用户ID
+            comment_ids: 只取这些评语（可选，不属于该用户或不需要重新生成的会被忽略）
+            limit: 最多返回数量
+
+        返回:
+            [{"id", "student_name", "student_info", "ai_model"}, ...]，按ID顺序
+        """
+        sql = '''SELECT id, student_name, student_info, ai_model FROM comments
+                 WHERE user_id = ? AND needs_regeneration = 1'''
+        params = [user_id]
+        if comment_ids is not None:
+            comment_ids = [int(comment_id) for comment_id in comment_ids]
+            if not comment_ids:
+                return []
+            sql += f" AND id IN ({','.join('?' * len(comment_ids))})"
+            params += comment_ids
+        sql += ' ORDER BY id LIMIT ?'
+        params.append(limit)
+
+        with get_database().connection() as conn:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+    @staticmethod
+    def regenerate_many(user_id, comments):
+        """
+        在一个事务中用重新生成的评语替换模板评语，并清除待重新生成标记
+
+        参数:
+            user_id: 用户ID
+            comments: [{"id", "generated_comment", "ai_model", "usage"}, ...]
 
-        return [dict(comment) for comment in comments]
+        返回:
+            实际更新的评语ID列表（已被删除或已重新生成过的评语不更新）
+        """
+        assignments = ', '.join(f'{column} = ?' for column in USAGE_COLUMNS)
+        with get_database().connection() as conn:
+            cursor = conn.cursor()
+            updated = []
+            for comment in comments:
+                cursor.execute(
+                    f'''UPDATE comments
+                        SET generated_comment = ?, ai_model = ?, {assignments}, needs_regeneration = 0
+                        WHERE id = ? AND user_id = ? AND needs_regeneration = 1''',
+                    (comment['generated_comment'], comment['ai_model'])
+                    + _usage_values(comment.get('usage'))
+                    + (comment['id'], user_id)
+                )
+                if cursor.rowcount:
+                    updated.append(comment['id'])
+            conn.commit()
+            return updated
 
     @staticmethod
     def delete(comment_id, user_id):
@@ -240,18 +1081,466 @@ class Comment:
         返回:
             成功返回True，失败返回False
         """
-        db = Database()
-        conn = db.get_connection()
-        cursor = conn.cursor()
+        with get_database().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'DELETE FROM comments WHERE id = ? AND user_id = ?',
+                (comment_id, user_id)
+            )
+            conn.commit()
+            return cursor.rowcount > 0
 
-        cursor.execute(
-            'DELETE FROM comments WHERE id = ? AND user_id = ?',
-            (comment_id, user_id)
-        )
-        conn.commit()
-        deleted = cursor.rowcount > 0
-        conn.close()
-        return deleted
+
+class Roster:
+    """学生名单（导入后可以直接用于批量生成评语）"""
+
+    # 超过这个时间仍处于 importing 状态的名单视为导入中断（进程退出），下次导入时清理
+    STALE_IMPORT_SECONDS = 3600
+
+    @staticmethod
+    def create(user_id, name, students, class_name=None, batch_size=500):
+        """
+        保存名单，边读边写（students 可以是逐行读取文件的生成器）
+
+        每读满 batch_size 个学生就写入并提交一次：读取、解析上传文件时不持有写锁，
+        评语写入器和其他请求的写入只需等待一批 executemany 的时间。
+        写入过程中名单的状态为 importing（列表、查询和生成都看不到），全部写完后改为 ready。
+        同一份名单中姓名和信息完全相同的行只保留第一条。
+
+        参数:
+            user_id: 用户ID
+            name: 名单名称
+            students: 可迭代的学生字典 {"student_name", "student_info", "class_name"（可选）}
+            class_name: 名单所属班级（学生没有单独的班级时使用）
+            batch_size: 每批写入的行数
+
+        返回:
+            (名单ID, 导入人数, 重复行数)；没有任何学生时不保存，名单ID为 None
+
+        异常:
+            读取 students 过程中抛出的异常会原样抛出，已经写入的部分被删除
+        """
+        database = get_database()
+        with database.connection() as conn:
+            Roster._purge_stale_imports(conn)
+            cursor = conn.execute(
+                "INSERT INTO rosters (user_id, name, class_name, status) VALUES (?, ?, ?, 'importing')",
+                (user_id, name, class_name)
+            )
+            roster_id = cursor.lastrowid
+            conn.commit()
+
+        def insert(batch):
+            """写入并提交一批学生，返回实际写入的行数（重复的行被忽略）"""
+            with database.connection() as conn:
+                cursor = conn.executemany(
+                    '''INSERT OR IGNORE INTO roster_students
+                       (roster_id, student_name, student_info, class_name)
+                       VALUES (?, ?, ?, ?)''',
+                    batch
+                )
+                conn.commit()
+                return cursor.rowcount
+
+        imported = duplicates = 0
+        try:
+            batch = []
+            for student in students:
+                batch.append((roster_id, student['student_name'].strip(), student['student_info'].strip(),
+                              student.get('class_name') or class_name))
+                if len(batch) >= batch_size:
+                    inserted = insert(batch)
+                    imported += inserted
+                    duplicates += len(batch) - inserted
+                    batch = []
+            if batch:
+                inserted = insert(batch)
+                imported += inserted
+                duplicates += len(batch) - inserted
+        except BaseException:
+            Roster._discard(roster_id)
+            raise
+
+        if imported == 0:
+            Roster._discard(roster_id)
+            return None, 0, duplicates
+
+        with database.connection() as conn:
+            conn.execute(
+                "UPDATE rosters SET student_count = ?, status = 'ready' WHERE id = ?",
+                (imported, roster_id)
+            )
+            conn.commit()
+        return roster_id, imported, duplicates
+
+    @staticmethod
+    def _discard(roster_id):
+        """删除没有导入完成的名单"""
+        with get_database().connection() as conn:
+            conn.execute('DELETE FROM roster_students WHERE roster_id = ?', (roster_id,))
+            conn.execute('DELETE FROM rosters WHERE id = ?', (roster_id,))
+            conn.commit()
+
+    @staticmethod
+    def _purge_stale_imports(conn):
+        """删除中断的导入（进程在导入过程中退出时留下的 importing 名单）"""
+        stale = [row[0] for row in conn.execute(
+            '''SELECT id FROM rosters
+               WHERE status = 'importing' AND created_at < datetime('now', ?)''',
+            (f'-{Roster.STALE_IMPORT_SECONDS} seconds',)
+        ).fetchall()]
+        if stale:
+            placeholders = ', '.join('?' * len(stale))
+            conn.execute(f'DELETE FROM roster_students WHERE roster_id IN ({placeholders})', stale)
+            conn.execute(f'DELETE FROM rosters WHERE id IN ({placeholders})', stale)
+            conn.commit()
+
+    @staticmethod
+    def list_by_user(user_id):
+        """
+        获取用户的全部名单（新的在前）
+
+        返回:
+            [{"id", "name", "class_name", "student_count", "generated", "created_at"}, ...]
+            generated 为已经生成评语的学生数
+        """
+        with get_database().connection() as conn:
+            rows = conn.execute(
+                '''SELECT r.id, r.name, r.class_name, r.student_count, r.created_at,
+                          (SELECT COUNT(*) FROM roster_students s
+                           WHERE s.roster_id = r.id AND s.comment_id IS NOT NULL) AS generated
+                   FROM rosters r
+                   WHERE r.user_id = ? AND r.status = 'ready'
+                   ORDER BY r.id DESC''',
+                (user_id,)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    @staticmethod
+    def get(roster_id, user_id):
+        """获取导入完成的名单（只能获取自己的），不存在时返回None"""
+        with get_database().connection() as conn:
+            row = conn.execute(
+                '''SELECT id, name, class_name, student_count, created_at
+                   FROM rosters WHERE id = ? AND status = 'ready' AND user_id = ?''',
+                (roster_id, user_id)
+            ).fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def get_students(roster_id, limit=100, after_id=None):
+        """
+        按导入顺序分页获取名单中的学生（键集分页）
+
+        参数:
+            roster_id: 名单ID（调用方需先用 get 确认名单属于当前用户）
+            limit: 本页最多返回数量
+            after_id: 上一页最后一个学生的ID
+
+        返回:
+            [{"id", "student_name", "student_info", "class_name", "comment_id"}, ...]
+        """
+        with get_database().connection() as conn:
+            rows = conn.execute(
+                '''SELECT id, student_name, student_info, class_name, comment_id
+                   FROM roster_students
+                   WHERE roster_id = ? AND id > ?
+                   ORDER BY id
+                   LIMIT ?''',
+                (roster_id, after_id or 0, limit)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    @staticmethod
+    def get_pending(roster_id, limit=100):
+        """按导入顺序获取还没有生成评语的学生"""
+        with get_database().connection() as conn:
+            rows = conn.execute(
+                '''SELECT id, student_name, student_info, class_name
+                   FROM roster_students
+                   WHERE roster_id = ? AND comment_id IS NULL
+                   ORDER BY id
+                   LIMIT ?''',
+                (roster_id, limit)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    @staticmethod
+    def mark_generated(roster_id, generated):
+        """
+        记录学生已生成的评语
+
+        参数:
+            roster_id: 名单ID
+            generated: [(学生ID, 评语ID), ...]
+        """
+        with get_database().connection() as conn:
+            conn.executemany(
+                'UPDATE roster_students SET comment_id = ? WHERE id = ? AND roster_id = ?',
+                [(comment_id, student_id, roster_id) for student_id, comment_id in generated]
+            )
+            conn.commit()
+
+    @staticmethod
+    def delete(roster_id, user_id):
+        """
+        删除名单（只能删除自己的，已经生成的评语保留）
+
+        返回:
+            成功返回True，失败返回False
+        """
+        with get_database().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM rosters WHERE id = ? AND user_id = ?', (roster_id, user_id))
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return False
+            cursor.execute('DELETE FROM roster_students WHERE roster_id = ?', (roster_id,))
+            conn.commit()
+            return True
+
+
+class GenerationJob:
+    """
+    评语生成任务（持久化在 SQLite 中的工作队列）
+
+    状态流转: pending -> running -> succeeded / failed
+    running 状态带有租约（locked_until），执行期间由工作线程池定期续约；
+    进程崩溃或重启后不再续约，租约过期后任务会被其他工作线程重新领取。
+    """
+
+    @staticmethod
+    def create(user_id, student_name, student_info, ai_model, max_attempts=3, force_fresh=False,
+               class_name=None):
+        """
+        创建任务
+
+        参数:
+            force_fresh: 是否跳过生成缓存，强制重新生成
+            class_name: 班级（可选，随评语一起保存）
+
+        返回:
+            任务ID
+        """
+        with get_database().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''INSERT INTO generation_jobs
+                   (user_id, student_name, student_info, ai_model, max_attempts,
+                    force_fresh, next_run_at, class_name)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                (user_id, student_name, student_info, ai_model, max_attempts,
+                 int(bool(force_fresh)), time.time(), class_name)
+            )
+            conn.commit()
+            return cursor.lastrowid
+
+    @staticmethod
+    def get(job_id, user_id):
+        """
+        获取任务详情（只能查看自己的）
+
+        返回:
+            任务字典（成功时包含生成的评语），不存在返回None
+        """
+        with get_database().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''SELECT j.id, j.status, j.ai_model, j.attempts, j.error,
+                          j.comment_id, j.student_name, j.class_name, j.created_at, j.updated_at,
+                          c.generated_comment AS comment
+                   FROM generation_jobs j
+                   LEFT JOIN comments c ON c.id = j.comment_id
+                   WHERE j.id = ? AND j.user_id = ?''',
+                (job_id, user_id)
+            )
+            job = cursor.fetchone()
+
+        if job:
+            return dict(job)
+        return None
+
+    @staticmethod
+    def claim(lease_seconds=120):
+        """
+        领取一个可执行的任务
+
+        可执行的任务包括: 到期的 pending 任务，以及租约已过期的 running 任务
+        （上次执行时进程退出了）。领取时 attempts 加一并设置新的租约。
+
+        返回:
+            任务字典，没有可执行任务时返回None
+        """
+        now = time.time()
+        with get_database().connection() as conn:
+            # 立即获取写锁，防止多个工作线程领取同一个任务
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                job = conn.execute(
+                    '''SELECT * FROM generation_jobs
+                       WHERE (status = 'pending' AND next_run_at <= ?)
+                          OR (status = 'running' AND locked_until < ?)
+                       ORDER BY next_run_at
+                       LIMIT 1''',
+                    (now, now)
+                ).fetchone()
+                if job is None:
+                    conn.rollback()
+                    return None
+
+                conn.execute(
+                    '''UPDATE generation_jobs
+                       SET status = 'running', attempts = attempts + 1,
+                           locked_until = ?, updated_at = CURRENT_TIMESTAMP
+                       WHERE id = ?''',
+                    (now + lease_seconds, job['id'])
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        job = dict(job)
+        job['attempts'] += 1
+        job['status'] = 'running'
+        return job
+
+    @staticmethod
+    def renew(jobs, lease_seconds=120):
+        """
+        为执行中的任务续约（一次写入）
+
+        参数:
+            jobs: claim 返回的任务字典列表
+            lease_seconds: 从现在起的租约时长（秒）
+
+        返回:
+            续约成功的任务数（已完成或已被其他线程重新领取的任务不续约）
+        """
+        if not jobs:
+            return 0
+        locked_until = time.time() + lease_seconds
+        with get_database().connection() as conn:
+            cursor = conn.executemany(
+                '''UPDATE generation_jobs SET locked_until = ?
+                   WHERE id = ? AND status = 'running' AND attempts = ?''',
+                [(locked_until, job['id'], job['attempts']) for job in jobs]
+            )
+            conn.commit()
+            return cursor.rowcount
+
+    @staticmethod
+    def complete(job, generated_comment, ai_model=None, usage=None, needs_regeneration=False):
+        """
+        任务成功：保存评语并标记完成（同一个事务）
+
+        参数:
+            job: claim 返回的任务字典
+            generated_comment: 生成的评语
+            ai_model: 实际生成评语的服务商（默认为任务指定的模型）
+            usage: 用量记录（可选）
+            needs_regeneration: 是否为降级模式的模板评语
+
+        返回:
+            评语ID；任务已被其他线程重新领取时返回None（不重复保存）
+        """
+        with get_database().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                INSERT_COMMENT_SQL,
+                (job['user_id'], job['student_name'], job['student_info'],
+                 generated_comment, ai_model or job['ai_model'])
+                + _usage_values(usage) + (int(bool(needs_regeneration)), job['class_name'])
+            )
+            comment_id = cursor.lastrowid
+            cursor.execute(
+                '''UPDATE generation_jobs
+                   SET status = 'succeeded', comment_id = ?, error = NULL,
+                       locked_until = NULL, updated_at = CURRENT_TIMESTAMP
+                   WHERE id = ? AND status = 'running' AND attempts = ?''',
+                (comment_id, job['id'], job['attempts'])
+            )
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return None
+            conn.commit()
+            return comment_id
+
+    @staticmethod
+    def fail(job, error, retry_at=None):
+        """
+        任务失败
+
+        参数:
+            job: claim 返回的任务字典
+            error: 错误信息
+            retry_at: 下次重试的时间戳；为None时直接标记为最终失败
+        """
+        with get_database().connection() as conn:
+            conn.execute(
+                '''UPDATE generation_jobs
+                   SET status = ?, error = ?, next_run_at = COALESCE(?, next_run_at),
+                       locked_until = NULL, updated_at = CURRENT_TIMESTAMP
+                   WHERE id = ? AND status = 'running' AND attempts = ?''',
+                ('pending' if retry_at is not None else 'failed', error, retry_at,
+                 job['id'], job['attempts'])
+            )
+            conn.commit()
+
+
+class GenerationCacheEntry:
+    """评语生成缓存（持久层），供 utils.generation_cache 使用"""
+
+    @staticmethod
+    def get(cache_key, max_age):
+        """
+        读取缓存
+
+        参数:
+            cache_key: 缓存键
+            max_age: 最长有效期（秒）
+
+        返回:
+            {"generated_comment", "provider"} 字典，不存在或已过期返回None
+        """
+        with get_database().connection() as conn:
+            row = conn.execute(
+                '''SELECT generated_comment, provider FROM generation_cache
+                   WHERE cache_key = ? AND created_at >= ?''',
+                (cache_key, time.time() - max_age)
+            ).fetchone()
+
+        if row:
+            return dict(row)
+        return None
+
+    @staticmethod
+    def set(cache_key, provider, generated_comment):
+        """写入缓存（同一个键覆盖旧值）"""
+        with get_database().connection() as conn:
+            conn.execute(
+                '''INSERT OR REPLACE INTO generation_cache
+                   (cache_key, provider, generated_comment, created_at)
+                   VALUES (?, ?, ?, ?)''',
+                (cache_key, provider, generated_comment, time.time())
+            )
+            conn.commit()
+
+    @staticmethod
+    def purge_expired(max_age):
+        """
+        删除过期缓存
+
+        返回:
+            删除的行数
+        """
+        with get_database().connection() as conn:
+            cursor = conn.execute(
+                'DELETE FROM generation_cache WHERE created_at < ?',
+                (time.time() - max_age,)
+            )
+            conn.commit()
+            return cursor.rowcount
 
 
 # 测试代码（仅在直接运行此文件时执行）
@@ -259,7 +1548,7 @@ if __name__ == '__main__':
     print("[TEST] 测试数据库模型...")
 
     # 初始化数据库
-    db = Database()
+    db = get_database()
 
     # 测试创建用户
     print("\n1. 测试创建用户...")
@@ -0,0 +1,101 @@
+"""
+测试公共配置
+
+在导入应用之前设置环境变量：临时数据库、在当前进程中计算密码哈希、不启动后台任务线程，
+并清空服务商 API Key（需要服务商的测试用 ai_provider 指向本地模拟服务）。
+运行: cd backend && python -m pytest
+"""
+
+import os
+import tempfile
+import uuid
+
+import pytest
+
+_TEST_DIR = tempfile.mkdtemp(prefix='commentgenie-test-')
+
+os.environ.update({
+    'DATABASE_PATH': os.path.join(_TEST_DIR, 'test.db'),
+    'PASSWORD_HASH_WORKERS': '0',
+    'BCRYPT_ROUNDS': '4',
+    'JOB_WORKERS': '0',
+    'REQUEST_LOG_SLOW_MS': '-1',
+    'PROFILE_SAMPLE_RATE': '0',
+    'AI_MAX_RETRIES': '0',
+    'AI_HEDGE_PROVIDER': '',
+    'METRICS_TOKEN': '',
+    # 设为空字符串而不是删除：load_dotenv 不会用 .env 中的值覆盖已设置的变量
+    'DEEPSEEK_API_KEY': '',
+    'ZHIPU_API_KEY': '',
+    'QWEN_API_KEY': '',
+    'KIMI_API_KEY': '',
+})
+
+from app import app as flask_app  # noqa: E402
+from loadtest.mock_llm import start_mock_llm  # noqa: E402
+from utils import rate_limit  # noqa: E402
+from utils.provider_stats import provider_health  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(client):
+    """注册并登录一个新用户，返回 (用户ID, 请求头)"""
+    def make():
+        username = f'teacher_{uuid.uuid4().hex[:12]}'
+        response = client.post('/api/register', json={'username': username, 'password': 'pw123456'})
+        assert response.status_code == 201, response.json
+        response = client.post('/api/login', json={'username': username, 'password': 'pw123456'})
+        return response.json['user']['id'], {'Authorization': f"Bearer {response.json['token']}"}
+    return make
+
+
+@pytest.fixture
+def auth(make_user):
+    """一个已登录的用户: (用户ID, 请求头)"""
+    return make_user()
+
+
+@pytest.fixture
+def fresh_limiters(monkeypatch):
+    """使用新的限流器（按测试中设置的环境变量创建），测试结束后恢复"""
+    monkeypatch.setattr(rate_limit, '_limiters', {})
+
+
+@pytest.fixture
+def fresh_provider_health(monkeypatch):
+    """清空服务商健康状态（熔断器、EWMA），测试中记录的失败不影响其他测试"""
+    monkeypatch.setattr(provider_health, '_providers', {})
+
+
+@pytest.fixture(scope='session')
+def mock_llm():
+    """本地模拟服务商（几乎没有延迟，不注入错误）"""
+    server = start_mock_llm(latency='0.01', stream_chunks=3, stream_interval=0)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def ai_provider(monkeypatch, mock_llm):
+    """
+    把 deepseek 和 qwen 指向模拟服务
+
+    每个测试使用不同的 API Key，客户端缓存（按服务商和 API Key）不会复用其他测试的客户端
+    """
+    api_key = f'test-{uuid.uuid4().hex}'
+    monkeypatch.setenv('DEEPSEEK_API_KEY', api_key)
+    monkeypatch.setenv('DEEPSEEK_BASE_URL', mock_llm.openai_url)
+    monkeypatch.setenv('QWEN_API_KEY', api_key)
+    monkeypatch.setenv('QWEN_BASE_URL', mock_llm.dashscope_url)
+    return mock_llm
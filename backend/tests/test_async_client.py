@@ -0,0 +1,134 @@
+"""异步 AI 客户端（对接本地模拟服务商）"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from loadtest.mock_llm import MOCK_COMMENT, start_mock_llm
+from utils.async_client import get_async_ai_client
+from utils.rate_limit import TokenBucket, get_limiter
+
+pytestmark = pytest.mark.usefixtures('fresh_limiters')
+
+
+def test_generate(ai_provider):
+    async def run():
+        async with get_async_ai_client('deepseek') as client:
+            return await client.generate('张三', '性格开朗')
+
+    result = asyncio.run(run())
+    assert result.comment == MOCK_COMMENT
+    assert result.provider == 'deepseek'
+    assert (result.usage['prompt_tokens'], result.usage['completion_tokens']) == (220, 48)
+
+
+def test_generate_many_respects_inflight_cap(ai_provider, monkeypatch):
+    monkeypatch.setenv('AI_MAX_INFLIGHT', '3')
+    limiter = get_limiter('deepseek')
+    students = [{'student_name': f'学生{i}', 'student_info': '爱读书'} for i in range(20)]
+
+    async def run():
+        peak = 0
+        results = []
+
+        async def watch():
+            nonlocal peak
+            while True:
+                peak = max(peak, limiter.stats()['in_flight'])
+                await asyncio.sleep(0.002)
+
+        watcher = asyncio.create_task(watch())
+        async with get_async_ai_client('deepseek') as client:
+            async for item in client.generate_many(students, concurrency=50):
+                results.append(item)
+        watcher.cancel()
+        return peak, results
+
+    peak, results = asyncio.run(run())
+    assert sorted(item['index'] for item in results) == list(range(20))
+    assert all(item['comment'] == MOCK_COMMENT for item in results)
+    assert 1 <= peak <= 3
+    assert limiter.stats()['acquired'] == 20
+    assert limiter.stats()['in_flight'] == 0
+
+
+def test_shares_budget_with_sync_callers(ai_provider, monkeypatch):
+    """同步调用占满并发名额时，异步请求排队，超时后报错"""
+    monkeypatch.setenv('AI_MAX_INFLIGHT', '1')
+    monkeypatch.setenv('AI_RATE_LIMIT_MAX_WAIT', '0.2')
+    limiter = get_limiter('deepseek')
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with limiter.acquire():
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait(5)
+
+    async def run():
+        async with get_async_ai_client('deepseek') as client:
+            return [item async for item in client.generate_many([{'student_name': '李四', 'student_info': '爱画画'}])]
+
+    try:
+        [item] = asyncio.run(run())
+        assert '请求过多' in item['error']
+    finally:
+        release.set()
+        thread.join()
+
+    # 名额释放后恢复正常
+    [item] = asyncio.run(run())
+    assert item['comment'] == MOCK_COMMENT
+
+
+def test_async_token_bucket_waits_without_blocking():
+    bucket = TokenBucket(600)  # 每秒 10 个
+    bucket.acquire(600, time.monotonic() + 1)
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        start = time.monotonic()
+        await bucket.acquire_async(2, time.monotonic() + 5)
+        elapsed = time.monotonic() - start
+        ticker.cancel()
+        return elapsed, ticks
+
+    elapsed, ticks = asyncio.run(run())
+    assert 0.1 <= elapsed < 1
+    # 等待期间事件循环仍在运行其他任务
+    assert ticks >= 5
+
+
+@pytest.mark.usefixtures('fresh_provider_health')
+def test_retries_requeue_through_limiter(monkeypatch):
+    """服务商一直返回 429：每次重试都重新排队、计入 RPM，等待期间不占用名额"""
+    server = start_mock_llm(latency='0', rate_limit_rate=1.0, retry_after=0.01)
+    monkeypatch.setenv('AI_MAX_RETRIES', '2')
+    monkeypatch.setenv('DEEPSEEK_API_KEY', 'test-retry-key')
+    monkeypatch.setenv('DEEPSEEK_BASE_URL', server.openai_url)
+
+    async def run():
+        async with get_async_ai_client('deepseek') as client:
+            await client.generate('张三', '开朗')
+
+    try:
+        with pytest.raises(Exception, match='429'):
+            asyncio.run(run())
+    finally:
+        server.shutdown()
+    stats = get_limiter('deepseek').stats()
+    assert (stats['acquired'], stats['in_flight']) == (3, 0)
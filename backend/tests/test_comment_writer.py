@@ -0,0 +1,101 @@
+"""评语组提交写入器"""
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from models import CommentWriter, _usage_values, get_database
+
+
+def row(user_id, name, comment='评语'):
+    return (user_id, name, '开朗', comment, 'deepseek') + _usage_values(None) + (0, None)
+
+
+def saved(ids):
+    with get_database().connection() as conn:
+        placeholders = ','.join('?' * len(ids))
+        return [r[0] for r in conn.execute(
+            f'SELECT student_name FROM comments WHERE id IN ({placeholders}) ORDER BY id', ids)]
+
+
+def test_queued_requests_share_one_transaction(auth):
+    user_id, _ = auth
+    writer = CommentWriter(max_batch=10, max_delay=0.2)
+    futures = [writer.submit([row(user_id, f'学生{i}')]) for i in range(5)]
+    ids = [future.result(5)[0] for future in futures]
+    assert saved(ids) == [f'学生{i}' for i in range(5)]
+    stats = writer.stats()
+    assert (stats['groups'], stats['requests'], stats['max_group']) == (1, 5, 5)
+
+
+def test_failed_group_retried_one_by_one(auth):
+    """组内一个请求出错：其余请求逐个重新提交，不受影响"""
+    user_id, _ = auth
+    writer = CommentWriter(max_batch=10, max_delay=0.2)
+    good = writer.submit([row(user_id, '张三')])
+    bad = writer.submit([row(user_id, '李四', comment=None)])  # generated_comment NOT NULL
+    other = writer.submit([row(user_id, '王五'), row(user_id, '赵六')])
+
+    with pytest.raises(sqlite3.IntegrityError):
+        bad.result(5)
+    assert saved(good.result(5) + other.result(5)) == ['张三', '王五', '赵六']
+    stats = writer.stats()
+    assert (stats['errors'], stats['groups'], stats['rows']) == (1, 2, 3)
+
+
+def test_full_queue_applies_backpressure(auth, monkeypatch):
+    """等待写入的请求达到上限时，调用方等待而不是丢弃请求"""
+    user_id, _ = auth
+    writer = CommentWriter(max_batch=1, queue_size=1)
+    release = threading.Event()
+    original = writer._write
+
+    def slow_write(conn, group):
+        release.wait(5)
+        original(conn, group)
+
+    monkeypatch.setattr(writer, '_write', slow_write)
+    first = writer.submit([row(user_id, '张三')])
+    time.sleep(0.1)  # 写线程已取走第一个请求，卡在提交上
+    second = writer.submit([row(user_id, '李四')])  # 占满队列
+
+    third = []
+    submitter = threading.Thread(target=lambda: third.append(writer.submit([row(user_id, '王五')])))
+    submitter.start()
+    submitter.join(0.2)
+    assert submitter.is_alive() and writer.stats()['pending'] == 1
+
+    release.set()
+    submitter.join(5)
+    ids = first.result(5) + second.result(5) + third[0].result(5)
+    assert saved(ids) == ['张三', '李四', '王五']
+
+
+# 模拟写线程意外退出，SystemExit 会被当作线程中未处理的异常报告
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_writer_thread_restarted(auth, monkeypatch):
+    """写线程意外退出：手上的请求立即失败（不会一直等待），下一次提交时重新启动写线程"""
+    user_id, _ = auth
+    writer = CommentWriter()
+    original = writer._commit
+    calls = []
+
+    def dying_commit(conn, group):
+        calls.append(len(group))
+        if len(calls) == 1:
+            raise SystemExit
+        original(conn, group)
+
+    monkeypatch.setattr(writer, '_commit', dying_commit)
+    lost = writer.submit([row(user_id, '张三')])
+    with pytest.raises(RuntimeError, match='写入线程'):
+        lost.result(5)
+    thread = writer._thread
+    thread.join(5)
+    assert not thread.is_alive()
+
+    ids = writer.write([row(user_id, '李四')])
+    assert writer._thread is not thread and writer._thread.is_alive()
+    assert saved(ids) == ['李四']
@@ -0,0 +1,111 @@
+"""评语导出（CSV / XLSX / DOCX）"""
+
+import csv
+import io
+import zipfile
+from xml.etree.ElementTree import fromstring
+
+import pytest
+
+from models import Comment, get_database
+from utils import export
+from utils.export import export_comments
+from utils.roster import iter_xlsx_rows
+
+ROWS = [
+    {'student_name': '张三', 'class_name': '一班', 'student_info': '开朗', 'generated_comment': '=SUM(A1)',
+     'ai_model': 'deepseek', 'created_at': '2026-01-01 08:00:00'},
+    {'student_name': '李四', 'class_name': '一班', 'student_info': '安静\x01', 'generated_comment': '第一行\n第二行',
+     'ai_model': 'qwen', 'created_at': '2026-01-01 09:00:00'},
+    {'student_name': '王五', 'class_name': None, 'student_info': '<b>&', 'generated_comment': '评语',
+     'ai_model': 'kimi', 'created_at': '2026-01-02 08:00:00'},
+]
+
+WORD = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def render(file_format, rows=ROWS, group_by_class=False):
+    return b''.join(export_comments(file_format, iter(rows), group_by_class))
+
+
+def test_csv(monkeypatch):
+    monkeypatch.setattr(export, 'CSV_ROWS_PER_CHUNK', 2)
+    chunks = list(export_comments('csv', iter(ROWS)))
+    assert len(chunks) == 3  # 表头 + 两段
+
+    text = b''.join(chunks).decode('utf-8')
+    assert text.startswith('\ufeff')
+    rows = list(csv.reader(io.StringIO(text[1:])))
+    assert rows[0] == ['学生姓名', '班级', '学生信息', '评语', '模型', '生成时间']
+    assert rows[1][3] == "'=SUM(A1)"
+    assert rows[2][3] == '第一行\n第二行'
+    assert len(rows) == 4
+
+
+def test_xlsx_grouped_by_class():
+    rows = sorted(ROWS, key=lambda row: row['class_name'] or '')
+    archive = zipfile.ZipFile(io.BytesIO(render('xlsx', rows, group_by_class=True)))
+    assert archive.testzip() is None
+    workbook = archive.read('xl/workbook.xml').decode('utf-8')
+    assert '未分班' in workbook and '一班' in workbook
+
+    # 用名单导入的读取器读回第一个工作表（没有班级的排在最前面）
+    values = list(iter_xlsx_rows(io.BytesIO(render('xlsx', rows, group_by_class=True))))
+    assert values[0][0] == '学生姓名'
+    assert values[1][:3] == ['王五', '', '<b>&']
+
+
+def test_xlsx_strips_invalid_xml_characters():
+    values = list(iter_xlsx_rows(io.BytesIO(render('xlsx'))))
+    assert [row[0] for row in values] == ['学生姓名', '张三', '李四', '王五']
+    assert values[2][2] == '安静'
+
+
+def test_empty_xlsx_has_header_sheet():
+    assert list(iter_xlsx_rows(io.BytesIO(render('xlsx', [])))) == [
+        ['学生姓名', '班级', '学生信息', '评语', '模型', '生成时间']]
+
+
+def test_docx_sections():
+    rows = sorted(ROWS, key=lambda row: row['class_name'] or '')
+    archive = zipfile.ZipFile(io.BytesIO(render('docx', rows, group_by_class=True)))
+    document = fromstring(archive.read('word/document.xml'))
+    paragraphs = [''.join(node.text or '' for node in p.iter(WORD + 't')) for p in document.iter(WORD + 'p')]
+    assert paragraphs[:4] == ['学生评语', '未分班', '王五', '评语']
+    assert '一班' in paragraphs
+    assert len(list(document.iter(WORD + 'pageBreakBefore'))) == 1
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        export_comments('pdf', iter(ROWS))
+
+
+def test_export_endpoint(client, auth):
+    user_id, headers = auth
+    Comment.create(user_id, '张三', '开朗', '评语', 'deepseek', class_name='一班')
+    response = client.get('/api/comment/export', headers=headers, query_string={'format': 'csv'})
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'].endswith('.csv"')
+    assert '张三' in response.get_data().decode('utf-8')
+    assert client.get('/api/comment/export', headers=headers, query_string={'format': 'pdf'}).status_code == 400
+
+
+def test_export_pages_do_not_hold_read_snapshot(auth):
+    """逐页读取：翻页之间不占连接、不保持读事务，检查点可以清空 WAL"""
+    user_id, _ = auth
+    ids = {}
+    for name, class_name in [('甲', '二班'), ('乙', None), ('丙', '一班'), ('丁', '二班'), ('戊', None), ('己', '一班')]:
+        ids[name] = Comment.create(user_id, name, '开朗', '评语', 'deepseek', class_name=class_name)
+
+    rows = Comment.iter_for_export(user_id, group_by_class=True, batch_size=2)
+    first = next(rows)
+    with get_database().connection() as conn:
+        busy, _, _ = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    assert busy == 0
+
+    names = [first['student_name']] + [row['student_name'] for row in rows]
+    assert names == ['乙', '戊', '丙', '己', '甲', '丁']
+    assert [row['student_name'] for row in Comment.iter_for_export(user_id, batch_size=2)] == list(ids)
+    assert [row['student_name'] for row in Comment.iter_for_export(user_id, class_name='二班', batch_size=1)] \
+        == ['甲', '丁']
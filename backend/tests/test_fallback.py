@@ -0,0 +1,117 @@
+"""降级模式（模板评语）"""
+
+import uuid
+
+import pytest
+
+from models import get_database
+from tests.test_usage import sse_events
+from utils.ai_client import (DeepSeekClient, FallbackClient, ProviderUnavailableError, fallback_reason,
+                             template_client)
+from utils.metrics import ai_fallback_generations
+from utils.provider_stats import provider_health
+from utils.rate_limit import RateLimitTimeout
+
+pytestmark = pytest.mark.usefixtures('fresh_provider_health')
+
+
+class FailingClient:
+    provider = 'deepseek'
+    model = 'deepseek-chat'
+    display_name = 'DeepSeek'
+
+    def __init__(self, error):
+        self.error = error
+
+    def generate(self, student_name, student_info):
+        raise self.error
+
+
+def fallback_count(reason):
+    return ai_fallback_generations._values.get(('deepseek', reason), 0)
+
+
+def open_breaker(provider='deepseek'):
+    for _ in range(provider_health.failure_threshold):
+        provider_health.record_failure(provider)
+
+
+def needs_regeneration(comment_id):
+    with get_database().connection() as conn:
+        row = conn.execute('SELECT needs_regeneration, ai_model FROM comments WHERE id = ?',
+                           (comment_id,)).fetchone()
+    return bool(row[0]), row[1]
+
+
+def test_fallback_reason():
+    assert fallback_reason(ProviderUnavailableError()) == 'unavailable'
+    assert fallback_reason(RateLimitTimeout()) == 'overloaded'
+    assert fallback_reason(RuntimeError('500')) == 'error'
+
+
+def test_fallback_client_uses_template():
+    before = fallback_count('overloaded')
+    client = FallbackClient(FailingClient(RateLimitTimeout('排队超时')))
+    result = client.generate('张三', '性格开朗，热爱阅读')
+    assert result.fallback and result.provider == template_client.provider
+    assert '张三' in result.comment
+    assert fallback_count('overloaded') == before + 1
+    assert (client.provider, client.display_name) == ('deepseek', 'DeepSeek')
+
+
+def test_generate_falls_back_then_regenerates(client, auth, ai_provider):
+    """服务商熔断时返回模板评语并标记；恢复后 /api/comment/regenerate 替换为正式评语"""
+    _, headers = auth
+    open_breaker()
+    response = client.post('/api/comment/generate', headers=headers, json={
+        'student_name': '张三', 'student_info': f'开朗 {uuid.uuid4().hex}', 'ai_model': 'deepseek'})
+    assert response.status_code == 200, response.json
+    assert response.json['needs_regeneration'] is True
+    comment_id = response.json['comment_id']
+    assert needs_regeneration(comment_id) == (True, 'template')
+
+    # 仍然熔断：重新生成失败，评语保持原样
+    response = client.post('/api/comment/regenerate', headers=headers, json={'ai_model': 'deepseek'})
+    assert response.json['succeeded'] == 0 and response.json['failed'] == 1
+    assert needs_regeneration(comment_id) == (True, 'template')
+
+    provider_health.record_probe('deepseek', ok=True)
+    response = client.post('/api/comment/regenerate', headers=headers, json={'ai_model': 'deepseek'})
+    assert response.json['succeeded'] == 1 and response.json['remaining'] is False
+    assert needs_regeneration(comment_id) == (False, 'deepseek')
+
+
+def test_fallback_disabled_returns_error(client, auth, ai_provider, monkeypatch):
+    _, headers = auth
+    monkeypatch.setenv('AI_FALLBACK', '0')
+    open_breaker()
+    response = client.post('/api/comment/generate', headers=headers, json={
+        'student_name': '张三', 'student_info': f'开朗 {uuid.uuid4().hex}', 'ai_model': 'deepseek'})
+    assert response.status_code >= 400
+    assert response.json['success'] is False
+
+
+def test_stream_falls_back_before_first_token(client, auth, ai_provider):
+    _, headers = auth
+    open_breaker()
+    response = client.post('/api/comment/generate/stream', headers=headers, json={
+        'student_name': '李四', 'student_info': f'安静 {uuid.uuid4().hex}', 'ai_model': 'deepseek'})
+    events = sse_events(response.data)
+    assert [name for name, _ in events] == ['token', 'done']
+    assert events[-1][1]['needs_regeneration'] is True and events[-1][1]['ai_model'] == 'template'
+
+
+def test_stream_error_after_first_token_is_not_replaced(client, auth, ai_provider, monkeypatch):
+    """已经输出文本之后失败：发送 error 事件，不改用模板评语，也不保存"""
+    _, headers = auth
+
+    def broken_stream(self, student_name, student_info):
+        yield '开头'
+        raise RuntimeError('连接中断')
+
+    monkeypatch.setattr(DeepSeekClient, '_stream', broken_stream)
+    response = client.post('/api/comment/generate/stream', headers=headers, json={
+        'student_name': '王五', 'student_info': f'活泼 {uuid.uuid4().hex}', 'ai_model': 'deepseek'})
+    events = sse_events(response.data)
+    assert [name for name, _ in events] == ['token', 'error']
+    assert client.get('/api/comment/history', headers=headers).json['comments'] == []
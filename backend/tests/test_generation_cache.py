@@ -0,0 +1,145 @@
+"""评语生成缓存"""
+
+import threading
+import time
+import uuid
+
+from models import GenerationCacheEntry
+from utils.ai_client import GenerationResult
+from utils.generation_cache import GenerationCache, normalize_text
+
+
+class CountingClient:
+    """记录调用次数的假客户端"""
+
+    provider = 'deepseek'
+    model = 'deepseek-chat'
+
+    def __init__(self, delay=0.0, fallback=False):
+        self.calls = 0
+        self.delay = delay
+        self.fallback = fallback
+        self._lock = threading.Lock()
+
+    def generate(self, student_name, student_info):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return GenerationResult(f'{student_name}：评语{self.calls}', self.provider, self.model,
+                                latency=0.5, usage={'prompt_tokens': 10, 'completion_tokens': 5},
+                                fallback=self.fallback)
+
+
+def test_normalize_text():
+    assert normalize_text('  性格　开朗 ，  喜欢ＡＢＣ  ') == '性格 开朗,喜欢ABC'
+    assert normalize_text(None) == ''
+
+
+def test_key_ignores_formatting_but_not_content():
+    client = CountingClient()
+    key = GenerationCache.make_key(client, '张三', '性格开朗，喜欢阅读')
+    assert GenerationCache.make_key(client, ' 张三 ', '性格开朗 ,  喜欢阅读') == key
+    assert GenerationCache.make_key(client, '张三', '性格开朗，喜欢画画') != key
+    assert GenerationCache.make_key(client, '李四', '性格开朗，喜欢阅读') != key
+
+    other_model = CountingClient()
+    other_model.model = 'deepseek-reasoner'
+    assert GenerationCache.make_key(other_model, '张三', '性格开朗，喜欢阅读') != key
+
+
+def test_hit_returns_copy_without_usage():
+    cache = GenerationCache(max_size=10, ttl=60)
+    client = CountingClient()
+    first = cache.generate(client, '张三', '开朗')
+    second = cache.generate(client, '张三', '开朗 ')
+    assert client.calls == 1
+    assert second.comment == first.comment
+    assert (second.latency, second.usage['prompt_tokens']) == (0.0, 0)
+    assert first.usage['prompt_tokens'] == 10
+
+    fresh = cache.generate(client, '张三', '开朗', force_fresh=True)
+    assert client.calls == 2 and cache.generate(client, '张三', '开朗').comment == fresh.comment
+    assert cache.stats()['force_fresh'] == 1
+
+
+def test_fallback_results_not_cached():
+    cache = GenerationCache(max_size=10, ttl=60)
+    client = CountingClient(fallback=True)
+    cache.generate(client, '张三', '开朗')
+    cache.generate(client, '张三', '开朗')
+    assert client.calls == 2
+
+
+def test_concurrent_misses_share_one_call():
+    cache = GenerationCache(max_size=10, ttl=60)
+    client = CountingClient(delay=0.1)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.generate(client, '张三', '开朗')))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.calls == 1
+    assert {result.comment for result in results} == {'张三：评语1'}
+    assert cache.stats()['inflight_hits'] == 4
+
+
+def test_persistent_store_survives_restart():
+    info = f'开朗 {uuid.uuid4().hex}'
+    client = CountingClient()
+    GenerationCache(store=GenerationCacheEntry, max_size=10, ttl=60).generate(client, '张三', info)
+
+    # 新的缓存实例（进程重启）：内存为空，从持久层读取
+    restarted = GenerationCache(store=GenerationCacheEntry, max_size=10, ttl=60)
+    assert restarted.generate(client, '张三', info).comment == '张三：评语1'
+    assert client.calls == 1
+    assert restarted.stats()['persistent_hits'] == 1
+
+
+class Killed(BaseException):
+    """模拟协程被杀（gevent.GreenletExit 等不是 Exception 的子类）"""
+
+
+def test_follower_not_stuck_when_leader_killed():
+    cache = GenerationCache(max_size=10, ttl=60, inflight_wait=5)
+    client = CountingClient()
+    started, release = threading.Event(), threading.Event()
+
+    class LeaderClient(CountingClient):
+        def generate(self, student_name, student_info):
+            started.set()
+            release.wait(5)
+            raise Killed()
+
+    def leader():
+        try:
+            cache.generate(LeaderClient(), '张三', '开朗')
+        except Killed:
+            pass
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    assert started.wait(5)
+    results = []
+    follower = threading.Thread(target=lambda: results.append(cache.generate(client, '张三', '开朗')))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    thread.join(5)
+    follower.join(5)
+    assert not follower.is_alive()
+    assert [result.comment for result in results] == ['张三：评语1'] and client.calls == 1
+    assert cache.stats()['inflight_timeouts'] == 1
+
+
+def test_follower_wait_is_bounded():
+    cache = GenerationCache(max_size=10, ttl=60, inflight_wait=0.05)
+    slow, fast = CountingClient(delay=1.0), CountingClient()
+    leader = threading.Thread(target=lambda: cache.generate(slow, '张三', '开朗'))
+    leader.start()
+    time.sleep(0.02)
+    start = time.monotonic()
+    assert cache.generate(fast, '张三', '开朗').comment == '张三：评语1'
+    assert time.monotonic() - start < 0.5 and fast.calls == 1
+    leader.join()
@@ -0,0 +1,72 @@
+"""gunicorn gevent 配置冒烟测试（启动真实的 gunicorn 进程）"""
+
+import sqlite3
+import threading
+import time
+import uuid
+
+import pytest
+import requests
+
+pytest.importorskip('gevent')
+pytest.importorskip('gunicorn')
+
+from loadtest.common import backend_env, free_port, start_server, stop_server  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def gevent_server(mock_llm):
+    """按生产配置（gunicorn.conf.py，gevent worker）启动后端，bcrypt 使用进程池配置"""
+    port = free_port()
+    env = backend_env(mock_llm, WEB_CONCURRENCY='1', PASSWORD_HASH_WORKERS='2', DB_BUSY_TIMEOUT_MS='5000')
+    process = start_server('gevent', port, env)
+    yield f'http://127.0.0.1:{port}', env['DATABASE_PATH']
+    stop_server(process)
+
+
+def login(base_url):
+    username = f'teacher_{uuid.uuid4().hex[:12]}'
+    credentials = {'username': username, 'password': 'pw123456'}
+    assert requests.post(base_url + '/api/register', json=credentials, timeout=10).status_code == 201
+    response = requests.post(base_url + '/api/login', json=credentials, timeout=10)
+    assert response.status_code == 200
+    return {'Authorization': f"Bearer {response.json()['token']}"}
+
+
+def generate(base_url, headers):
+    return requests.post(base_url + '/api/comment/generate', headers=headers, timeout=30, json={
+        'student_name': '张三', 'student_info': f'开朗 {uuid.uuid4().hex}', 'ai_model': 'deepseek'})
+
+
+def test_login_and_comment_write(gevent_server):
+    base_url, _ = gevent_server
+    headers = login(base_url)
+    response = generate(base_url, headers)
+    assert response.status_code == 200, response.text
+    comment_id = response.json()['comment_id']
+
+    history = requests.get(base_url + '/api/comment/history', headers=headers, timeout=10).json()
+    assert [comment['id'] for comment in history['comments']] == [comment_id]
+
+
+def test_waiting_for_write_lock_does_not_block_other_requests(gevent_server):
+    """评语写入在等待 SQLite 写锁时，同一进程中的其他请求照常响应"""
+    base_url, database_path = gevent_server
+    headers = login(base_url)
+
+    blocker = sqlite3.connect(database_path, isolation_level=None)
+    blocker.execute('BEGIN IMMEDIATE')
+    results = []
+    writer = threading.Thread(target=lambda: results.append(generate(base_url, headers)))
+    try:
+        writer.start()
+        time.sleep(0.5)  # 写入请求已经在等待写锁
+        start = time.monotonic()
+        assert requests.get(base_url + '/', timeout=5).status_code == 200
+        assert time.monotonic() - start < 1
+        assert not results
+    finally:
+        blocker.rollback()
+        blocker.close()
+        writer.join(30)
+    assert results[0].status_code == 200, results[0].text
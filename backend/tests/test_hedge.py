@@ -0,0 +1,129 @@
+"""对冲请求"""
+
+import threading
+import time
+
+import pytest
+
+from utils import ai_client
+from utils.ai_client import (DeepSeekClient, FallbackClient, GenerationResult, HedgedClient, HedgePool,
+                             QwenClient, _check_cancelled, fallback_reason, get_http_pool_size)
+from utils.rate_limit import RateLimitTimeout
+
+
+class FakeClient:
+    """按给定耗时返回结果（或抛出异常）的假客户端，等待期间检查对冲取消标记"""
+
+    def __init__(self, provider, delay=0.0, error=None):
+        self.provider = provider
+        self.model = f'{provider}-model'
+        self.display_name = provider
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = threading.Event()
+        self.threads = []
+
+    def generate(self, student_name, student_info):
+        self.calls += 1
+        self.threads.append(threading.current_thread())
+        deadline = time.monotonic() + self.delay
+        while time.monotonic() < deadline:
+            try:
+                _check_cancelled()
+            except ai_client.HedgeCancelled:
+                self.cancelled.set()
+                raise
+            time.sleep(0.005)
+        if self.error is not None:
+            raise self.error
+        return GenerationResult(f'{self.provider}的评语', self.provider, self.model, latency=self.delay)
+
+
+@pytest.fixture
+def hedge_pool(monkeypatch):
+    """每个测试使用新的对冲线程池（大小可调）"""
+    def make(max_workers=4):
+        pool = HedgePool(max_workers)
+        monkeypatch.setattr(ai_client, '_hedge_pool', pool)
+        return pool
+    return make
+
+
+def hedged(primary, secondary, delay=0.05):
+    client = HedgedClient(primary, secondary)
+    client.default_delay = delay
+    client.min_samples = 10 ** 6
+    return client
+
+
+def test_fast_primary_skips_hedge(hedge_pool):
+    hedge_pool()
+    primary, secondary = FakeClient('deepseek'), FakeClient('kimi')
+    assert hedged(primary, secondary).generate('张三', '开朗').provider == 'deepseek'
+    assert secondary.calls == 0
+
+
+def test_secondary_wins_and_primary_is_cancelled(hedge_pool):
+    hedge_pool()
+    primary, secondary = FakeClient('deepseek', delay=5), FakeClient('kimi', delay=0.01)
+    start = time.monotonic()
+    result = hedged(primary, secondary).generate('张三', '开朗')
+    assert result.provider == 'kimi'
+    assert time.monotonic() - start < 1
+    # 慢的主请求在下一个检查点停止，不会一直占着对冲线程
+    assert primary.cancelled.wait(1)
+
+
+def test_both_fail_raises_primary_error(hedge_pool):
+    hedge_pool()
+    primary = FakeClient('deepseek', error=RateLimitTimeout('排队超时'))
+    secondary = FakeClient('kimi', error=RuntimeError('kimi 调用失败'))
+    with pytest.raises(RateLimitTimeout) as excinfo:
+        hedged(primary, secondary).generate('张三', '开朗')
+    assert secondary.calls == 1
+    # 保留原始异常类型：降级原因仍然是排队超时
+    assert fallback_reason(excinfo.value) == 'overloaded'
+
+
+def test_saturated_pool_runs_primary_inline_without_hedge(hedge_pool):
+    pool = hedge_pool(max_workers=1)
+    blocker = threading.Event()
+    occupied = pool.try_submit(blocker.wait)
+    try:
+        assert pool.try_submit(lambda: None) is None
+        primary, secondary = FakeClient('deepseek', delay=0.1), FakeClient('kimi')
+        assert hedged(primary, secondary).generate('张三', '开朗').provider == 'deepseek'
+        assert primary.threads == [threading.current_thread()]
+        assert secondary.calls == 0
+    finally:
+        blocker.set()
+        occupied.result()
+    # 线程用完后名额归还
+    assert pool.try_submit(lambda: 1).result() == 1
+
+
+def test_no_free_worker_for_hedge_waits_for_primary(hedge_pool):
+    hedge_pool(max_workers=1)
+    primary, secondary = FakeClient('deepseek', delay=0.2), FakeClient('kimi')
+    assert hedged(primary, secondary).generate('张三', '开朗').provider == 'deepseek'
+    assert secondary.calls == 0
+
+
+def test_pool_size_follows_batch_concurrency(monkeypatch, fresh_limiters):
+    monkeypatch.delenv('AI_HEDGE_WORKERS', raising=False)
+    monkeypatch.setenv('AI_MAX_INFLIGHT', '0')
+    monkeypatch.setenv('AI_MAX_CONCURRENCY', '64')
+    assert ai_client.get_hedge_pool_size() == 128
+    assert get_http_pool_size('deepseek') == 128
+    monkeypatch.setenv('AI_HEDGE_WORKERS', '40')
+    assert ai_client.get_hedge_pool_size() == 40
+
+
+def test_wrappers_report_primary_identity():
+    primary = DeepSeekClient('test-key')
+    for wrapper in (FallbackClient(primary), HedgedClient(primary, QwenClient('test-key')),
+                    FallbackClient(HedgedClient(primary, QwenClient('test-key')))):
+        assert (wrapper.provider, wrapper.model, wrapper.display_name) == \
+            ('deepseek', primary.model, primary.display_name)
+        assert not hasattr(wrapper, 'session')
@@ -0,0 +1,83 @@
+"""评语历史（键集分页）"""
+
+import sqlite3
+
+from models import Comment, get_database
+
+
+def add_comments(user_id, count, created_at=None):
+    ids = [Comment.create(user_id, f'学生{i}', f'信息{i}', f'评语{i}', 'deepseek') for i in range(count)]
+    if created_at is not None:
+        # 同一秒内生成的多条评语：只能靠 id 区分先后
+        with get_database().connection() as conn:
+            conn.executemany('UPDATE comments SET created_at = ? WHERE id = ?', [(created_at, i) for i in ids])
+            conn.commit()
+    return ids
+
+
+def pages(client, headers, limit):
+    """按 next_cursor 翻完所有页，返回每页的评语ID"""
+    result = []
+    params = {'limit': limit}
+    while True:
+        response = client.get('/api/comment/history', headers=headers, query_string=params)
+        assert response.status_code == 200
+        body = response.json
+        result.append([comment['id'] for comment in body['comments']])
+        if body['next_cursor'] is None:
+            return result
+        params = dict(body['next_cursor'], limit=limit)
+
+
+def test_cursor_walks_every_comment_once(client, auth):
+    user_id, headers = auth
+    older = add_comments(user_id, 3, created_at='2026-01-01 08:00:00')
+    newer = add_comments(user_id, 4, created_at='2026-01-02 08:00:00')
+
+    result = pages(client, headers, limit=3)
+    assert result == [newer[::-1][:3], [newer[0]] + older[::-1][:2], [older[0]]]
+
+
+def test_exact_page_has_no_next_cursor(client, auth):
+    user_id, headers = auth
+    ids = add_comments(user_id, 2)
+    assert pages(client, headers, limit=2) == [ids[::-1]]
+
+
+def test_history_only_shows_own_comments(client, auth, make_user):
+    user_id, headers = auth
+    add_comments(user_id, 1)
+    _, other = make_user()
+    assert pages(client, headers=other, limit=5) == [[]]
+
+
+def test_limit_clamped(client, auth, app, monkeypatch):
+    user_id, headers = auth
+    add_comments(user_id, 4)
+    monkeypatch.setitem(app.config, 'HISTORY_MAX_LIMIT', 2)
+    body = client.get('/api/comment/history', headers=headers, query_string={'limit': 100}).json
+    assert len(body['comments']) == 2 and body['next_cursor'] is not None
+
+
+def test_malformed_cursor_rejected(client, auth):
+    user_id, headers = auth
+    add_comments(user_id, 2)
+    for params in ({'before_id': 5}, {'before_ts': '2026-01-01 08:00:00'},
+                   {'before_ts': '2026-01-01 08:00:00', 'before_id': 'abc'}):
+        response = client.get('/api/comment/history', headers=headers, query_string=params)
+        assert response.status_code == 400, params
+        assert response.json['success'] is False
+
+
+def test_database_error_returns_json_500(client, auth, monkeypatch):
+    """查询出错发生在返回响应之前：返回 500 JSON，而不是中断的 200"""
+    _, headers = auth
+
+    def broken(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+        yield
+
+    monkeypatch.setattr(Comment, 'iter_by_user', staticmethod(broken))
+    response = client.get('/api/comment/history', headers=headers)
+    assert response.status_code == 500
+    assert response.json['success'] is False
@@ -0,0 +1,113 @@
+"""后台生成任务"""
+
+import threading
+import time
+import uuid
+
+import pytest
+
+from jobs import JobWorkerPool
+from models import GenerationJob, get_database
+
+
+def locked_until(job_id):
+    with get_database().connection() as conn:
+        return conn.execute('SELECT locked_until FROM generation_jobs WHERE id = ?', (job_id,)).fetchone()[0]
+
+
+def claim(job_id, lease_seconds):
+    """领取指定的任务（数据库中可能还有其他测试留下的任务）"""
+    for _ in range(20):
+        job = GenerationJob.claim(lease_seconds)
+        if job is None:
+            return None
+        if job['id'] == job_id:
+            return job
+        GenerationJob.fail(job, '测试中忽略')
+    return None
+
+
+def test_renew_only_extends_own_attempt(auth):
+    user_id, _ = auth
+    job_id = GenerationJob.create(user_id, '张三', f'开朗 {uuid.uuid4().hex}', 'deepseek')
+    job = claim(job_id, lease_seconds=1)
+    before = locked_until(job_id)
+
+    assert GenerationJob.renew([job], lease_seconds=60) == 1
+    assert locked_until(job_id) > before + 50
+
+    # 过期的尝试（已被重新领取）不能续约
+    stale = dict(job, attempts=job['attempts'] - 1)
+    assert GenerationJob.renew([stale], lease_seconds=600) == 0
+    assert locked_until(job_id) < time.time() + 100
+    assert GenerationJob.renew([], lease_seconds=60) == 0
+
+
+def test_long_attempt_keeps_lease(auth):
+    """一次尝试比租约长：执行期间持续续约，不会被其他工作线程重复领取"""
+    user_id, _ = auth
+    job_id = GenerationJob.create(user_id, '李四', f'安静 {uuid.uuid4().hex}', 'deepseek')
+    pool = JobWorkerPool(num_workers=1, poll_interval=0.02, lease_seconds=0.3)
+    started = threading.Event()
+    attempts = []
+
+    def process(job):
+        if job['id'] != job_id:
+            GenerationJob.fail(job, '测试中忽略')
+            return
+        attempts.append(job['attempts'])
+        started.set()
+        time.sleep(1.0)
+        GenerationJob.complete(job, '评语')
+
+    pool.process = process
+    pool.ensure_started()
+    try:
+        assert started.wait(5)
+        time.sleep(0.5)
+        assert locked_until(job_id) > time.time()
+        assert GenerationJob.claim(0.3) is None
+    finally:
+        pool.stop()
+
+    assert attempts == [1]
+    assert GenerationJob.get(job_id, user_id)['status'] == 'succeeded'
+
+
+# 模拟线程意外退出，SystemExit 会被当作线程中未处理的异常报告
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_worker_survives_process_errors_and_is_respawned(auth):
+    """process 抛出异常时工作线程不退出；线程意外退出后 ensure_started 重新启动"""
+    user_id, _ = auth
+    job_ids = [GenerationJob.create(user_id, '王五', f'活泼 {uuid.uuid4().hex}', 'deepseek') for _ in range(3)]
+    pool = JobWorkerPool(num_workers=1, poll_interval=0.02, lease_seconds=30)
+    seen = []
+    done = threading.Event()
+
+    def process(job):
+        if job['id'] not in job_ids:
+            GenerationJob.fail(job, '测试中忽略')
+            return
+        seen.append(job['id'])
+        if len(seen) == 1:
+            raise RuntimeError('database is locked')
+        if len(seen) == 2:
+            raise SystemExit  # 线程退出
+        GenerationJob.complete(job, '评语')
+        done.set()
+
+    pool.process = process
+    pool.ensure_started()
+    try:
+        worker = pool._threads[0]
+        deadline = time.time() + 5
+        while worker.is_alive() and time.time() < deadline:
+            time.sleep(0.02)
+        assert not worker.is_alive() and len(seen) == 2
+
+        pool.ensure_started()
+        assert done.wait(5)
+        assert all(thread.is_alive() for thread in pool._threads)
+    finally:
+        pool.stop()
+    assert len(seen) == 3
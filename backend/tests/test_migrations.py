@@ -0,0 +1,52 @@
+"""数据库迁移"""
+
+import sqlite3
+
+from models import MIGRATIONS, Database
+
+
+def tables(db):
+    with db.connection() as conn:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")}
+
+
+def test_migrate_new_database(tmp_path):
+    db = Database(str(tmp_path / 'new.db'))
+    latest = MIGRATIONS[-1][0]
+
+    assert db.migrate() == latest
+    assert db.get_schema_version() == latest
+    assert {'users', 'comments', 'generation_jobs', 'generation_cache', 'comments_fts',
+            'rosters', 'roster_students', 'idx_comments_user_created'} <= tables(db)
+
+    # 再次执行不做任何事
+    assert db.migrate() == latest
+    db.close_all()
+
+
+def test_migration_versions_are_sequential():
+    assert [version for version, _, _ in MIGRATIONS] == list(range(1, len(MIGRATIONS) + 1))
+
+
+def test_upgrade_keeps_existing_comments(tmp_path):
+    """在旧版本的数据库上升级：已有评语保留，并能被全文检索找到"""
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    for version, _, statements in MIGRATIONS[:6]:
+        for statement in statements:
+            conn.execute(statement)
+        conn.execute(f'PRAGMA user_version = {version}')
+    conn.execute("INSERT INTO users (username, password_hash) VALUES ('old', 'x')")
+    conn.execute("""INSERT INTO comments (user_id, student_name, student_info, generated_comment, ai_model)
+                    VALUES (1, '张三', '性格开朗', '张三同学热爱阅读', 'deepseek')""")
+    conn.commit()
+    conn.close()
+
+    db = Database(path)
+    assert db.migrate() == MIGRATIONS[-1][0]
+    with db.connection() as conn:
+        row = conn.execute('SELECT student_name, class_name, prompt_tokens FROM comments').fetchone()
+        assert tuple(row) == ('张三', None, 0)
+        found = conn.execute("SELECT rowid FROM comments_fts WHERE comments_fts MATCH '\"热爱阅读\"'").fetchall()
+        assert [r[0] for r in found] == [1]
+    db.close_all()
@@ -0,0 +1,81 @@
+"""密码哈希（进程池、排队上限）"""
+
+import threading
+import time
+import uuid
+
+import pytest
+
+from utils import passwords
+from utils.passwords import PasswordHasher, PasswordHasherBusy, hash_rounds, password_hasher
+
+
+def test_process_pool_hash_and_verify():
+    hasher = PasswordHasher(rounds=4, workers=1)
+    hashed = hasher.hash('pw123456')
+    assert hash_rounds(hashed) == 4
+    assert hasher.verify('pw123456', hashed) and not hasher.verify('wrong', hashed)
+    assert not hasher.needs_rehash(hashed)
+    assert PasswordHasher(rounds=5, workers=0).needs_rehash(hashed)
+    assert hasher.stats()['hashed'] == 1 and hasher.stats()['verified'] == 2
+
+
+@pytest.fixture
+def slow_hash(monkeypatch):
+    """哈希计算卡住，直到 release 被设置"""
+    started, release = threading.Event(), threading.Event()
+    original = passwords._hash
+
+    def blocking(password, rounds):
+        started.set()
+        release.wait(5)
+        return original(password, rounds)
+
+    monkeypatch.setattr(passwords, '_hash', blocking)
+    yield started, release
+    release.set()
+
+
+def test_full_queue_rejects_immediately(slow_hash):
+    started, release = slow_hash
+    hasher = PasswordHasher(rounds=4, workers=0, max_pending=1, queue_timeout=0)
+    worker = threading.Thread(target=hasher.hash, args=('pw123456',))
+    worker.start()
+    assert started.wait(5)
+
+    start = time.monotonic()
+    with pytest.raises(PasswordHasherBusy):
+        hasher.verify('pw123456', '$2b$04$' + 'x' * 53)
+    assert time.monotonic() - start < 0.5
+    assert hasher.stats()['rejected'] == 1
+
+    release.set()
+    worker.join(5)
+    assert hasher.stats()['pending'] == 0
+    hasher.hash('pw123456')  # 名额已归还
+
+
+def test_queue_timeout_waits_for_a_slot(slow_hash):
+    started, release = slow_hash
+    hasher = PasswordHasher(rounds=4, workers=0, max_pending=1, queue_timeout=5)
+    worker = threading.Thread(target=hasher.hash, args=('pw123456',))
+    worker.start()
+    assert started.wait(5)
+    threading.Timer(0.1, release.set).start()
+    assert hash_rounds(hasher.hash('pw123456')) == 4
+    worker.join(5)
+    assert hasher.stats()['rejected'] == 0
+
+
+def test_login_and_register_return_503_when_busy(client, monkeypatch):
+    credentials = {'username': f'teacher_{uuid.uuid4().hex[:12]}', 'password': 'pw123456'}
+    assert client.post('/api/register', json=credentials).status_code == 201
+
+    monkeypatch.setattr(password_hasher, '_slots', threading.BoundedSemaphore(1))
+    assert password_hasher._slots.acquire(blocking=False)  # 名额被占满
+    for path, body in (('/api/login', credentials),
+                       ('/api/register', dict(credentials, username=f'teacher_{uuid.uuid4().hex[:12]}'))):
+        response = client.post(path, json=body)
+        assert response.status_code == 503, path
+        assert response.json['success'] is False
+        assert int(response.headers['Retry-After']) > 0
@@ -0,0 +1,95 @@
+"""服务商熔断和 EWMA 路由"""
+
+import time
+
+import pytest
+
+from utils.ai_client import DeepSeekClient, ProviderUnavailableError, get_ai_client
+from utils.provider_stats import ProviderHealth, provider_health
+
+
+def test_breaker_opens_after_consecutive_failures():
+    health = ProviderHealth(failure_threshold=3, cooldown=60)
+    for _ in range(2):
+        health.record_failure('deepseek')
+    health.record_success('deepseek', 1.0)  # 成功一次，连续失败次数清零
+    for _ in range(2):
+        health.record_failure('deepseek')
+    assert health.is_available('deepseek')
+
+    health.record_failure('deepseek')
+    assert not health.is_available('deepseek')
+    assert health.snapshot()['deepseek']['state'] == ProviderHealth.OPEN
+
+
+def test_half_open_probe_recovers_or_reopens():
+    health = ProviderHealth(failure_threshold=1, cooldown=0.05)
+    health.record_failure('qwen')
+    assert not health.due_for_probe('qwen')  # 冷却中
+
+    time.sleep(0.06)
+    assert health.due_for_probe('qwen')
+    assert health.snapshot()['qwen']['state'] == ProviderHealth.HALF_OPEN
+    assert not health.is_available('qwen')  # 探测结果出来之前不接受正常请求
+
+    health.record_probe('qwen', ok=False)
+    assert health.snapshot()['qwen']['state'] == ProviderHealth.OPEN
+    assert not health.due_for_probe('qwen')  # 重新计算冷却时间
+
+    time.sleep(0.06)
+    assert health.due_for_probe('qwen')
+    health.record_probe('qwen', ok=True, latency=0.5)
+    assert health.is_available('qwen')
+
+
+def test_ewma_score_weights_latency_by_errors():
+    health = ProviderHealth(alpha=0.5, failure_threshold=100)
+    assert health.score('kimi') == 0.0  # 没有样本
+
+    health.record_success('deepseek', 2.0)
+    health.record_success('deepseek', 4.0)
+    assert health.score('deepseek') == pytest.approx(3.0)
+
+    health.record_success('qwen', 1.0)
+    health.record_failure('qwen')  # 错误率 0.5：评分 1.0 × (1 + 4 × 0.5)
+    assert health.score('qwen') == pytest.approx(3.0)
+    health.record_failure('qwen')
+    assert health.choose(['deepseek', 'qwen']) == 'deepseek'
+
+
+def test_choose_skips_open_breakers():
+    health = ProviderHealth(failure_threshold=1, cooldown=60)
+    health.record_success('deepseek', 5.0)
+    health.record_success('qwen', 1.0)
+    assert health.choose(['deepseek', 'qwen']) == 'qwen'
+
+    health.record_failure('qwen')
+    assert health.choose(['deepseek', 'qwen']) == 'deepseek'
+
+    # 全部熔断：选最早熔断的（最接近恢复）
+    health.record_failure('deepseek')
+    assert health.choose(['deepseek', 'qwen']) == 'qwen'
+    assert health.choose([]) is None
+
+
+@pytest.mark.usefixtures('fresh_provider_health', 'ai_provider')
+def test_auto_routes_to_fastest_healthy_provider():
+    provider_health.record_success('deepseek', 3.0)
+    provider_health.record_success('qwen', 1.0)
+    assert get_ai_client('auto').provider == 'qwen'
+
+    for _ in range(provider_health.failure_threshold):
+        provider_health.record_failure('qwen')
+    assert get_ai_client('auto').provider == 'deepseek'
+
+
+@pytest.mark.usefixtures('fresh_provider_health')
+def test_open_breaker_fails_fast(monkeypatch):
+    """熔断后不再发出请求（指向不存在的地址也不会等待连接超时）"""
+    monkeypatch.setenv('DEEPSEEK_BASE_URL', 'http://127.0.0.1:9/v1/chat/completions')
+    for _ in range(provider_health.failure_threshold):
+        provider_health.record_failure('deepseek')
+    start = time.monotonic()
+    with pytest.raises(ProviderUnavailableError):
+        DeepSeekClient('test-key').generate('张三', '开朗')
+    assert time.monotonic() - start < 0.5
@@ -0,0 +1,202 @@
+"""服务商限流和连接池大小"""
+
+import threading
+import time
+
+import pytest
+
+from loadtest.mock_llm import start_mock_llm
+from utils.ai_client import DeepSeekClient, get_http_pool_size, get_provider_concurrency
+from utils.rate_limit import ProviderLimiter, RateLimitTimeout, TokenBucket, get_limiter
+
+
+pytestmark = pytest.mark.usefixtures('fresh_limiters')
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(600)  # 每秒 10 个
+    deadline = time.monotonic() + 5
+    bucket.acquire(600, deadline)
+
+    start = time.monotonic()
+    bucket.acquire(2, deadline)
+    assert 0.1 <= time.monotonic() - start < 1
+
+    with pytest.raises(RateLimitTimeout):
+        bucket.acquire(600, time.monotonic() + 0.05)
+
+
+def test_inflight_cap_queues_then_times_out(monkeypatch):
+    monkeypatch.setenv('AI_MAX_INFLIGHT', '2')
+    monkeypatch.setenv('AI_RATE_LIMIT_MAX_WAIT', '0.1')
+    limiter = ProviderLimiter('deepseek')
+
+    with limiter.acquire(), limiter.acquire():
+        assert limiter.stats()['in_flight'] == 2
+        with pytest.raises(RateLimitTimeout):
+            with limiter.acquire():
+                pass
+    assert limiter.stats()['in_flight'] == 0
+    assert limiter.stats()['timeouts'] == 1
+
+    # 名额释放后可以继续获取
+    with limiter.acquire() as wait:
+        assert wait < 0.1
+
+
+def test_inflight_cap_bounds_concurrency(monkeypatch):
+    monkeypatch.setenv('AI_MAX_INFLIGHT', '3')
+    limiter = ProviderLimiter('deepseek')
+    peak = []
+    lock = threading.Lock()
+
+    def call():
+        with limiter.acquire():
+            with lock:
+                peak.append(limiter.stats()['in_flight'])
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=call) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 3
+    assert limiter.stats()['acquired'] == 12
+
+
+def test_provider_override(monkeypatch):
+    monkeypatch.setenv('AI_MAX_INFLIGHT', '16')
+    monkeypatch.setenv('KIMI_MAX_INFLIGHT', '2')
+    monkeypatch.setenv('KIMI_RPM', '3')
+    assert ProviderLimiter('kimi').max_inflight == 2
+    assert ProviderLimiter('kimi').requests.capacity == 3
+    assert ProviderLimiter('deepseek').max_inflight == 16
+    assert ProviderLimiter('deepseek').requests is None
+
+
+def test_http_pool_matches_inflight_cap(monkeypatch):
+    monkeypatch.setenv('AI_MAX_INFLIGHT', '24')
+    monkeypatch.setenv('AI_MAX_CONCURRENCY', '8')
+    client = DeepSeekClient('test-key')
+    assert client.session.get_adapter('https://api.deepseek.com')._pool_maxsize == 24
+    assert get_http_pool_size('deepseek') == 24
+
+
+def test_batch_concurrency_capped_by_inflight(monkeypatch):
+    monkeypatch.setenv('AI_MAX_INFLIGHT', '4')
+    monkeypatch.setenv('AI_MAX_CONCURRENCY', '64')
+    assert get_provider_concurrency('deepseek') == 4
+
+
+def test_unlimited_inflight_pool_covers_callers(monkeypatch):
+    monkeypatch.setenv('AI_MAX_INFLIGHT', '0')
+    monkeypatch.setenv('AI_MAX_CONCURRENCY', '8')
+    monkeypatch.setenv('AI_HEDGE_WORKERS', '32')
+    assert get_provider_concurrency('deepseek') == 8
+    assert get_http_pool_size('deepseek') == 32
+
+
+def test_backoff_releases_slot_and_charges_rpm(monkeypatch):
+    monkeypatch.setenv('AI_MAX_INFLIGHT', '1')
+    monkeypatch.setenv('AI_RPM', '60')
+    limiter = ProviderLimiter('deepseek')
+    other_waits = []
+
+    def other():
+        with limiter.acquire() as wait:
+            other_waits.append(wait)
+
+    with limiter.acquire():
+        thread = threading.Thread(target=other)
+        thread.start()
+        # 重试等待期间名额归还，另一个请求不必等到这次调用结束
+        limiter.backoff(0.3)
+        thread.join()
+        assert limiter.stats()['in_flight'] == 1
+    assert other_waits and other_waits[0] < 0.3
+    assert limiter.stats() == dict(limiter.stats(), acquired=3, in_flight=0)
+    # 三次请求（两次首发 + 一次重试）都从每分钟 60 次的额度中扣除
+    assert limiter.requests.tokens < 58
+
+
+def test_backoff_timeout_does_not_double_release(monkeypatch):
+    monkeypatch.setenv('AI_MAX_INFLIGHT', '1')
+    monkeypatch.setenv('AI_RATE_LIMIT_MAX_WAIT', '0.05')
+    limiter = ProviderLimiter('deepseek')
+    holder_ready = threading.Event()
+    release = threading.Event()
+
+    def holder():
+        with limiter.acquire():
+            holder_ready.set()
+            release.wait(5)
+
+    with pytest.raises(RateLimitTimeout):
+        with limiter.acquire():
+            thread = threading.Thread(target=holder)
+            thread.start()
+            limiter.backoff(0.01)
+            assert holder_ready.wait(5)
+            limiter.backoff(0.01)  # 名额被占用，重新排队超时
+    release.set()
+    thread.join()
+    assert limiter.stats()['in_flight'] == 0
+    # 名额只归还了一次：仍然只能同时拿到一个
+    with limiter.acquire():
+        with pytest.raises(RateLimitTimeout):
+            with limiter.acquire():
+                pass
+
+
+def test_backoff_without_lease_only_sleeps(monkeypatch):
+    monkeypatch.setenv('AI_RPM', '60')
+    limiter = ProviderLimiter('deepseek')
+    limiter.backoff(0.01)
+    assert limiter.stats()['acquired'] == 0
+
+
+@pytest.mark.usefixtures('fresh_provider_health')
+def test_client_retries_go_through_limiter(monkeypatch):
+    """服务商一直返回 429：每次重试都重新排队、计入 RPM"""
+    server = start_mock_llm(latency='0', rate_limit_rate=1.0, retry_after=0.01)
+    try:
+        monkeypatch.setenv('AI_MAX_RETRIES', '2')
+        monkeypatch.setenv('AI_MAX_INFLIGHT', '1')
+        monkeypatch.setenv('DEEPSEEK_BASE_URL', server.openai_url)
+        with pytest.raises(Exception, match='429'):
+            DeepSeekClient('test-key').generate('张三', '开朗')
+    finally:
+        server.shutdown()
+    stats = get_limiter('deepseek').stats()
+    assert (stats['acquired'], stats['in_flight']) == (3, 0)
+
+
+@pytest.mark.usefixtures('ai_provider', 'fresh_provider_health')
+def test_slow_stream_reader_does_not_hold_slot(monkeypatch):
+    """浏览器读取得慢：服务商响应读完（缓冲）后就归还并发名额"""
+    monkeypatch.setenv('AI_MAX_INFLIGHT', '1')
+    stream = DeepSeekClient('test-key').stream_comment('张三', '开朗')
+    first = next(stream)
+
+    limiter = get_limiter('deepseek')
+    assert limiter.inflight.acquire(timeout=2)
+    limiter.inflight.release()
+
+    parts = [first]
+    with pytest.raises(StopIteration) as stop:
+        while True:
+            parts.append(next(stream))
+    assert stop.value.value.comment == ''.join(parts).strip() != ''
+
+
+@pytest.mark.usefixtures('ai_provider', 'fresh_provider_health')
+def test_closing_stream_stops_upstream_read(monkeypatch):
+    monkeypatch.setenv('AI_MAX_INFLIGHT', '1')
+    stream = DeepSeekClient('test-key').stream_comment('张三', '开朗')
+    next(stream)
+    stream.close()
+    limiter = get_limiter('deepseek')
+    assert limiter.inflight.acquire(timeout=2)
+    limiter.inflight.release()
+    assert limiter.stats()['in_flight'] == 0
@@ -0,0 +1,62 @@
+"""服务商调用重试（Retry-After）"""
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from loadtest.mock_llm import start_mock_llm
+from utils.ai_client import DeepSeekClient
+from utils.rate_limit import get_limiter
+
+
+class FakeResponse:
+    def __init__(self, retry_after=None):
+        self.headers = {} if retry_after is None else {'Retry-After': retry_after}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv('AI_RETRY_MAX_DELAY', '20')
+    return DeepSeekClient('test-key')
+
+
+def http_date(seconds):
+    return format_datetime(datetime.now(timezone.utc) + timedelta(seconds=seconds), usegmt=True)
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, None),
+    ('', None),
+    ('3', 3.0),
+    ('1.5', 1.5),
+    ('-5', 0.0),
+    ('3600', 20.0),  # 不超过 AI_RETRY_MAX_DELAY
+    ('inf', 20.0),
+    ('soon', None),
+])
+def test_retry_after_seconds(client, value, expected):
+    assert client._retry_after_delay(FakeResponse(value)) == expected
+
+
+def test_retry_after_http_date(client):
+    assert client._retry_after_delay(FakeResponse(http_date(10))) == pytest.approx(10, abs=1.5)
+    assert client._retry_after_delay(FakeResponse(http_date(-60))) == 0.0
+    assert client._retry_after_delay(FakeResponse(http_date(3600))) == 20.0
+
+
+@pytest.mark.usefixtures('fresh_limiters', 'fresh_provider_health')
+def test_retry_waits_for_retry_after(monkeypatch):
+    """429 带 Retry-After 时按响应头等待，而不是按指数退避"""
+    server = start_mock_llm(latency='0', rate_limit_rate=1.0, retry_after=0.25)
+    delays = []
+    try:
+        monkeypatch.setenv('AI_MAX_RETRIES', '2')
+        monkeypatch.setenv('AI_RETRY_BASE_DELAY', '5')
+        monkeypatch.setenv('DEEPSEEK_BASE_URL', server.openai_url)
+        monkeypatch.setattr(get_limiter('deepseek'), 'backoff', delays.append)
+        with pytest.raises(Exception, match='429'):
+            DeepSeekClient('test-key').generate('张三', '开朗')
+    finally:
+        server.shutdown()
+    assert delays == [0.25, 0.25]
@@ -0,0 +1,248 @@
+"""学生名单导入"""
+
+import io
+import sqlite3
+import zipfile
+
+import pytest
+
+from models import Roster, get_database
+from utils.roster import RosterFormatError, iter_xlsx_rows
+
+
+def upload(client, headers, filename, content, **form):
+    data = dict(form, file=(io.BytesIO(content), filename))
+    return client.post('/api/roster/import', headers=headers, data=data, content_type='multipart/form-data')
+
+
+def make_xlsx(rows):
+    """生成只有一个工作表的 XLSX（文本放在共享字符串表中）"""
+    strings = []
+    sheet_rows = []
+    for number, row in enumerate(rows, start=1):
+        cells = []
+        for column, value in enumerate(row):
+            strings.append(value)
+            cells.append(f'<c r="{chr(ord("A") + column)}{number}" t="s"><v>{len(strings) - 1}</v></c>')
+        sheet_rows.append(f'<row r="{number}">{"".join(cells)}</row>')
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('xl/worksheets/sheet1.xml',
+                         f'<worksheet {ns}><sheetData>{"".join(sheet_rows)}</sheetData></worksheet>')
+        archive.writestr('xl/sharedStrings.xml',
+                         f'<sst {ns}>{"".join(f"<si><t>{value}</t></si>" for value in strings)}</sst>')
+    return buffer.getvalue()
+
+
+def students(client, headers, roster_id, **params):
+    response = client.get(f'/api/roster/{roster_id}', headers=headers, query_string=params)
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def test_import_csv_with_header(client, auth):
+    _, headers = auth
+    content = '姓名,学生信息,班级\n张三,性格开朗,三年级1班\n李四,喜欢画画,\n'.encode('utf-8')
+    response = upload(client, headers, '三年级.csv', content, class_name='三年级2班')
+    assert response.status_code == 201, response.json
+    assert (response.json['imported'], response.json['invalid']) == (2, 0)
+
+    body = students(client, headers, response.json['roster_id'])
+    assert body['roster']['name'] == '三年级'
+    assert [(s['student_name'], s['student_info'], s['class_name']) for s in body['students']] == [
+        ('张三', '性格开朗', '三年级1班'), ('李四', '喜欢画画', '三年级2班')]
+
+
+def test_import_gbk_csv_without_header(client, auth):
+    _, headers = auth
+    response = upload(client, headers, 'gbk.csv', '王五,爱运动\n赵六,数学好\n'.encode('gbk'))
+    assert response.status_code == 201, response.json
+    body = students(client, headers, response.json['roster_id'])
+    assert [s['student_name'] for s in body['students']] == ['王五', '赵六']
+
+
+def test_columns_joined_without_info_header(client, auth):
+    _, headers = auth
+    content = '序号,姓名,性格,爱好\n1,张三,开朗,阅读\n2,李四,安静,\n'.encode('utf-8')
+    response = upload(client, headers, 'mixed.csv', content)
+    body = students(client, headers, response.json['roster_id'])
+    assert [s['student_info'] for s in body['students']] == ['性格：开朗，爱好：阅读', '性格：安静']
+
+
+def test_import_xlsx(client, auth):
+    _, headers = auth
+    content = make_xlsx([['姓名', '学生信息'], ['张三', '热爱阅读'], ['李四', '乐于助人']])
+    response = upload(client, headers, 'roster.xlsx', content)
+    assert response.status_code == 201, response.json
+    body = students(client, headers, response.json['roster_id'])
+    assert [(s['student_name'], s['student_info']) for s in body['students']] == [
+        ('张三', '热爱阅读'), ('李四', '乐于助人')]
+
+
+def test_duplicates_and_invalid_rows(client, auth):
+    _, headers = auth
+    content = '姓名,学生信息\n张三,开朗\n张三,开朗\n,没有姓名\n李四,\n王五,安静\n'.encode('utf-8')
+    response = upload(client, headers, 'dup.csv', content)
+    assert response.status_code == 201, response.json
+    assert (response.json['imported'], response.json['duplicates'], response.json['invalid']) == (2, 1, 2)
+    assert [error['row'] for error in response.json['errors']] == [4, 5]
+
+
+def test_rejected_uploads(client, auth, app, monkeypatch):
+    _, headers = auth
+    assert upload(client, headers, 'roster.txt', b'a,b\n').status_code == 400
+    assert upload(client, headers, 'roster.xlsx', b'not a zip').status_code == 400
+    response = upload(client, headers, 'empty.csv', '姓名,学生信息\n张三,\n'.encode('utf-8'))
+    assert response.status_code == 400 and response.json['invalid'] == 1
+
+    monkeypatch.setitem(app.config, 'ROSTER_MAX_UPLOAD_MB', 0.001)
+    assert upload(client, headers, 'big.csv', b'a,b\n' * 1000).status_code == 413
+
+    monkeypatch.setitem(app.config, 'ROSTER_MAX_UPLOAD_MB', 5)
+    monkeypatch.setitem(app.config, 'ROSTER_MAX_ROWS', 2)
+    assert upload(client, headers, 'rows.csv', b'a,1\nb,2\nc,3\n').status_code == 400
+    assert client.get('/api/roster', headers=headers).json['rosters'] == []
+
+
+def test_list_paginate_and_delete(client, auth, make_user):
+    _, headers = auth
+    content = ''.join(f'学生{i},信息{i}\n' for i in range(5)).encode('utf-8')
+    roster_id = upload(client, headers, 'five.csv', content).json['roster_id']
+
+    [roster] = client.get('/api/roster', headers=headers).json['rosters']
+    assert (roster['id'], roster['student_count'], roster['generated']) == (roster_id, 5, 0)
+
+    first = students(client, headers, roster_id, limit=2)
+    second = students(client, headers, roster_id, limit=2, after_id=first['next_after_id'])
+    last = students(client, headers, roster_id, limit=2, after_id=second['next_after_id'])
+    names = [s['student_name'] for page in (first, second, last) for s in page['students']]
+    assert names == [f'学生{i}' for i in range(5)] and last['next_after_id'] is None
+
+    _, other = make_user()
+    assert client.get(f'/api/roster/{roster_id}', headers=other).status_code == 404
+    assert client.delete(f'/api/roster/{roster_id}', headers=other).status_code == 404
+    assert client.delete(f'/api/roster/{roster_id}', headers=headers).status_code == 200
+    assert client.get(f'/api/roster/{roster_id}', headers=headers).status_code == 404
+
+
+def test_generate_roster_comments(client, auth, ai_provider):
+    _, headers = auth
+    roster_id = upload(client, headers, 'gen.csv', '张三,开朗\n李四,安静\n'.encode('utf-8')).json['roster_id']
+
+    response = client.post(f'/api/roster/{roster_id}/generate', headers=headers, json={'ai_model': 'deepseek'})
+    assert response.status_code == 200, response.json
+    assert (response.json['succeeded'], response.json['remaining']) == (2, False)
+    assert all(s['comment_id'] for s in students(client, headers, roster_id)['students'])
+
+    # 已经生成过的学生不再生成
+    response = client.post(f'/api/roster/{roster_id}/generate', headers=headers, json={'ai_model': 'deepseek'})
+    assert response.json['results'] == []
+
+
+def roster_rows(user_id):
+    with get_database().connection() as conn:
+        return conn.execute(
+            '''SELECT r.status, COUNT(s.id) FROM rosters r LEFT JOIN roster_students s ON s.roster_id = r.id
+               WHERE r.user_id = ? GROUP BY r.id''', (user_id,)
+        ).fetchall()
+
+
+def test_batches_commit_without_holding_write_lock(auth):
+    """读取名单时不持有写锁：两批之间其他连接可以写入"""
+    user_id, _ = auth
+    seen = []
+
+    def rows():
+        for i in range(5):
+            if i == 3:
+                # 第一批（2 行）已提交，第二批还在读取
+                seen.extend(tuple(row) for row in roster_rows(user_id))
+                other = sqlite3.connect(get_database().db_path, timeout=0)
+                other.execute('BEGIN IMMEDIATE')
+                other.rollback()
+                other.close()
+            yield {'student_name': f'学生{i}', 'student_info': '信息'}
+
+    roster_id, imported, _ = Roster.create(user_id, '分批', rows(), batch_size=2)
+    assert imported == 5
+    assert seen == [('importing', 2)]
+    assert Roster.get(roster_id, user_id)['student_count'] == 5
+
+
+def test_failed_import_is_removed(auth):
+    user_id, _ = auth
+
+    def rows():
+        yield {'student_name': '张三', 'student_info': '开朗'}
+        yield {'student_name': '李四', 'student_info': '安静'}
+        raise ValueError('文件损坏')
+
+    with pytest.raises(ValueError):
+        Roster.create(user_id, '中断', rows(), batch_size=1)
+    assert roster_rows(user_id) == []
+    assert Roster.list_by_user(user_id) == []
+
+
+def test_stale_imports_purged(auth):
+    user_id, _ = auth
+    with get_database().connection() as conn:
+        stale = conn.execute(
+            '''INSERT INTO rosters (user_id, name, status, created_at)
+               VALUES (?, '中断', 'importing', datetime('now', '-2 hours'))''', (user_id,)
+        ).lastrowid
+        conn.execute("INSERT INTO roster_students (roster_id, student_name, student_info) VALUES (?, '张三', '开朗')",
+                     (stale,))
+        conn.commit()
+    assert Roster.get(stale, user_id) is None
+
+    Roster.create(user_id, '新名单', [{'student_name': '李四', 'student_info': '安静'}])
+    assert [tuple(row) for row in roster_rows(user_id)] == [('ready', 1)]
+
+
+def test_xlsx_size_limits():
+    strings = make_xlsx([['姓名', '学生信息'], ['张三', '开朗'] * 2000])
+    with pytest.raises(RosterFormatError, match='内容过大'):
+        list(iter_xlsx_rows(io.BytesIO(strings), max_xml_bytes=10 * 1024))
+
+    # 压缩炸弹：压缩后很小，解压后超过上限
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('xl/worksheets/sheet1.xml', '<worksheet>' + ' ' * (5 * 1024 * 1024) + '</worksheet>')
+    assert len(buffer.getvalue()) < 64 * 1024
+    with pytest.raises(RosterFormatError, match='内容过大'):
+        list(iter_xlsx_rows(io.BytesIO(buffer.getvalue()), max_xml_bytes=1024 * 1024))
+
+    # 工作簿和关系表同样受限
+    for name in ('xl/workbook.xml', 'xl/_rels/workbook.xml.rels'):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            if name != 'xl/workbook.xml':
+                archive.writestr('xl/workbook.xml', '<workbook/>')
+            archive.writestr(name, '<workbook>' + '<x/>' * (512 * 1024) + '</workbook>')
+            archive.writestr('xl/worksheets/sheet1.xml', '<worksheet></worksheet>')
+        with pytest.raises(RosterFormatError, match='内容过大'):
+            list(iter_xlsx_rows(io.BytesIO(buffer.getvalue()), max_xml_bytes=1024 * 1024))
+
+
+def test_undecodable_csv_rejected(client, auth):
+    """开头是 UTF-8、后面出现无法解码的字节：返回 400，不用替换字符导入乱码"""
+    _, headers = auth
+    content = ('姓名,学生信息\n张三,' + '开朗' * 40000 + '\n').encode('utf-8') + b'\xe6\x9d,\xff\xfe\n'
+    response = upload(client, headers, 'broken.csv', content)
+    assert response.status_code == 400
+    assert '编码' in response.json['message']
+
+
+def test_chunked_upload_over_limit(client, auth, app, monkeypatch):
+    """没有 Content-Length 的上传读取超过 MAX_CONTENT_LENGTH 时返回 413"""
+    _, headers = auth
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 1024)
+    body = (b'--x\r\nContent-Disposition: form-data; name="file"; filename="big.csv"\r\n\r\n'
+            + b'a,b\n' * 1000 + b'\r\n--x--\r\n')
+    # 服务器（gunicorn）处理分块编码后设置 wsgi.input_terminated
+    response = client.post('/api/roster/import', input_stream=io.BytesIO(body),
+                           environ_overrides={'wsgi.input_terminated': True},
+                           headers=dict(headers, **{'Content-Type': 'multipart/form-data; boundary=x'}))
+    assert response.status_code == 413
+    assert response.json['success'] is False
@@ -0,0 +1,78 @@
+"""评语全文检索"""
+
+from models import Comment, get_database
+from utils.search import Highlighter, like_pattern, parse_query
+
+
+def test_parse_query_splits_indexed_and_short_terms():
+    query = parse_query('开朗活泼 张三 "x" 开朗活泼')
+    assert query.terms == ['开朗活泼', '张三', '"x"']
+    assert query.match == '"开朗活泼" AND """x"""'
+    assert query.like_terms == ['张三']
+    assert parse_query('   ').terms == []
+
+
+def test_like_pattern_and_highlight_escape():
+    assert like_pattern('50%_a') == '%50\\%\\_a%'
+    assert Highlighter(['开朗'])('<b>开朗</b>') == '&lt;b&gt;<mark>开朗</mark>&lt;/b&gt;'
+
+
+def add(user_id, name, info, comment='评语'):
+    return Comment.create(user_id, name, info, comment, 'deepseek')
+
+
+def test_search_ranks_and_paginates(client, auth):
+    user_id, headers = auth
+    add(user_id, '张三', '热爱阅读，数学好')
+    add(user_id, '李四', '热爱阅读')
+    add(user_id, '王五', '喜欢运动')
+
+    response = client.get('/api/comment/search', headers=headers, query_string={'q': '热爱阅读', 'limit': 1})
+    assert response.status_code == 200
+    first = response.json
+    assert len(first['comments']) == 1 and first['next_offset'] == 1
+    assert first['comments'][0]['highlights']['student_info'].startswith('<mark>热爱阅读</mark>')
+
+    second = client.get('/api/comment/search', headers=headers,
+                        query_string={'q': '热爱阅读', 'limit': 1, 'offset': 1}).json
+    assert second['next_offset'] is None
+    names = {first['comments'][0]['student_name'], second['comments'][0]['student_name']}
+    assert names == {'张三', '李四'}
+
+
+def test_mixed_terms_filter_fts_matches(client, auth, make_user):
+    user_id, headers = auth
+    add(user_id, '张三', '热爱阅读')
+    add(user_id, '李四', '热爱阅读')
+    add(user_id, '张三', '喜欢运动')
+    other_id, _ = make_user()
+    add(other_id, '张三', '热爱阅读')
+
+    comments = client.get('/api/comment/search', headers=headers, query_string={'q': '张三 热爱阅读'}).json['comments']
+    assert [(c['student_name'], c['student_info']) for c in comments] == [('张三', '热爱阅读')]
+
+
+def test_short_terms_scan_recent_comments_only(auth):
+    user_id, _ = auth
+    old = add(user_id, '张三', '旧评语')
+    for i in range(3):
+        add(user_id, f'学生{i}', '新评语')
+    with get_database().connection() as conn:
+        conn.execute("UPDATE comments SET created_at = datetime('now', '-1 year') WHERE id = ?", (old,))
+        conn.commit()
+
+    results, _ = Comment.search(user_id, '张三', short_scan_limit=3)
+    assert results == []
+    results, _ = Comment.search(user_id, '张三', short_scan_limit=4)
+    assert [item['id'] for item in results] == [old] and results[0]['score'] is None
+
+    # 加上可索引的词后不受扫描条数限制
+    results, _ = Comment.search(user_id, '张三 旧评语', short_scan_limit=3)
+    assert [item['id'] for item in results] == [old]
+
+
+def test_search_validation(client, auth, app, monkeypatch):
+    _, headers = auth
+    assert client.get('/api/comment/search', headers=headers).status_code == 400
+    monkeypatch.setitem(app.config, 'SEARCH_MAX_QUERY_LENGTH', 5)
+    assert client.get('/api/comment/search', headers=headers, query_string={'q': '很长的检索词啊'}).status_code == 400
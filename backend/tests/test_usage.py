@@ -0,0 +1,113 @@
+"""用量统计接口"""
+
+import json
+import uuid
+
+import pytest
+
+from loadtest.mock_llm import MOCK_COMMENT
+from models import Comment, get_database
+
+USAGE = {'prompt_tokens': 220, 'completion_tokens': 48, 'cached_tokens': 192, 'latency_ms': 900, 'retries': 1}
+
+
+@pytest.fixture
+def metrics_token(app):
+    app.config['METRICS_TOKEN'] = 'ops-secret'
+    yield 'ops-secret'
+    app.config['METRICS_TOKEN'] = ''
+
+
+def test_my_usage_only_counts_own_comments(client, make_user):
+    owner_id, owner = make_user()
+    _, other = make_user()
+    Comment.create(owner_id, '张三', '性格开朗', '评语', 'deepseek', usage=USAGE)
+
+    mine = client.get('/api/usage', headers=owner).json['by_provider']
+    assert [(row['key'], row['comments'], row['prompt_tokens']) for row in mine] == [('deepseek', 1, 220)]
+    assert client.get('/api/usage', headers=other).json['by_provider'] == []
+
+
+def test_site_stats_closed_without_metrics_token(client, auth):
+    _, headers = auth
+    response = client.get('/api/usage/stats?group_by=user', headers=headers)
+    assert response.status_code == 403
+    assert 'results' not in response.json
+
+
+def test_site_stats_reject_user_token(client, auth, metrics_token):
+    _, headers = auth
+    response = client.get('/api/usage/stats?group_by=user', headers=headers)
+    assert response.status_code == 401
+
+
+def test_site_stats_with_metrics_token(client, auth, metrics_token):
+    user_id, _ = auth
+    Comment.create(user_id, '李四', '喜欢画画', '评语', 'qwen', usage=USAGE)
+
+    response = client.get('/api/usage/stats?group_by=user',
+                          headers={'Authorization': f'Bearer {metrics_token}'})
+    assert response.status_code == 200
+    row = next(row for row in response.json['results'] if row['key'] == user_id)
+    assert row['prompt_tokens'] == 220 and row['cached_tokens'] == 192
+
+    response = client.get('/api/usage/stats?group_by=nope', headers={'Authorization': f'Bearer {metrics_token}'})
+    assert response.status_code == 400
+
+
+def test_metrics_closed_without_metrics_token(client):
+    response = client.get('/metrics')
+    assert response.status_code == 403
+    assert response.json['success'] is False
+
+
+def test_metrics_token_guards_metrics(client, metrics_token):
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': f'Bearer {metrics_token}'}).status_code == 200
+
+
+def sse_events(body):
+    """解析 SSE 响应为 [(事件类型, 数据)]"""
+    events = []
+    for block in body.decode('utf-8').strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+def saved_usage(comment_id):
+    with get_database().connection() as conn:
+        row = conn.execute(
+            'SELECT ai_model, prompt_tokens, completion_tokens, cached_tokens, latency_ms FROM comments WHERE id = ?',
+            (comment_id,)
+        ).fetchone()
+    return dict(row)
+
+
+@pytest.mark.parametrize('ai_model', ['deepseek', 'qwen'])
+def test_stream_generation_records_usage(client, auth, ai_provider, ai_model):
+    _, headers = auth
+    response = client.post('/api/comment/generate/stream', headers=headers, json={
+        'student_name': '王五', 'student_info': f'爱运动 {uuid.uuid4().hex}', 'ai_model': ai_model
+    })
+    events = sse_events(response.data)
+    assert [name for name, _ in events][-1] == 'done'
+    assert ''.join(data['text'] for name, data in events if name == 'token') == MOCK_COMMENT
+
+    usage = saved_usage(events[-1][1]['comment_id'])
+    assert usage['ai_model'] == ai_model
+    assert (usage['prompt_tokens'], usage['completion_tokens'], usage['cached_tokens']) == (220, 48, 192)
+    assert usage['latency_ms'] > 0
+
+
+def test_stream_and_plain_generation_both_counted(client, auth, ai_provider):
+    _, headers = auth
+    student = {'student_name': '赵六', 'ai_model': 'deepseek'}
+    response = client.post('/api/comment/generate', headers=headers,
+                           json=dict(student, student_info=f'数学好 {uuid.uuid4().hex}'))
+    assert response.status_code == 200, response.json
+    client.post('/api/comment/generate/stream', headers=headers,
+                json=dict(student, student_info=f'数学好 {uuid.uuid4().hex}')).get_data()
+
+    [row] = client.get('/api/usage', headers=headers).json['by_provider']
+    assert (row['comments'], row['prompt_tokens'], row['completion_tokens']) == (2, 440, 96)
@@ -0,0 +1,59 @@
+"""用户信息缓存"""
+
+import time
+
+from models import User, get_database, user_cache
+from utils.lru_cache import LRUCache
+
+
+def set_email(user_id, email):
+    """绕过 User 直接修改数据库（模拟没有调用 invalidate 的写操作）"""
+    with get_database().connection() as conn:
+        conn.execute('UPDATE users SET email = ? WHERE id = ?', (email, user_id))
+        conn.commit()
+
+
+def test_login_warms_cache_for_user_info(client, auth):
+    user_id, headers = auth
+    before = user_cache.stats()['hits']
+    response = client.get('/api/user/info', headers=headers)
+    assert response.status_code == 200 and response.json['user']['id'] == user_id
+    assert user_cache.stats()['hits'] == before + 1
+
+
+def test_invalidate_after_write(auth):
+    user_id, _ = auth
+    User.get_by_id(user_id)
+    set_email(user_id, 'new@example.com')
+    assert User.get_by_id(user_id)['email'] is None  # 仍是缓存中的旧值
+
+    User.invalidate(user_id)
+    assert User.get_by_id(user_id)['email'] == 'new@example.com'
+
+
+def test_cached_value_is_copied(auth):
+    user_id, _ = auth
+    User.get_by_id(user_id)['username'] = 'changed'
+    assert User.get_by_id(user_id)['username'] != 'changed'
+
+
+def test_missing_user_not_cached():
+    size = len(user_cache)
+    assert User.get_by_id(10 ** 9) is None
+    assert len(user_cache) == size
+
+
+def test_lru_expiry_and_eviction():
+    cache = LRUCache(max_size=2, ttl=0.05)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)  # 淘汰最久未使用的 b
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+
+    time.sleep(0.06)
+    assert cache.get('a') is None
+    cache.set('d', 4)
+    cache.delete('d')
+    stats = cache.stats()
+    assert (stats['evictions'], stats['invalidations'], stats['size']) == (1, 1, 1)
@@ -4,16 +4,234 @@ AI 客户端工具
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+import contextvars
+import json
 import os
-from typing import Optional, Dict
+import queue
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Optional, Dict, Generator, Iterator, List
+
+from . import request_timing
+from .metrics import ai_fallback_generations, ai_generations_in_flight, ai_hedge_requests, observe_ai_call
+from .phrase_bank import PHRASE_BANK_VERSION, phrase_bank
+from .prompts import PROMPT_VERSION, get_prompt_template
+from .provider_stats import latency_tracker, provider_health, usage_stats
+from .rate_limit import RateLimitTimeout, get_limiter
+
+
+# 每次生成的最大输出 token 数
+MAX_TOKENS = 500
+
+
+def estimate_tokens(student_name: str, student_info: str) -> int:
+    """
+    粗略估计一次生成消耗的 token 数（用于每分钟 token 限流）
+
+    中文大约每个字一个 token，按提示词字符数加最大输出数估计，宁多勿少
+    """
+    return get_prompt_template().static_length + len(student_name) + len(student_info) + MAX_TOKENS
+
+
+def parse_usage(usage: Optional[Dict]) -> Dict[str, int]:
+    """
+    把各服务商的 usage 字段统一成 prompt_tokens / completion_tokens / cached_tokens
+    （retries 为本次调用的重试次数，由调用方填写）
+
+    缓存命中的输入 token 数在不同服务商的字段名不同:
+        DeepSeek: prompt_cache_hit_tokens
+        OpenAI 兼容（智谱等）、DashScope: prompt_tokens_details.cached_tokens
+        Kimi: cached_tokens
+    DashScope 使用 input_tokens / output_tokens
+    """
+    usage = usage or {}
+    cached = usage.get('prompt_cache_hit_tokens')
+    if cached is None:
+        cached = (usage.get('prompt_tokens_details') or {}).get('cached_tokens')
+    if cached is None:
+        cached = usage.get('cached_tokens')
+    return {
+        'prompt_tokens': int(usage.get('prompt_tokens', usage.get('input_tokens')) or 0),
+        'completion_tokens': int(usage.get('completion_tokens', usage.get('output_tokens')) or 0),
+        'cached_tokens': int(cached or 0),
+        'retries': 0
+    }
+
+
+def iter_sse_data(response: requests.Response) -> Iterator[str]:
+    """
+    逐条读取 Server-Sent Events 响应中的 data 字段
+
+    参数:
+        response: 以 stream=True 发出的请求的响应
+
+    返回:
+        生成器，产出每个事件的 data 字符串（遇到 [DONE] 结束）
+    """
+    # text/event-stream 通常不带 charset，requests 会误用 ISO-8859-1 解码中文
+    response.encoding = 'utf-8'
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            return
+        yield data
+
+
+# 遇到这些状态码时重试（限流和服务端错误）
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class ProviderUnavailableError(Exception):
+    """服务商已熔断，请求直接失败"""
+
+
+class HedgeCancelled(Exception):
+    """对冲中的另一个请求已经成功，这个请求不再继续（不计为服务商失败）"""
+
+
+# 对冲请求的取消标记：设置后，请求在下一次排队或重试前停止（已经发出的 HTTP 请求无法中断）
+_hedge_cancel: contextvars.ContextVar = contextvars.ContextVar('ai_hedge_cancel', default=None)
+
+
+def _check_cancelled():
+    """当前请求已被对冲取消时抛出 HedgeCancelled"""
+    event = _hedge_cancel.get()
+    if event is not None and event.is_set():
+        raise HedgeCancelled()
+
+
+class GenerationResult:
+    """一次评语生成的结果"""
+
+    def __init__(self, comment: str, provider: str, model: str = '', latency: float = 0.0,
+                 queue_wait: float = 0.0, usage: Optional[Dict[str, int]] = None, fallback: bool = False):
+        """
+        参数:
+            comment: 生成的评语
+            provider: 实际给出结果的服务商标识
+            model: 模型名称
+            latency: 服务商调用耗时（秒，不含排队时间）
+            queue_wait: 限流排队等待时间（秒）
+            usage: token 用量和重试次数（prompt_tokens / completion_tokens / cached_tokens / retries），
+                   命中缓存的结果全部为 0
+            fallback: 是否为降级模式下的模板评语（不写入缓存，保存时标记为待重新生成）
+        """
+        self.comment = comment
+        self.provider = provider
+        self.model = model
+        self.latency = latency
+        self.queue_wait = queue_wait
+        self.usage = usage or parse_usage(None)
+        self.fallback = fallback
+
+    def accounting(self) -> Dict[str, int]:
+        """随评语一起保存的用量记录：token 数、服务商耗时（毫秒）和重试次数"""
+        return dict(self.usage, latency_ms=int(round(self.latency * 1000)))
+
+
+class CommentStream:
+    """
+    流式生成的输出
+
+    用法:
+        stream = CommentStream(client.stream_comment(student_name, student_info))
+        for text in stream:
+            ...  # 逐段产出的评语文本
+        stream.result  # 输出结束后为 GenerationResult（含 token 用量和耗时）
+    """
+
+    def __init__(self, generator: Generator[str, None, GenerationResult]):
+        self._generator = generator
+        self.result: Optional[GenerationResult] = None
+
+    def __iter__(self) -> Iterator[str]:
+        self.result = yield from self._generator
 
 
 class AIClient:
-    """AI 客户端基类"""
+    """
+    AI 客户端基类
+
+    每个客户端持有一个长连接的 requests.Session（HTTP keep-alive 连接池），
+    由 get_ai_client 按服务商缓存复用，避免每次请求都重新握手 TCP/TLS。
+    """
+
+    # 服务商标识（与 get_ai_client 的 model_name 一致）和显示名称（用于错误信息）
+    provider = ''
+    display_name = 'AI'
+    base_url = ''
 
     def __init__(self, api_key: str):
         self.api_key = api_key
 
+        # 接口地址可用 <PROVIDER>_BASE_URL 覆盖（代理网关或压测时指向模拟服务）
+        self.base_url = os.getenv(f'{self.provider.upper()}_BASE_URL', self.base_url)
+
+        # 连接超时和读取超时分开设置（读取超时也是流式响应两段数据之间的最长间隔）
+        self.connect_timeout = float(os.getenv('AI_CONNECT_TIMEOUT', 5))
+        self.read_timeout = float(os.getenv('AI_READ_TIMEOUT', 30))
+
+        # 重试策略：指数退避 + 随机抖动，429/5xx 优先使用 Retry-After
+        self.max_retries = int(os.getenv('AI_MAX_RETRIES', 2))
+        self.retry_base_delay = float(os.getenv('AI_RETRY_BASE_DELAY', 0.5))
+        self.retry_max_delay = float(os.getenv('AI_RETRY_MAX_DELAY', 20))
+
+        # 连接池与限流器的同时请求上限一样大：排到名额的请求都能复用 keep-alive 连接
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=get_http_pool_size(self.provider or 'ai'))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def generate(self, student_name: str, student_info: str) -> GenerationResult:
+        """
+        生成学生评语，并记录调用耗时
+
+        参数:
+            student_name: 学生姓名
+            student_info: 学生信息
+
+        返回:
+            GenerationResult
+        """
+        self._check_available()
+        _check_cancelled()
+        # 超出服务商的速率或并发上限时在这里排队（排队超时抛出 RateLimitTimeout）
+        with get_limiter(self.provider).acquire(estimate_tokens(student_name, student_info)) as queue_wait:
+            request_timing.record('ai_queue', queue_wait)
+            start = time.monotonic()
+            ai_generations_in_flight.inc(self.provider)
+            try:
+                comment, usage = self._generate(student_name, student_info)
+            except HedgeCancelled:
+                raise
+            except Exception as e:
+                observe_ai_call(self.provider, time.monotonic() - start, e)
+                provider_health.record_failure(self.provider)
+                raise
+            finally:
+                ai_generations_in_flight.dec(self.provider)
+                request_timing.record('ai', time.monotonic() - start)
+            latency = time.monotonic() - start
+        observe_ai_call(self.provider, latency)
+        latency_tracker.record(self.provider, latency)
+        provider_health.record_success(self.provider, latency)
+        usage_stats.record(self.provider, usage)
+        return GenerationResult(comment, self.provider, getattr(self, 'model', ''), latency,
+                                queue_wait, usage)
+
+    def _check_available(self):
+        """熔断中的服务商直接失败，不再等待超时"""
+        if not provider_health.is_available(self.provider):
+            raise ProviderUnavailableError(
+                f"{self.display_name} 暂时不可用（连续调用失败），请稍后重试或选择其他模型"
+            )
+
     def generate_comment(self, student_name: str, student_info: str) -> str:
         """
         生成学生评语
@@ -25,269 +243,704 @@ class AIClient:
         返回:
             生成的评语
         """
-        raise NotImplementedError("子类必须实现此方法")
+        return self.generate(student_name, student_info).comment
 
+    def _generate(self, student_name: str, student_info: str) -> tuple:
+        """
+        调用服务商接口生成评语（子类实现）
 
-class DeepSeekClient(AIClient):
-    """DeepSeek AI 客户端"""
+        返回:
+            (评语, parse_usage 统一后的 token 用量，retries 为重试次数)
+        """
+        raise NotImplementedError("子类必须实现此方法")
 
-    def __init__(self, api_key: str):
-        super().__init__(api_key)
-        self.base_url = "https://api.deepseek.com/v1/chat/completions"
+    def _build_data(self, student_name: str, student_info: str, stream: bool = False) -> Dict:
+        """构建请求体（子类实现，异步客户端共用）"""
+        raise NotImplementedError("子类必须实现此方法")
 
-    def generate_comment(self, student_name: str, student_info: str) -> str:
-        """使用 DeepSeek 生成评语"""
+    def _parse_response(self, result: Dict) -> str:
+        """从响应 JSON 中取出评语（子类实现，异步客户端共用）"""
+        raise NotImplementedError("子类必须实现此方法")
 
-        # 构建提示词
-        prompt = f"""你是一位经验丰富的班主任老师，请根据以下学生信息，生成一段真诚、具体、有温度的学生评语。
+    def _parse_usage(self, result: Dict) -> Dict[str, int]:
+        """从响应 JSON 中取出 token 用量（异步客户端共用）"""
+        return parse_usage(result.get('usage'))
 
-学生姓名：{student_name}
-学生情况：{student_info}
+    def stream_comment(self, student_name: str,
+                       student_info: str) -> Generator[str, None, GenerationResult]:
+        """
+        流式生成学生评语
 
-要求：
-1. 评语要真诚、具体，避免空洞的套话
-2. 突出学生的优点和进步
-3. 如果有不足，要委婉地提出改进建议
-4. 语气要温暖、鼓励，体现对学生的关心
-5. 字数控制在150-200字左右
-6. 直接输出评语内容，不要有其他说明
+        服务商的流式响应由后台线程读取并缓冲（见 _pump_stream）：限流名额只在读取服务商响应期间占用，
+        浏览器读取得慢（SSE 背压）不会一直占着名额和服务商连接
 
-请生成评语："""
+        返回:
+            生成器，逐段产出评语文本；结束时的返回值为 GenerationResult
+            （token 用量取自服务商流式响应最后给出的 usage，用 CommentStream 读取）
+        """
+        self._check_available()
+        events = queue.Queue()
+        stop = threading.Event()
+        # 在当前上下文的副本中读取（Server-Timing 记到同一个请求上）
+        threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._pump_stream, student_name, student_info, events, stop),
+            name=f'ai-stream-{self.provider}',
+            daemon=True
+        ).start()
+        parts = []
+        try:
+            while True:
+                kind, value = events.get()
+                if kind == 'text':
+                    parts.append(value)
+                    yield value
+                elif kind == 'error':
+                    raise value
+                else:
+                    latency, queue_wait, usage = value
+                    return GenerationResult(''.join(parts).strip(), self.provider, getattr(self, 'model', ''),
+                                            latency, queue_wait, usage)
+        finally:
+            # 浏览器断开连接时让后台线程停止读取
+            stop.set()
+
+    def _pump_stream(self, student_name: str, student_info: str, events: queue.Queue, stop: threading.Event):
+        """
+        在后台线程中读取服务商的流式响应，逐段放入 events 队列
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        队列中的事件: ('text', 文本)、('done', (耗时, 排队时间, 用量))、('error', 异常)；
+        服务商响应读完即归还限流名额，不等浏览器取走
+        """
+        try:
+            with get_limiter(self.provider).acquire(estimate_tokens(student_name, student_info)) as queue_wait:
+                start = time.monotonic()
+                ai_generations_in_flight.inc(self.provider)
+                stream = self._stream(student_name, student_info)
+                try:
+                    while True:
+                        if stop.is_set():
+                            # 浏览器断开连接，不算服务商失败
+                            return
+                        try:
+                            text = next(stream)
+                        except StopIteration as stop_iteration:
+                            usage = stop_iteration.value or parse_usage(None)
+                            break
+                        events.put(('text', text))
+                except Exception as e:
+                    observe_ai_call(self.provider, time.monotonic() - start, e)
+                    provider_health.record_failure(self.provider)
+                    raise
+                finally:
+                    # 提前结束时关闭服务商的流式响应，连接回到连接池
+                    stream.close()
+                    ai_generations_in_flight.dec(self.provider)
+                    request_timing.record('ai', time.monotonic() - start)
+                latency = time.monotonic() - start
+            observe_ai_call(self.provider, latency)
+            provider_health.record_success(self.provider)
+            usage_stats.record(self.provider, usage)
+            events.put(('done', (latency, queue_wait, usage)))
+        except Exception as e:
+            events.put(('error', e))
+        except BaseException:
+            events.put(('error', RuntimeError('流式生成被中断')))
+            raise
+
+    def _stream(self, student_name: str, student_info: str) -> Generator[str, None, Dict[str, int]]:
+        """
+        调用服务商流式接口（子类实现），不支持流式的客户端一次性产出全部内容
 
-        data = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 500
-        }
+        返回:
+            生成器，逐段产出评语文本；返回值为 parse_usage 统一后的 token 用量（retries 为重试次数）
+        """
+        comment, usage = self._generate(student_name, student_info)
+        yield comment
+        return usage
+
+    def probe(self) -> bool:
+        """
+        健康探测：发送一个最小请求（max_tokens=1），不经过熔断检查和重试
 
+        返回:
+            服务商是否可用
+        """
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.base_url,
-                headers=headers,
-                json=data,
-                timeout=30
+                headers=self._headers(),
+                json=self._probe_data(),
+                timeout=(self.connect_timeout, self.read_timeout)
             )
-            response.raise_for_status()
-
-            result = response.json()
-            comment = result['choices'][0]['message']['content'].strip()
-            return comment
-
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"DeepSeek API 调用失败: {str(e)}")
-
+            response.close()
+            return response.ok
+        except requests.exceptions.RequestException:
+            return False
 
-class ZhipuClient(AIClient):
-    """智谱 AI（GLM-4）客户端"""
-
-    def __init__(self, api_key: str):
-        super().__init__(api_key)
-        self.base_url = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
-
-    def generate_comment(self, student_name: str, student_info: str) -> str:
-        """使用智谱 AI 生成评语"""
+    def _probe_data(self) -> Dict:
+        """健康探测的请求体（子类实现）"""
+        raise NotImplementedError("子类必须实现此方法")
 
-        prompt = f"""你是一位经验丰富的班主任老师，请根据以下学生信息，生成一段真诚、具体、有温度的学生评语。
+    def _headers(self) -> Dict[str, str]:
+        """请求头"""
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
 
-学生姓名：{student_name}
-学生情况：{student_info}
+    def _backoff_delay(self, attempt: int) -> float:
+        """第 attempt 次重试前的等待时间（full jitter 指数退避）"""
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
 
-要求：
-1. 评语要真诚、具体，避免空洞的套话
-2. 突出学生的优点和进步
-3. 如果有不足，要委婉地提出改进建议
-4. 语气要温暖、鼓励，体现对学生的关心
-5. 字数控制在150-200字左右
-6. 直接输出评语内容，不要有其他说明
+    def _retry_after_delay(self, response: requests.Response) -> Optional[float]:
+        """解析 Retry-After 响应头（秒数或 HTTP 日期），没有时返回 None"""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(self.retry_max_delay, max(0.0, delay))
+
+    def _post(self, data: Dict, headers: Optional[Dict] = None, stream: bool = False) -> requests.Response:
+        """
+        发送请求（带重试）
 
-请生成评语："""
+        连接失败、超时以及 429/5xx 响应会重试，最多 max_retries 次。
+        重试前的等待期间归还限流器的并发名额，每次重试重新排队并计入 RPM/TPM。
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        返回:
+            成功的响应（stream=True 时调用方负责关闭），response.retries 为重试次数
 
+        异常:
+            requests.exceptions.RequestException: 重试用尽后仍然失败
+        """
+        attempt = 0
+        while True:
+            _check_cancelled()
+            try:
+                response = self.session.post(
+                    self.base_url,
+                    headers=headers or self._headers(),
+                    json=data,
+                    timeout=(self.connect_timeout, self.read_timeout),
+                    stream=stream
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                get_limiter(self.provider).backoff(self._backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                delay = self._retry_after_delay(response)
+                response.close()
+                get_limiter(self.provider).backoff(delay if delay is not None else self._backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError:
+                response.close()
+                raise
+            response.retries = attempt
+            return response
+
+
+class OpenAICompatibleClient(AIClient):
+    """兼容 OpenAI Chat Completions 接口的客户端（DeepSeek、智谱、Kimi）"""
+
+    model = ''
+
+    def _build_data(self, student_name: str, student_info: str, stream: bool = False) -> Dict:
+        """构建请求体"""
         data = {
-            "model": "glm-4",
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
+            "model": self.model,
+            "messages": get_prompt_template().messages(student_name, student_info),
             "temperature": 0.7,
-            "max_tokens": 500
+            "max_tokens": MAX_TOKENS
         }
-
+        if stream:
+            data["stream"] = True
+            # 最后多发一个 choices 为空、带 usage 的数据块（不支持该参数的服务商会忽略）
+            data["stream_options"] = {"include_usage": True}
+        return data
+
+    def _parse_response(self, result: Dict) -> str:
+        """从响应 JSON 中取出评语"""
+        return result['choices'][0]['message']['content'].strip()
+
+    def _generate(self, student_name: str, student_info: str) -> tuple:
+        """使用 Chat Completions 接口生成评语"""
         try:
-            response = requests.post(
-                self.base_url,
-                headers=headers,
-                json=data,
-                timeout=30
-            )
-            response.raise_for_status()
-
+            response = self._post(self._build_data(student_name, student_info))
             result = response.json()
-            comment = result['choices'][0]['message']['content'].strip()
-            return comment
+            usage = self._parse_usage(result)
+            usage['retries'] = response.retries
+            return self._parse_response(result), usage
 
         except requests.exceptions.RequestException as e:
-            raise Exception(f"智谱 AI API 调用失败: {str(e)}")
+            raise Exception(f"{self.display_name} API 调用失败: {str(e)}")
+
+    def _probe_data(self) -> Dict:
+        """健康探测的请求体"""
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": "ping"}],
+            "max_tokens": 1
+        }
 
+    def _stream(self, student_name: str, student_info: str) -> Generator[str, None, Dict[str, int]]:
+        """
+        使用流式接口生成评语，逐段产出 choices[].delta.content
 
-class QwenClient(AIClient):
-    """通义千问客户端"""
+        token 用量在最后的数据块中：OpenAI 兼容接口（DeepSeek、智谱）为顶层 usage，
+        Kimi 放在 choices[0].usage
+        """
+        usage = None
+        try:
+            with self._post(
+                self._build_data(student_name, student_info, stream=True),
+                stream=True
+            ) as response:
+                for data in iter_sse_data(response):
+                    chunk = json.loads(data)
+                    usage = chunk.get('usage') or usage
+                    for choice in chunk.get('choices') or []:
+                        usage = choice.get('usage') or usage
+                        content = (choice.get('delta') or {}).get('content')
+                        if content:
+                            yield content
+                retries = response.retries
 
-    def __init__(self, api_key: str):
-        super().__init__(api_key)
-        self.base_url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"{self.display_name} API 调用失败: {str(e)}")
 
-    def generate_comment(self, student_name: str, student_info: str) -> str:
-        """使用通义千问生成评语"""
+        usage = parse_usage(usage)
+        usage['retries'] = retries
+        return usage
 
-        prompt = f"""你是一位经验丰富的班主任老师，请根据以下学生信息，生成一段真诚、具体、有温度的学生评语。
 
-学生姓名：{student_name}
-学生情况：{student_info}
+class DeepSeekClient(OpenAICompatibleClient):
+    """DeepSeek AI 客户端"""
 
-要求：
-1. 评语要真诚、具体，避免空洞的套话
-2. 突出学生的优点和进步
-3. 如果有不足，要委婉地提出改进建议
-4. 语气要温暖、鼓励，体现对学生的关心
-5. 字数控制在150-200字左右
-6. 直接输出评语内容，不要有其他说明
+    provider = 'deepseek'
+    display_name = 'DeepSeek'
+    base_url = "https://api.deepseek.com/v1/chat/completions"
+    model = "deepseek-chat"
 
-请生成评语："""
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+class ZhipuClient(OpenAICompatibleClient):
+    """智谱 AI（GLM-4）客户端"""
+
+    provider = 'zhipu'
+    display_name = '智谱 AI'
+    base_url = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
+    model = "glm-4"
 
+
+class QwenClient(AIClient):
+    """通义千问客户端（DashScope 接口）"""
+
+    provider = 'qwen'
+    display_name = '通义千问'
+    base_url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
+    model = "qwen-turbo"
+
+    def _build_data(self, student_name: str, student_info: str, stream: bool = False) -> Dict:
+        """构建请求体"""
         data = {
-            "model": "qwen-turbo",
+            "model": self.model,
             "input": {
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ]
+                "messages": get_prompt_template().messages(student_name, student_info)
             },
             "parameters": {
                 "temperature": 0.7,
-                "max_tokens": 500
+                "max_tokens": MAX_TOKENS
             }
         }
+        if stream:
+            # 增量输出：每个事件只包含新生成的部分
+            data["parameters"]["incremental_output"] = True
+        return data
 
-        try:
-            response = requests.post(
-                self.base_url,
-                headers=headers,
-                json=data,
-                timeout=30
-            )
-            response.raise_for_status()
+    def _parse_response(self, result: Dict) -> str:
+        """从响应 JSON 中取出评语"""
+        return result['output']['text'].strip()
 
+    def _generate(self, student_name: str, student_info: str) -> tuple:
+        """使用通义千问生成评语"""
+        try:
+            response = self._post(self._build_data(student_name, student_info))
             result = response.json()
-            comment = result['output']['text'].strip()
-            return comment
+            usage = self._parse_usage(result)
+            usage['retries'] = response.retries
+            return self._parse_response(result), usage
 
         except requests.exceptions.RequestException as e:
-            raise Exception(f"通义千问 API 调用失败: {str(e)}")
+            raise Exception(f"{self.display_name} API 调用失败: {str(e)}")
+
+    def _probe_data(self) -> Dict:
+        """健康探测的请求体"""
+        return {
+            "model": self.model,
+            "input": {"messages": [{"role": "user", "content": "ping"}]},
+            "parameters": {"max_tokens": 1}
+        }
 
+    def _stream(self, student_name: str, student_info: str) -> Generator[str, None, Dict[str, int]]:
+        """
+        使用 DashScope SSE 接口生成评语，逐段产出 output.text
 
-class KimiClient(AIClient):
+        每个事件都带有截至当前的累计 usage，取最后一个
+        """
+        headers = self._headers()
+        headers["X-DashScope-SSE"] = "enable"
+        usage = None
+        try:
+            with self._post(
+                self._build_data(student_name, student_info, stream=True),
+                headers=headers,
+                stream=True
+            ) as response:
+                for data in iter_sse_data(response):
+                    event = json.loads(data)
+                    usage = event.get('usage') or usage
+                    text = (event.get('output') or {}).get('text')
+                    if text:
+                        yield text
+                retries = response.retries
+
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"{self.display_name} API 调用失败: {str(e)}")
+
+        usage = parse_usage(usage)
+        usage['retries'] = retries
+        return usage
+
+
+class KimiClient(OpenAICompatibleClient):
     """Kimi（月之暗面）客户端"""
 
-    def __init__(self, api_key: str):
-        super().__init__(api_key)
-        self.base_url = "https://api.moonshot.cn/v1/chat/completions"
+    provider = 'kimi'
+    display_name = 'Kimi'
+    base_url = "https://api.moonshot.cn/v1/chat/completions"
+    model = "moonshot-v1-8k"
 
-    def generate_comment(self, student_name: str, student_info: str) -> str:
-        """使用 Kimi 生成评语"""
 
-        prompt = f"""你是一位经验丰富的班主任老师，请根据以下学生信息，生成一段真诚、具体、有温度的学生评语。
+class TemplateClient(AIClient):
+    """
+    离线模板客户端（降级模式）
 
-学生姓名：{student_name}
-学生情况：{student_info}
+    按学生信息中的关键词从短语库拼出评语，不访问网络、不经过限流和熔断，
+    耗时在一毫秒以内。生成的评语都标记为待重新生成。
+    不访问网络，也就不需要 AIClient 构造函数创建的连接池和超时、重试配置。
+    """
 
-要求：
-1. 评语要真诚、具体，避免空洞的套话
-2. 突出学生的优点和进步
-3. 如果有不足，要委婉地提出改进建议
-4. 语气要温暖、鼓励，体现对学生的关心
-5. 字数控制在150-200字左右
-6. 直接输出评语内容，不要有其他说明
+    provider = 'template'
+    display_name = '模板评语'
+    model = f'phrase-bank-{PHRASE_BANK_VERSION}'
 
-请生成评语："""
+    def __init__(self, bank=None):
+        self.bank = bank or phrase_bank
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+    def generate(self, student_name: str, student_info: str) -> GenerationResult:
+        """拼出评语"""
+        start = time.monotonic()
+        comment, usage = self._generate(student_name, student_info)
+        return GenerationResult(comment, self.provider, self.model, time.monotonic() - start,
+                                usage=usage, fallback=True)
 
-        data = {
-            "model": "moonshot-v1-8k",
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 500
-        }
+    def _generate(self, student_name: str, student_info: str) -> tuple:
+        return self.bank.compose(student_name, student_info), parse_usage(None)
 
+    def stream_comment(self, student_name: str,
+                       student_info: str) -> Generator[str, None, GenerationResult]:
+        """一次性产出全部内容"""
+        result = self.generate(student_name, student_info)
+        yield result.comment
+        return result
+
+    def probe(self) -> bool:
+        return True
+
+
+# 全局共享的模板客户端
+template_client = TemplateClient()
+
+
+def fallback_enabled() -> bool:
+    """服务商失败或过载时是否改用模板评语（AI_FALLBACK，默认开启）"""
+    return os.getenv('AI_FALLBACK', '1').lower() not in ('0', 'false', 'off', 'no')
+
+
+def fallback_reason(error: Exception) -> str:
+    """改用模板评语的原因：unavailable（已熔断）、overloaded（排队超时）、error（调用失败）"""
+    if isinstance(error, ProviderUnavailableError):
+        return 'unavailable'
+    if isinstance(error, RateLimitTimeout):
+        return 'overloaded'
+    return 'error'
+
+
+class DelegatingClient(AIClient):
+    """
+    包装其他客户端的客户端基类（降级、对冲）
+
+    本身不发请求，不调用 AIClient 的构造函数（没有自己的连接池）；
+    服务商标识、模型和显示名称沿用主客户端，错误信息和监控指标都记到主服务商上。
+    """
+
+    def __init__(self, primary: AIClient):
+        self.primary = primary
+        self.provider = primary.provider
+        self.model = getattr(primary, 'model', '')
+        self.display_name = primary.display_name
+
+
+class FallbackClient(DelegatingClient):
+    """
+    降级客户端
+
+    先用原来的客户端生成；服务商已熔断、限流排队超时或重试后仍然失败时，
+    改用模板客户端给出一段评语，而不是让请求失败。
+    """
+
+    def __init__(self, primary: AIClient, fallback: Optional[AIClient] = None):
+        """
+        参数:
+            primary: 原来的客户端（单个服务商或对冲客户端）
+            fallback: 降级时使用的客户端（默认为模板客户端）
+        """
+        super().__init__(primary)
+        self.fallback = fallback or template_client
+
+    def generate(self, student_name: str, student_info: str) -> GenerationResult:
+        """生成评语，降级时结果中的 provider 为 template、fallback 为 True"""
         try:
-            response = requests.post(
-                self.base_url,
-                headers=headers,
-                json=data,
-                timeout=30
-            )
-            response.raise_for_status()
+            return self.primary.generate(student_name, student_info)
+        except Exception as e:
+            ai_fallback_generations.inc(self.provider, fallback_reason(e))
+            print(f"[WARN] {self.display_name} 生成失败，改用模板评语: {str(e)}")
+            return self.fallback.generate(student_name, student_info)
 
-            result = response.json()
-            comment = result['choices'][0]['message']['content'].strip()
-            return comment
+    def stream_comment(self, student_name: str,
+                       student_info: str) -> Generator[str, None, GenerationResult]:
+        """流式输出不做降级（已经发出的内容无法撤回），由调用方在开始输出前处理"""
+        return self.primary.stream_comment(student_name, student_info)
 
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Kimi API 调用失败: {str(e)}")
 
+class HedgePool:
+    """
+    对冲请求的线程池
+
+    提交前先占用一个空闲线程，没有空闲线程时 try_submit 返回 None 而不是排队：
+    排在慢请求后面的备用请求起不到对冲的作用，由调用方改为直接请求、不做对冲。
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-hedge')
+        self._free = threading.BoundedSemaphore(max_workers)
+
+    def try_submit(self, fn, *args) -> Optional[Future]:
+        """有空闲线程时提交（在当前上下文的副本中执行），否则返回 None"""
+        if not self._free.acquire(blocking=False):
+            return None
+        try:
+            # 保留当前请求的上下文（Server-Timing 记到同一个请求上）
+            future = self.executor.submit(contextvars.copy_context().run, fn, *args)
+        except BaseException:
+            self._free.release()
+            raise
+        future.add_done_callback(lambda _: self._free.release())
+        return future
+
+
+_hedge_pool: Optional[HedgePool] = None
+_hedge_pool_lock = threading.Lock()
 
-def get_ai_client(model_name: str = 'deepseek') -> Optional[AIClient]:
+
+def get_hedge_pool_size() -> int:
     """
-    获取 AI 客户端实例
+    获取对冲线程池大小
+
+    每个对冲调用最多占两个线程（主请求和备用请求），
+    默认为批量生成线程数（AI_MAX_CONCURRENCY）的两倍，不少于 32；可用 AI_HEDGE_WORKERS 指定
+    """
+    default = max(32, 2 * int(os.getenv('AI_MAX_CONCURRENCY', 8)))
+    return int(os.getenv('AI_HEDGE_WORKERS', default))
+
+
+def get_hedge_pool() -> HedgePool:
+    """获取对冲请求的共享线程池（按需创建）"""
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _hedge_pool_lock:
+            if _hedge_pool is None:
+                _hedge_pool = HedgePool(get_hedge_pool_size())
+    return _hedge_pool
+
+
+def _run_cancellable(client: 'AIClient', cancel: threading.Event, student_name: str, student_info: str):
+    """在对冲线程中执行一次生成，cancel 被设置后请求在下一次排队或重试前停止"""
+    _hedge_cancel.set(cancel)
+    return client.generate(student_name, student_info)
+
+
+class HedgedClient(DelegatingClient):
+    """
+    对冲请求客户端
+
+    先把请求发给主服务商；如果在等待时间内（主服务商历史耗时的分位数）
+    还没有结果，或主服务商已经失败，就把同样的提示词再发给备用服务商。
+    谁先成功返回就用谁的结果，另一个请求的结果被忽略。
+    """
+
+    def __init__(self, primary: AIClient, secondary: AIClient):
+        """
+        参数:
+            primary: 主服务商客户端
+            secondary: 备用服务商客户端
+        """
+        super().__init__(primary)
+        self.secondary = secondary
+
+        self.percentile = float(os.getenv('AI_HEDGE_PERCENTILE', 90))
+        self.min_samples = int(os.getenv('AI_HEDGE_MIN_SAMPLES', 20))
+        self.default_delay = float(os.getenv('AI_HEDGE_DEFAULT_DELAY', 8))
+        self.min_delay = float(os.getenv('AI_HEDGE_MIN_DELAY', 1))
+
+    def hedge_delay(self) -> float:
+        """发出备用请求前的等待时间（秒）"""
+        if latency_tracker.count(self.primary.provider) < self.min_samples:
+            return self.default_delay
+        delay = latency_tracker.percentile(self.primary.provider, self.percentile)
+        return max(self.min_delay, delay)
+
+    def generate(self, student_name: str, student_info: str) -> GenerationResult:
+        """
+        生成评语，返回结果中的 provider 是实际给出结果的服务商
+
+        对冲线程池没有空闲线程时不做对冲，直接在调用方线程中请求主服务商；
+        两个请求都失败时抛出主服务商的原始异常（保留异常类型，用于降级原因和 429 响应）
+        """
+        pool = get_hedge_pool()
+        primary_cancel = threading.Event()
+        primary = pool.try_submit(_run_cancellable, self.primary, primary_cancel, student_name, student_info)
+        if primary is None:
+            ai_hedge_requests.inc(self.primary.provider, 'skipped')
+            return self.primary.generate(student_name, student_info)
+
+        # 等待主服务商；超时或已经失败就发出备用请求
+        done, _ = wait([primary], timeout=self.hedge_delay())
+        if done and primary.exception() is None:
+            return primary.result()
+
+        secondary_cancel = threading.Event()
+        secondary = pool.try_submit(_run_cancellable, self.secondary, secondary_cancel,
+                                    student_name, student_info)
+        if secondary is None:
+            ai_hedge_requests.inc(self.primary.provider, 'skipped')
+            return primary.result()
+        ai_hedge_requests.inc(self.primary.provider, 'sent')
+
+        pending = {primary: primary_cancel, secondary: secondary_cancel}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                del pending[future]
+                if future.exception() is None:
+                    # 另一个请求：还没开始的直接取消，已经开始的在下一次排队或重试前停止
+                    for other, cancel in pending.items():
+                        cancel.set()
+                        other.cancel()
+                    if future is secondary:
+                        ai_hedge_requests.inc(self.primary.provider, 'won')
+                    return future.result()
+
+        raise primary.exception()
+
+    def stream_comment(self, student_name: str,
+                       student_info: str) -> Generator[str, None, GenerationResult]:
+        """流式输出不做对冲，直接使用主服务商"""
+        return self.primary.stream_comment(student_name, student_info)
+
+
+# 已创建的客户端（按服务商和 API Key 缓存，进程内复用连接池）
+_clients: Dict[tuple, AIClient] = {}
+_clients_lock = threading.Lock()
+_clients_pid = os.getpid()
+
+
+def get_ai_client(model_name: str = 'deepseek', hedge: bool = False,
+                  fallback: bool = False) -> Optional[AIClient]:
+    """
+    获取 AI 客户端实例（同一服务商复用同一个长连接客户端）
 
     参数:
-        model_name: AI 模型名称（deepseek, zhipu, qwen, kimi）
+        model_name: AI 模型名称（deepseek, zhipu, qwen, kimi，
+                    或 auto：自动选择当前最快且未熔断的服务商）
+        hedge: 是否使用对冲请求；只有配置了 AI_HEDGE_PROVIDER
+               （且与 model_name 不同、已配置 API Key）时才生效
+        fallback: 服务商失败或过载时是否改用模板评语（AI_FALLBACK 关闭时不生效）
 
     返回:
         AI 客户端实例，如果未配置则返回 None
     """
+    if model_name.lower() == 'auto':
+        model_name = provider_health.choose(get_configured_providers())
+        if model_name is None:
+            raise ValueError("未配置任何 AI 模型的 API Key，请在 .env 文件中配置")
 
-    model_name = model_name.lower()
+    client = _get_provider_client(model_name)
 
-    # 根据模型名称获取对应的 API Key
-    api_key_map = {
-        'deepseek': os.getenv('DEEPSEEK_API_KEY'),
-        'zhipu': os.getenv('ZHIPU_API_KEY'),
-        'qwen': os.getenv('QWEN_API_KEY'),
-        'kimi': os.getenv('KIMI_API_KEY')
-    }
+    secondary_name = (os.getenv('AI_HEDGE_PROVIDER') or '').lower()
+    if hedge and secondary_name and secondary_name != client.provider:
+        try:
+            client = HedgedClient(client, _get_provider_client(secondary_name))
+        except ValueError:
+            # 备用服务商未配置时不做对冲
+            pass
 
-    # 客户端类映射
-    client_map = {
-        'deepseek': DeepSeekClient,
-        'zhipu': ZhipuClient,
-        'qwen': QwenClient,
-        'kimi': KimiClient
-    }
+    if fallback and fallback_enabled():
+        client = FallbackClient(client)
+    return client
+
+
+# 客户端类映射
+CLIENT_CLASSES = {
+    'deepseek': DeepSeekClient,
+    'zhipu': ZhipuClient,
+    'qwen': QwenClient,
+    'kimi': KimiClient
+}
+
+
+def get_api_key(model_name: str) -> Optional[str]:
+    """根据模型名称获取对应的 API Key（环境变量 <MODEL>_API_KEY）"""
+    return os.getenv(f'{model_name.upper()}_API_KEY')
+
+
+def get_configured_providers() -> List[str]:
+    """已配置 API Key 的服务商列表"""
+    return [name for name in CLIENT_CLASSES if get_api_key(name)]
 
-    api_key = api_key_map.get(model_name)
-    client_class = client_map.get(model_name)
+
+def _get_provider_client(model_name: str) -> AIClient:
+    """获取单个服务商的客户端（按服务商和 API Key 缓存）"""
+
+    model_name = model_name.lower()
+
+    api_key = get_api_key(model_name) if model_name in CLIENT_CLASSES else None
+    client_class = CLIENT_CLASSES.get(model_name)
 
     if not api_key:
         raise ValueError(f"未配置 {model_name} 的 API Key，请在 .env 文件中配置")
@@ -295,7 +948,127 @@ def get_ai_client(model_name: str = 'deepseek') -> Optional[AIClient]:
     if not client_class:
         raise ValueError(f"不支持的 AI 模型: {model_name}")
 
-    return client_class(api_key)
+    global _clients_pid
+    key = (model_name, api_key)
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            # fork 后不能复用父进程的 HTTP 连接
+            _clients.clear()
+            _clients_pid = os.getpid()
+        client = _clients.get(key)
+        if client is None:
+            client = client_class(api_key)
+            _clients[key] = client
+    return client
+
+
+# 每个服务商一个共享线程池，限制同时发往该服务商的请求数
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_provider_concurrency(model_name: str) -> int:
+    """
+    获取批量生成时每个服务商的线程数
+
+    优先读取 <MODEL>_MAX_CONCURRENCY（如 DEEPSEEK_MAX_CONCURRENCY），
+    否则使用 AI_MAX_CONCURRENCY，默认 8；不超过限流器的同时请求上限
+    （<MODEL>_MAX_INFLIGHT / AI_MAX_INFLIGHT），多出来的线程只会在限流器上排队
+    """
+    model_name = model_name.lower()
+    default = os.getenv('AI_MAX_CONCURRENCY', 8)
+    concurrency = max(1, int(os.getenv(f'{model_name.upper()}_MAX_CONCURRENCY', default)))
+    max_inflight = get_limiter(model_name).max_inflight
+    return min(concurrency, max_inflight) if max_inflight > 0 else concurrency
+
+
+def get_http_pool_size(model_name: str) -> int:
+    """
+    获取服务商的 HTTP keep-alive 连接池大小
+
+    等于限流器的同时请求上限（<MODEL>_MAX_INFLIGHT / AI_MAX_INFLIGHT）：
+    所有调用（单条、流式、批量、后台任务、对冲）都要先拿到限流名额，
+    同时进行的请求不会超过连接池大小，用完的连接都能放回池中复用。
+    不限制并发（设为 0）时按批量生成线程数和对冲线程数中较大的一个
+    """
+    model_name = model_name.lower()
+    max_inflight = get_limiter(model_name).max_inflight
+    if max_inflight > 0:
+        return max_inflight
+    return max(get_provider_concurrency(model_name), get_hedge_pool_size())
+
+
+def get_executor(model_name: str) -> ThreadPoolExecutor:
+    """获取服务商对应的共享线程池（按需创建）"""
+    model_name = model_name.lower()
+    executor = _executors.get(model_name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(model_name)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=get_provider_concurrency(model_name),
+                    thread_name_prefix=f'ai-{model_name}'
+                )
+                _executors[model_name] = executor
+    return executor
+
+
+def generate_comments(model_name: str, students: List[Dict], cache=None,
+                      force_fresh: bool = False, hedge: bool = False,
+                      fallback: bool = False) -> List[Dict]:
+    """
+    并发为多个学生生成评语
+
+    所有请求提交到该服务商的共享线程池，整批耗时约等于最慢的一次调用
+    （学生数超过并发上限时按上限分批执行）。
+
+    参数:
+        model_name: AI 模型名称
+        students: [{"student_name": ..., "student_info": ...}, ...]
+        cache: 生成缓存（GenerationCache，可选）
+        force_fresh: 是否跳过缓存重新生成
+        hedge: 是否使用对冲请求
+        fallback: 服务商失败或过载时是否改用模板评语
+
+    返回:
+        与 students 顺序一致的结果列表，每项为
+        {"comment": 评语, "provider": 实际服务商, "usage": GenerationResult.accounting(),
+         "fallback": 是否为模板评语}
+        或 {"error": 错误信息}
+
+    异常:
+        ValueError: API Key 未配置或模型不支持
+    """
+    ai_client = get_ai_client(model_name, hedge=hedge, fallback=fallback)
+    executor = get_executor(ai_client.provider)
+
+    def generate(student):
+        if cache is not None:
+            return cache.generate(
+                ai_client,
+                student['student_name'],
+                student['student_info'],
+                force_fresh=force_fresh
+            )
+        return ai_client.generate(student['student_name'], student['student_info'])
+
+    # 每个任务在当前上下文的副本中执行，耗时记到发起批量生成的请求上
+    futures = [executor.submit(contextvars.copy_context().run, generate, student) for student in students]
+
+    results = []
+    for future in futures:
+        try:
+            result = future.result()
+            results.append({
+                'comment': result.comment,
+                'provider': result.provider,
+                'usage': result.accounting(),
+                'fallback': result.fallback
+            })
+        except Exception as e:
+            results.append({'error': str(e)})
+    return results
 
 
 # 测试代码
@@ -0,0 +1,208 @@
+"""
+异步 AI 客户端（asyncio + aiohttp）
+用于大批量生成：单个进程、单个线程即可同时保持上千个进行中的请求
+
+请求体构建、响应解析和重试策略与同步客户端（utils.ai_client）共用，
+每个服务商的异步版本都包装对应的同步客户端。
+限流（每分钟请求数、token 数和同时请求上限）与同步调用共用同一个限流器，
+批量生成不会绕过服务商的额度。
+"""
+
+import asyncio
+import time
+from typing import AsyncIterator, Dict, Iterable, Optional
+
+import aiohttp
+
+from .ai_client import (
+    AIClient, GenerationResult, RETRY_STATUS_CODES, _get_provider_client, estimate_tokens, get_http_pool_size
+)
+from .metrics import ai_generations_in_flight, observe_ai_call
+from .provider_stats import latency_tracker, provider_health, usage_stats
+from .rate_limit import get_limiter
+
+
+class AsyncAIClient:
+    """
+    异步 AI 客户端
+
+    用法:
+        async with get_async_ai_client('deepseek') as client:
+            async for result in client.generate_many(students, concurrency=50):
+                ...
+    """
+
+    def __init__(self, client: AIClient, base_url: Optional[str] = None):
+        """
+        参数:
+            client: 对应服务商的同步客户端（提供请求体、解析和重试配置）
+            base_url: 覆盖接口地址（测试时指向本地模拟服务）
+        """
+        self.client = client
+        self.provider = client.provider
+        self.model = getattr(client, 'model', '')
+        self.base_url = base_url or client.base_url
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self, pool_size: Optional[int] = None):
+        """
+        创建 HTTP 会话
+
+        参数:
+            pool_size: 连接池大小（默认与同步客户端相同，等于限流器的同时请求上限）
+        """
+        if self.session is None:
+            if pool_size is None:
+                pool_size = get_http_pool_size(self.provider)
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=pool_size),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=self.client.connect_timeout,
+                    sock_read=self.client.read_timeout
+                )
+            )
+
+    async def close(self):
+        """关闭 HTTP 会话"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _post(self, data: Dict) -> tuple:
+        """发送请求并返回 (响应 JSON, 重试次数)（重试策略与同步客户端一致）"""
+        attempt = 0
+        while True:
+            try:
+                async with self.session.post(
+                    self.base_url,
+                    headers=self.client._headers(),
+                    json=data
+                ) as response:
+                    if response.status in RETRY_STATUS_CODES and attempt < self.client.max_retries:
+                        delay = self.client._retry_after_delay(response)
+                    else:
+                        response.raise_for_status()
+                        return await response.json(content_type=None), attempt
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.client.max_retries:
+                    raise
+                delay = None
+
+            # 等待期间归还并发名额，重试重新排队并计入 RPM/TPM
+            await get_limiter(self.provider).backoff_async(
+                delay if delay is not None else self.client._backoff_delay(attempt))
+            attempt += 1
+
+    async def generate(self, student_name: str, student_info: str) -> GenerationResult:
+        """
+        生成学生评语
+
+        返回:
+            GenerationResult
+
+        异常:
+            RateLimitTimeout: 限流排队超过 AI_RATE_LIMIT_MAX_WAIT 秒
+        """
+        if self.session is None:
+            await self.open()
+        self.client._check_available()
+
+        # 与同步调用共用限流额度，超出时在这里排队
+        limiter = get_limiter(self.provider)
+        async with limiter.acquire_async(estimate_tokens(student_name, student_info)) as queue_wait:
+            start = time.monotonic()
+            ai_generations_in_flight.inc(self.provider)
+            try:
+                result, retries = await self._post(self.client._build_data(student_name, student_info))
+                comment = self.client._parse_response(result)
+                usage = self.client._parse_usage(result)
+                usage['retries'] = retries
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                observe_ai_call(self.provider, time.monotonic() - start, e)
+                provider_health.record_failure(self.provider)
+                raise Exception(f"{self.client.display_name} API 调用失败: {str(e) or type(e).__name__}")
+            except Exception as e:
+                observe_ai_call(self.provider, time.monotonic() - start, e)
+                provider_health.record_failure(self.provider)
+                raise
+            finally:
+                ai_generations_in_flight.dec(self.provider)
+            latency = time.monotonic() - start
+        observe_ai_call(self.provider, latency)
+        latency_tracker.record(self.provider, latency)
+        provider_health.record_success(self.provider, latency)
+        usage_stats.record(self.provider, usage)
+        return GenerationResult(comment, self.provider, self.model, latency, queue_wait, usage)
+
+    async def generate_many(self, items: Iterable[Dict], concurrency: int = 10) -> AsyncIterator[Dict]:
+        """
+        并发生成多条评语，按完成顺序逐条产出结果
+
+        参数:
+            items: [{"student_name": ..., "student_info": ...}, ...]（可以是生成器，按需读取）
+            concurrency: 同时进行的请求数（不超过限流器的同时请求上限 AI_MAX_INFLIGHT，
+                         多出来的协程只会在限流器上排队）
+
+        返回:
+            异步生成器，每项为
+            {"index": 在 items 中的序号, "comment": 评语, "provider": 服务商}
+            或 {"index": 序号, "error": 错误信息}
+        """
+        if self.session is None:
+            await self.open()
+
+        max_inflight = get_limiter(self.provider).max_inflight
+        if max_inflight > 0:
+            concurrency = min(concurrency, max_inflight)
+
+        source = iter(enumerate(items))
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def worker():
+            # 每个协程依次从 items 取任务，内存占用只与 concurrency 有关
+            for index, item in source:
+                try:
+                    result = await self.generate(item['student_name'], item['student_info'])
+                    await results.put({
+                        'index': index,
+                        'comment': result.comment,
+                        'provider': result.provider
+                    })
+                except Exception as e:
+                    await results.put({'index': index, 'error': str(e)})
+
+        workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+        done = asyncio.gather(*workers)
+        try:
+            while not (done.done() and results.empty()):
+                getter = asyncio.ensure_future(results.get())
+                await asyncio.wait({getter, done}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+            await done
+        finally:
+            for task in workers:
+                task.cancel()
+
+
+def get_async_ai_client(model_name: str = 'deepseek', base_url: Optional[str] = None) -> AsyncAIClient:
+    """
+    获取异步 AI 客户端
+
+    参数:
+        model_name: AI 模型名称（deepseek, zhipu, qwen, kimi）
+        base_url: 覆盖接口地址（可选）
+
+    返回:
+        AsyncAIClient（需要在 async with 中使用，或手动 open/close）
+    """
+    return AsyncAIClient(_get_provider_client(model_name), base_url)
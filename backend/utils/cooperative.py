@@ -0,0 +1,74 @@
+"""
+协程（gevent）部署下的阻塞调用
+在 gevent worker 中，CPU 密集或在 C 代码里等待的调用会卡住整个进程的事件循环，
+期间所有其他请求都无法推进：
+- bcrypt 计算
+- SQLite 语句：等待写锁（busy_timeout）、提交时 fsync、BEGIN IMMEDIATE 都在 C 代码中阻塞，
+  monkey patch 管不到
+这类调用交给 gevent 的原生线程池执行，当前协程让出，其他请求继续处理；
+bcrypt 和 SQLite 执行时都释放 GIL，可以真正并行。
+
+非 gevent 环境（python app.py、线程 worker）下直接调用，没有额外开销。
+"""
+
+import sys
+from typing import Any, Callable, Optional
+
+from .metrics import TimedConnection, TimedCursor
+
+
+def is_gevent_patched() -> bool:
+    """当前进程是否已被 gevent monkey patch"""
+    if 'gevent.monkey' not in sys.modules:
+        return False
+    return sys.modules['gevent.monkey'].is_module_patched('threading')
+
+
+def run_blocking(fn: Callable, *args, **kwargs) -> Any:
+    """
+    执行一个会长时间占用 CPU 或阻塞的调用
+
+    gevent 环境下在原生线程池中执行并等待结果（只阻塞当前协程），否则直接调用
+    """
+    if is_gevent_patched():
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
+
+
+def native_threadpool(size: int) -> Optional[Any]:
+    """gevent 环境下创建一个独立的原生线程池（最多 size 个线程），否则返回 None"""
+    if not is_gevent_patched():
+        return None
+    from gevent.threadpool import ThreadPool
+    return ThreadPool(size)
+
+
+class CooperativeCursor(TimedCursor):
+    """在原生线程中执行语句的游标（第一行结果在 execute 中取出，等待写锁也发生在这里）"""
+
+    def _call(self, method, *args):
+        return run_blocking(method, *args)
+
+
+class CooperativeConnection(TimedConnection):
+    """
+    gevent 环境下使用的 SQLite 连接（sqlite3.connect(..., factory=CooperativeConnection)）
+
+    语句执行、提交和回滚都在原生线程中进行，只挂起当前协程；同时记录语句耗时。
+    连接需要 check_same_thread=False（同一时刻仍然只被一个协程使用）
+    """
+
+    def cursor(self, factory=CooperativeCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        return run_blocking(super().commit)
+
+    def rollback(self):
+        return run_blocking(super().rollback)
+
+
+def connection_factory():
+    """SQLite 连接类：gevent 环境下为 CooperativeConnection，否则为 TimedConnection"""
+    return CooperativeConnection if is_gevent_patched() else TimedConnection
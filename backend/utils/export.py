@@ -0,0 +1,421 @@
+"""
+评语导出（CSV / XLSX / DOCX）
+三种格式都是边读边写的生成器：数据库游标每取出一批评语，就编码成对应格式产出一段字节，
+整个文件不会在内存中拼出来，导出几万条评语时内存占用也基本不变。
+
+XLSX 和 DOCX 本质上是 zip 压缩的 XML 文件。这里不依赖 openpyxl / python-docx
+（它们都要先在内存或临时文件中建好整个文档），而是直接写出最小的 Office Open XML 结构，
+用标准库 zipfile 写进一个不可 seek 的缓冲区（zip 条目使用数据描述符，不需要回写文件头），
+缓冲区每积累 CHUNK_SIZE 字节就交给 HTTP 响应发送出去。
+"""
+
+import csv
+import io
+import re
+import zipfile
+from itertools import groupby
+from typing import Dict, Iterable, Iterator
+from xml.sax.saxutils import escape
+
+# 导出的列：(字段名, 表头)
+EXPORT_COLUMNS = (
+    ('student_name', '学生姓名'),
+    ('class_name', '班级'),
+    ('student_info', '学生信息'),
+    ('generated_comment', '评语'),
+    ('ai_model', '模型'),
+    ('created_at', '生成时间'),
+)
+
+# 没有班级的评语分组名
+NO_CLASS = '未分班'
+
+# 缓冲多少字节后发送一段
+CHUNK_SIZE = 64 * 1024
+
+# CSV 每多少行发送一段
+CSV_ROWS_PER_CHUNK = 200
+
+# 各格式的 MIME 类型
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+}
+
+# XML 1.0 不允许的控制字符
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+# 工作表名不允许的字符
+_INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+
+def class_label(row: Dict) -> str:
+    """评语所在班级（没有班级时为 NO_CLASS）"""
+    return row.get('class_name') or NO_CLASS
+
+
+def _xml_text(value) -> str:
+    """转义成 XML 文本（去掉 XML 不允许的控制字符）"""
+    if value is None:
+        return ''
+    return escape(_INVALID_XML_CHARS.sub('', str(value)))
+
+
+def _xml_attr(value) -> str:
+    return _xml_text(value).replace('"', '&quot;')
+
+
+class _ChunkSink:
+    """
+    zipfile 的输出目标：只支持 write，不支持 tell / seek
+
+    zipfile 检测到输出不可 seek 时会在每个条目后写数据描述符，
+    写出的字节先存在这里，由调用方定期取走发送。
+    """
+
+    def __init__(self):
+        self._parts = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        """取走已写出的字节"""
+        data = b''.join(self._parts)
+        self._parts.clear()
+        self.size = 0
+        return data
+
+
+# ===== CSV =====
+
+def _csv_cell(value) -> str:
+    """CSV 单元格：以 = + - @ 开头的内容前加单引号，防止被电子表格当成公式执行"""
+    if value is None:
+        return ''
+    value = str(value)
+    if value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def export_csv(rows: Iterable[Dict]) -> Iterator[bytes]:
+    """
+    导出 CSV（UTF-8 带 BOM，Excel 直接打开中文不乱码）
+
+    按班级分组时由调用方按班级排序，班级列相同的行排在一起
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([title for _, title in EXPORT_COLUMNS])
+    yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+
+    count = 0
+    for row in rows:
+        if count == 0:
+            buffer.seek(0)
+            buffer.truncate()
+        writer.writerow([_csv_cell(row.get(column)) for column, _ in EXPORT_COLUMNS])
+        count += 1
+        if count == CSV_ROWS_PER_CHUNK:
+            yield buffer.getvalue().encode('utf-8')
+            count = 0
+    if count:
+        yield buffer.getvalue().encode('utf-8')
+
+
+# ===== XLSX =====
+
+_XLSX_COLUMN_WIDTHS = (12, 12, 30, 60, 12, 20)
+_XLSX_COLUMN_LETTERS = 'ABCDEF'
+_XLSX_WRAP_COLUMNS = ('student_info', 'generated_comment')
+
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+# 样式 0：默认；1：表头加粗；2：自动换行、顶端对齐（学生信息和评语）
+_XLSX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0" applyAlignment="1">'
+    '<alignment wrapText="1" vertical="top"/></xf>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def _sheet_name(name: str, used: set) -> str:
+    """合法且不重复的工作表名（不超过 31 个字符，不含 []:*?/\\）"""
+    base = _INVALID_SHEET_CHARS.sub('_', _INVALID_XML_CHARS.sub('', name)).strip("' ")[:31] or NO_CLASS
+    candidate, index = base, 1
+    while candidate.lower() in used:
+        index += 1
+        suffix = f'({index})'
+        candidate = base[:31 - len(suffix)] + suffix
+    used.add(candidate.lower())
+    return candidate
+
+
+def _xlsx_row(index: int, values, styles) -> str:
+    cells = []
+    for letter, value, style in zip(_XLSX_COLUMN_LETTERS, values, styles):
+        style_attr = f' s="{style}"' if style else ''
+        cells.append(f'<c r="{letter}{index}" t="inlineStr"{style_attr}>'
+                     f'<is><t xml:space="preserve">{_xml_text(value)}</t></is></c>')
+    return f'<row r="{index}">' + ''.join(cells) + '</row>'
+
+
+def _xlsx_sheet_head() -> str:
+    cols = ''.join(f'<col min="{i}" max="{i}" width="{width}" customWidth="1"/>'
+                   for i, width in enumerate(_XLSX_COLUMN_WIDTHS, start=1))
+    header = _xlsx_row(1, [title for _, title in EXPORT_COLUMNS], [1] * len(EXPORT_COLUMNS))
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        # 冻结表头
+        '<sheetViews><sheetView workbookViewId="0">'
+        '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+        '</sheetView></sheetViews>'
+        f'<cols>{cols}</cols><sheetData>{header}'
+    )
+
+
+def export_xlsx(rows: Iterable[Dict], group_by_class: bool = False) -> Iterator[bytes]:
+    """
+    导出 XLSX
+
+    参数:
+        rows: 评语字典（按班级分组时必须已按班级排序）
+        group_by_class: 是否每个班级一个工作表
+    """
+    sink = _ChunkSink()
+    archive = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED)
+    styles = [2 if column in _XLSX_WRAP_COLUMNS else 0 for column, _ in EXPORT_COLUMNS]
+
+    groups = groupby(rows, key=class_label) if group_by_class else [('评语', rows)]
+    sheet_names = []
+    used = set()
+    for name, group in groups:
+        sheet_names.append(_sheet_name(name, used))
+        with archive.open(f'xl/worksheets/sheet{len(sheet_names)}.xml', 'w') as sheet:
+            sheet.write(_xlsx_sheet_head().encode('utf-8'))
+            for index, row in enumerate(group, start=2):
+                sheet.write(_xlsx_row(index, [row.get(column) for column, _ in EXPORT_COLUMNS],
+                                      styles).encode('utf-8'))
+                if sink.size >= CHUNK_SIZE:
+                    yield sink.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    if not sheet_names:
+        # 没有评语时也输出一个只有表头的工作表
+        sheet_names.append('评语')
+        archive.writestr('xl/worksheets/sheet1.xml', _xlsx_sheet_head() + '</sheetData></worksheet>')
+
+    # 工作表数量确定后再写工作簿（zip 中条目的顺序无关紧要）
+    sheets = ''.join(f'<sheet name="{_xml_attr(name)}" sheetId="{i}" r:id="rId{i}"/>'
+                     for i, name in enumerate(sheet_names, start=1))
+    archive.writestr('xl/workbook.xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets>{sheets}</sheets></workbook>'
+    ))
+    relationships = ''.join(
+        f'<Relationship Id="rId{i}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, len(sheet_names) + 1)
+    )
+    styles_id = len(sheet_names) + 1
+    archive.writestr('xl/_rels/workbook.xml.rels', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'{relationships}'
+        f'<Relationship Id="rId{styles_id}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ))
+    archive.writestr('xl/styles.xml', _XLSX_STYLES)
+    archive.writestr('_rels/.rels', _XLSX_ROOT_RELS)
+    overrides = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(sheet_names) + 1)
+    )
+    archive.writestr('[Content_Types].xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        f'{overrides}'
+        '</Types>'
+    ))
+    archive.close()
+    yield sink.drain()
+
+
+# ===== DOCX =====
+
+_DOCX_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+_DOCX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<w:styles xmlns:w="{_DOCX_NAMESPACE}">'
+    '<w:docDefaults><w:rPrDefault><w:rPr>'
+    '<w:rFonts w:ascii="Times New Roman" w:hAnsi="Times New Roman" w:eastAsia="宋体"/>'
+    '<w:sz w:val="24"/><w:lang w:eastAsia="zh-CN"/>'
+    '</w:rPr></w:rPrDefault>'
+    '<w:pPrDefault><w:pPr><w:spacing w:after="120" w:line="360" w:lineRule="auto"/></w:pPr></w:pPrDefault>'
+    '</w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/>'
+    '<w:pPr><w:ind w:firstLineChars="200"/></w:pPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/><w:basedOn w:val="Normal"/>'
+    '<w:pPr><w:jc w:val="center"/><w:ind w:firstLineChars="0"/><w:spacing w:after="240"/></w:pPr>'
+    '<w:rPr><w:rFonts w:eastAsia="黑体"/><w:b/><w:sz w:val="36"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/><w:basedOn w:val="Normal"/>'
+    '<w:pPr><w:keepNext/><w:ind w:firstLineChars="0"/><w:spacing w:before="240" w:after="120"/>'
+    '<w:outlineLvl w:val="0"/></w:pPr>'
+    '<w:rPr><w:rFonts w:eastAsia="黑体"/><w:b/><w:sz w:val="32"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading2"><w:name w:val="heading 2"/><w:basedOn w:val="Normal"/>'
+    '<w:pPr><w:keepNext/><w:ind w:firstLineChars="0"/><w:spacing w:before="200" w:after="60"/>'
+    '<w:outlineLvl w:val="1"/></w:pPr>'
+    '<w:rPr><w:rFonts w:eastAsia="黑体"/><w:b/><w:sz w:val="26"/></w:rPr></w:style>'
+    '</w:styles>'
+)
+
+_DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '</Types>'
+)
+
+_DOCX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+_DOCX_DOCUMENT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+# A4 纸，页边距 2.5cm
+_DOCX_SECTION = (
+    '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+    '<w:pgMar w:top="1417" w:right="1417" w:bottom="1417" w:left="1417" '
+    'w:header="851" w:footer="992" w:gutter="0"/></w:sectPr>'
+)
+
+
+def _docx_paragraph(text, style: str = None, page_break: bool = False) -> str:
+    """一个段落；文本中的换行转换成段内换行"""
+    properties = ''
+    if style or page_break:
+        properties = '<w:pPr>' + (f'<w:pStyle w:val="{style}"/>' if style else '') + \
+            ('<w:pageBreakBefore/>' if page_break else '') + '</w:pPr>'
+    lines = _xml_text(text).split('\n')
+    runs = '<w:br/>'.join(f'<w:t xml:space="preserve">{line}</w:t>' for line in lines)
+    return f'<w:p>{properties}<w:r>{runs}</w:r></w:p>'
+
+
+def export_docx(rows: Iterable[Dict], group_by_class: bool = False, title: str = '学生评语') -> Iterator[bytes]:
+    """
+    导出 DOCX：每个学生一个小标题（姓名）加一段评语
+
+    参数:
+        rows: 评语字典（按班级分组时必须已按班级排序）
+        group_by_class: 是否按班级分节（每个班级从新的一页开始，班级名为一级标题）
+        title: 文档标题
+    """
+    sink = _ChunkSink()
+    archive = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED)
+
+    with archive.open('word/document.xml', 'w') as document:
+        document.write((
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<w:document xmlns:w="{_DOCX_NAMESPACE}"><w:body>'
+            + _docx_paragraph(title, 'Title')
+        ).encode('utf-8'))
+
+        groups = groupby(rows, key=class_label) if group_by_class else [(None, rows)]
+        for index, (name, group) in enumerate(groups):
+            if name is not None:
+                document.write(_docx_paragraph(name, 'Heading1', page_break=index > 0).encode('utf-8'))
+            for row in group:
+                document.write((
+                    _docx_paragraph(row.get('student_name'), 'Heading2')
+                    + _docx_paragraph(row.get('generated_comment'))
+                ).encode('utf-8'))
+                if sink.size >= CHUNK_SIZE:
+                    yield sink.drain()
+
+        document.write((_DOCX_SECTION + '</w:body></w:document>').encode('utf-8'))
+
+    archive.writestr('word/styles.xml', _DOCX_STYLES)
+    archive.writestr('word/_rels/document.xml.rels', _DOCX_DOCUMENT_RELS)
+    archive.writestr('_rels/.rels', _DOCX_ROOT_RELS)
+    archive.writestr('[Content_Types].xml', _DOCX_CONTENT_TYPES)
+    archive.close()
+    yield sink.drain()
+
+
+def export_comments(file_format: str, rows: Iterable[Dict], group_by_class: bool = False) -> Iterator[bytes]:
+    """
+    按格式导出评语
+
+    参数:
+        file_format: csv / xlsx / docx
+        rows: 评语字典（按班级分组时必须已按班级排序）
+        group_by_class: 是否按班级分组（XLSX 每班一个工作表，DOCX 每班一节，CSV 只按班级排序）
+
+    异常:
+        ValueError: 不支持的格式
+    """
+    if file_format == 'csv':
+        return export_csv(rows)
+    if file_format == 'xlsx':
+        return export_xlsx(rows, group_by_class)
+    if file_format == 'docx':
+        return export_docx(rows, group_by_class)
+    raise ValueError(f"不支持的导出格式: {file_format}")
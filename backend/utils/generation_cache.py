@@ -0,0 +1,193 @@
+"""
+评语生成缓存
+相同服务商、模型、提示词版本和学生信息的请求直接返回已生成的评语，
+避免重复调用付费 API
+
+两级缓存:
+    内存: 有容量上限的 LRU，带过期时间
+    持久: SQLite 表（由调用方传入的 store 实现），进程重启后仍然有效
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import unicodedata
+from concurrent.futures import CancelledError, Future, TimeoutError as FutureTimeoutError
+from typing import Dict, Optional
+
+from .ai_client import AIClient, GenerationResult
+from .lru_cache import LRUCache
+from .prompts import PROMPT_VERSION
+
+
+def normalize_text(text: str) -> str:
+    """规范化输入：全角转半角、去掉标点两侧的空白、合并空白、去掉首尾空白"""
+    text = unicodedata.normalize('NFKC', text or '')
+    text = re.sub(r'\s*([,.;:!?、。])\s*', r'\1', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class GenerationCache:
+    """评语生成缓存（内存 LRU + 持久层）"""
+
+    def __init__(self, store=None, max_size: int = None, ttl: float = None, inflight_wait: float = None):
+        """
+        参数:
+            store: 持久层，需要提供 get(key, max_age)（返回包含 generated_comment
+                   和 provider 的字典）、set(key, provider, comment)、
+                   purge_expired(max_age)，为 None 时只使用内存缓存
+            max_size: 内存缓存条目数（默认读取 GENERATION_CACHE_SIZE）
+            ttl: 缓存有效期（秒，默认读取 GENERATION_CACHE_TTL）
+            inflight_wait: 等待相同请求的生成结果最多多少秒，超时后自己生成
+                           （默认读取 GENERATION_CACHE_INFLIGHT_WAIT）
+        """
+        self.ttl = ttl or float(os.getenv('GENERATION_CACHE_TTL', 86400))
+        self.memory = LRUCache(
+            max_size or int(os.getenv('GENERATION_CACHE_SIZE', 1024)),
+            self.ttl
+        )
+        self.store = store
+        self.inflight_wait = inflight_wait or float(os.getenv('GENERATION_CACHE_INFLIGHT_WAIT', 60))
+
+        # 正在生成中的请求：相同的并发请求等待同一个结果，不重复调用 API
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'persistent_hits': 0,
+            'inflight_hits': 0,
+            'inflight_timeouts': 0,
+            'misses': 0,
+            'force_fresh': 0
+        }
+
+    @staticmethod
+    def make_key(client: AIClient, student_name: str, student_info: str) -> str:
+        """根据服务商、模型、提示词版本和规范化后的学生信息计算缓存键"""
+        raw = json.dumps([
+            client.provider,
+            getattr(client, 'model', ''),
+            PROMPT_VERSION,
+            normalize_text(student_name),
+            normalize_text(student_info)
+        ], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def lookup(self, key: str) -> Optional[GenerationResult]:
+        """依次查询内存和持久层，持久层命中时回填内存"""
+        result = self.memory.get(key)
+        if result is not None:
+            self._count('memory_hits')
+            return result
+
+        if self.store is not None:
+            try:
+                row = self.store.get(key, self.ttl)
+            except Exception as e:
+                # 持久层出错时当作未命中，不影响生成
+                print(f"[WARN] 读取生成缓存失败: {str(e)}")
+                row = None
+            if row is not None:
+                result = GenerationResult(row['generated_comment'], row['provider'])
+                self.memory.set(key, result)
+                self._count('persistent_hits')
+                return result
+        return None
+
+    @staticmethod
+    def _cached_copy(result: GenerationResult) -> GenerationResult:
+        """缓存中保存的副本：不带用量和耗时，命中缓存不算作一次服务商调用"""
+        return GenerationResult(result.comment, result.provider, result.model, fallback=result.fallback)
+
+    def put(self, key: str, result: GenerationResult):
+        """写入两级缓存（降级模式的模板评语不缓存，服务商恢复后重新生成）"""
+        if result.fallback:
+            return
+        self.memory.set(key, self._cached_copy(result))
+        if self.store is not None:
+            try:
+                self.store.set(key, result.provider, result.comment)
+                # 偶尔顺便清理过期的持久缓存
+                if random.random() < 0.01:
+                    self.store.purge_expired(self.ttl)
+            except Exception as e:
+                print(f"[WARN] 写入生成缓存失败: {str(e)}")
+
+    def generate(self, client: AIClient, student_name: str, student_info: str,
+                 force_fresh: bool = False) -> GenerationResult:
+        """
+        带缓存地生成评语
+
+        参数:
+            client: AI 客户端
+            student_name: 学生姓名
+            student_info: 学生信息
+            force_fresh: 为 True 时跳过缓存重新生成（老师想要一个新版本），
+                         新结果会覆盖旧缓存
+
+        返回:
+            GenerationResult（命中缓存时 provider 为当初实际生成的服务商）
+        """
+        key = self.make_key(client, student_name, student_info)
+
+        if force_fresh:
+            self._count('force_fresh')
+            result = client.generate(student_name, student_info)
+            self.put(key, result)
+            return result
+
+        result = self.lookup(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            pending = self._inflight.get(key)
+            leader = pending is None
+            if leader:
+                pending = Future()
+                self._inflight[key] = pending
+                self._stats['misses'] += 1
+            else:
+                self._stats['inflight_hits'] += 1
+
+        if not leader:
+            try:
+                return self._cached_copy(pending.result(timeout=self.inflight_wait))
+            except (FutureTimeoutError, CancelledError):
+                # 相同请求迟迟没有结果，或生成被中断（没有给出结果）：自己生成，不再无限等待
+                self._count('inflight_timeouts')
+                result = client.generate(student_name, student_info)
+                self.put(key, result)
+                return result
+
+        try:
+            result = client.generate(student_name, student_info)
+            self.put(key, result)
+            pending.set_result(result)
+            return result
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            # BaseException（协程被杀、线程退出）时没有结果也没有异常：取消，让等待的请求自己生成
+            pending.cancel()
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> Dict:
+        """命中和未命中次数"""
+        with self._lock:
+            stats = dict(self._stats)
+        hits = stats['memory_hits'] + stats['persistent_hits'] + stats['inflight_hits']
+        total = hits + stats['misses']
+        stats['hits'] = hits
+        stats['hit_rate'] = round(hits / total, 4) if total else 0.0
+        stats['memory_size'] = len(self.memory)
+        return stats
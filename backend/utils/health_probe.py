@@ -0,0 +1,64 @@
+"""
+服务商健康探测
+后台线程定期检查已熔断的服务商，冷却时间过后发送探测请求，成功则恢复
+"""
+
+import os
+import threading
+import time
+
+from .ai_client import get_configured_providers, _get_provider_client
+from .provider_stats import provider_health
+
+
+class HealthProber:
+    """熔断服务商的后台探测线程"""
+
+    def __init__(self, interval: float = None):
+        """
+        参数:
+            interval: 检查间隔（秒，默认读取 AI_PROBE_INTERVAL）
+        """
+        self.interval = interval or float(os.getenv('AI_PROBE_INTERVAL', 5))
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """确保当前进程中的探测线程已启动（fork 后的子进程需要重新启动）"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='ai-health-probe', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """停止探测线程"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+        self._pid = None
+
+    def probe_due(self):
+        """探测所有冷却时间已过的熔断服务商"""
+        for provider in get_configured_providers():
+            if not provider_health.due_for_probe(provider):
+                continue
+            client = _get_provider_client(provider)
+            start = time.monotonic()
+            ok = client.probe()
+            provider_health.record_probe(provider, ok, time.monotonic() - start if ok else None)
+
+    def _run(self):
+        """探测线程主循环"""
+        while not self._stop.wait(self.interval):
+            try:
+                self.probe_due()
+            except Exception as e:
+                print(f"[WARN] 服务商健康探测失败: {str(e)}")
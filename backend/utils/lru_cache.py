@@ -0,0 +1,73 @@
+"""
+内存 LRU 缓存
+有容量上限和过期时间，线程安全；用于评语生成缓存、用户信息缓存等进程内缓存
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict
+
+
+class LRUCache:
+    """线程安全的 LRU 缓存，带过期时间和命中统计"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 86400):
+        """
+        参数:
+            max_size: 最多缓存的条目数
+            ttl: 过期时间（秒）
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        """读取缓存，不存在或已过期返回 None"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._stats['misses'] += 1
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self._stats['misses'] += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key, value):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def delete(self, key):
+        """删除缓存（数据被修改时调用）"""
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        """命中、未命中、淘汰和失效次数"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._data)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def __len__(self):
+        return len(self._data)
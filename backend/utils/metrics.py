@@ -0,0 +1,297 @@
+"""
+进程内监控指标（Prometheus 文本格式）
+计数器、直方图和仪表盘都在内存中累计，每次记录只做一次加锁和几次加法，
+由 /metrics 接口按 Prometheus 文本格式输出。
+
+多进程部署时每个进程各自统计，由 Prometheus 按实例分别抓取后汇总。
+"""
+
+import bisect
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from . import request_timing
+
+
+# 默认的耗时分桶（秒）：覆盖从毫秒级的 SQLite 查询到几十秒的 AI 生成
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    """转义标签值中的反斜杠、双引号和换行"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: Tuple = ()) -> str:
+    """格式化标签：{name="value",...}，没有标签时返回空字符串"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """指标基类：按标签值分别累计（线程安全）"""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        """
+        参数:
+            name: 指标名称
+            documentation: 说明（输出为 # HELP）
+            labels: 标签名列表
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Sequence) -> Tuple:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} 需要 {len(self.label_names)} 个标签值")
+        return tuple(str(value) for value in labels)
+
+    def render(self) -> List[str]:
+        """输出 Prometheus 文本格式的行"""
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}'
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines += self._render_items(items)
+        return lines
+
+    def _render_items(self, items) -> List[str]:
+        return [
+            f'{self.name}{_format_labels(self.label_names, key)} {_format_number(value)}'
+            for key, value in items
+        ]
+
+
+class Counter(Metric):
+    """只增不减的计数器"""
+
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """可增可减的当前值（如进行中的请求数）"""
+
+    kind = 'gauge'
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """
+    直方图：按分桶统计观测值的分布
+
+    每个标签组合保存 [各桶计数..., 总数, 总和]，桶计数不累加，输出时再转换成累计值。
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        """记录一次观测值"""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # 最后一个桶是 +Inf
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0, 0.0]
+            state[index] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    def _render_items(self, items) -> List[str]:
+        lines = []
+        bounds = self.buckets + (float('inf'),)
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(bounds, state):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, (('le', _format_number(bound)),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_count{labels} {state[-2]}')
+            lines.append(f'{self.name}_sum{labels} {_format_number(state[-1])}')
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """所有指标的 Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+# 全局注册表（/metrics 输出的内容）
+registry = Registry()
+
+http_request_duration = registry.register(Histogram(
+    'http_request_duration_seconds',
+    'HTTP 请求耗时（流式响应只统计到开始返回为止）',
+    ('method', 'route', 'status')
+))
+http_requests_in_flight = registry.register(Gauge(
+    'http_requests_in_flight',
+    '正在处理的 HTTP 请求数'
+))
+ai_request_duration = registry.register(Histogram(
+    'ai_provider_request_duration_seconds',
+    'AI 服务商调用耗时（不含限流排队）',
+    ('provider', 'outcome')
+))
+ai_request_errors = registry.register(Counter(
+    'ai_provider_errors_total',
+    'AI 服务商调用失败次数',
+    ('provider', 'error')
+))
+ai_generations_in_flight = registry.register(Gauge(
+    'ai_generations_in_flight',
+    '正在进行的 AI 生成数',
+    ('provider',)
+))
+ai_fallback_generations = registry.register(Counter(
+    'ai_fallback_generations_total',
+    '服务商失败或过载时改用模板评语的次数',
+    ('provider', 'reason')
+))
+ai_hedge_requests = registry.register(Counter(
+    'ai_hedge_requests_total',
+    '对冲请求次数（sent: 发出备用请求，won: 备用请求先成功，skipped: 对冲线程池已满未发出）',
+    ('provider', 'result')
+))
+password_hash_duration = registry.register(Histogram(
+    'password_hash_duration_seconds',
+    'bcrypt 哈希计算耗时（含在进程池中排队的时间）',
+    ('operation',)
+))
+password_hash_rejected = registry.register(Counter(
+    'password_hash_rejected_total',
+    '等待中的哈希计算达到上限而被拒绝的次数',
+    ('operation',)
+))
+user_cache_lookups = registry.register(Counter(
+    'user_cache_lookups_total',
+    '用户信息缓存查询次数（hit / miss）',
+    ('result',)
+))
+comment_write_group_size = registry.register(Histogram(
+    'comment_write_group_size',
+    '评语写入器每个事务合并的请求数',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+))
+sqlite_query_duration = registry.register(Histogram(
+    'sqlite_query_duration_seconds',
+    'SQLite 语句执行耗时（不含逐行读取结果的时间）',
+    ('operation',),
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+))
+
+
+def sql_operation(sql: str) -> str:
+    """SQL 语句的类型（SELECT / INSERT / UPDATE / DELETE / BEGIN / PRAGMA ...），用作标签"""
+    word = sql.lstrip().split(None, 1)[:1]
+    return word[0].upper() if word else 'UNKNOWN'
+
+
+def _observe_sql(sql: str, seconds: float):
+    """记录一条语句的耗时（直方图和当前请求的 Server-Timing）"""
+    sqlite_query_duration.observe(seconds, sql_operation(sql))
+    request_timing.record('db', seconds)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """记录每条语句执行耗时的游标"""
+
+    def execute(self, sql, parameters=()):
+        return self._timed(sql, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(sql, super().executemany, sql, seq_of_parameters)
+
+    def _timed(self, sql, method, *args):
+        start = time.perf_counter()
+        try:
+            return self._call(method, *args)
+        finally:
+            # 在调用方线程（协程）中记录，Server-Timing 记到当前请求上
+            _observe_sql(sql, time.perf_counter() - start)
+
+    def _call(self, method, *args):
+        """执行语句（子类可以改为在其他线程中执行）"""
+        return method(*args)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    记录语句耗时的 SQLite 连接（sqlite3.connect(..., factory=TimedConnection)）
+
+    conn.execute 和 conn.cursor().execute 都会经过 TimedCursor。
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def observe_ai_call(provider: str, duration: float, error: Optional[BaseException] = None):
+    """记录一次 AI 服务商调用的耗时和结果"""
+    if error is None:
+        ai_request_duration.observe(duration, provider, 'success')
+    else:
+        ai_request_duration.observe(duration, provider, 'error')
+        ai_request_errors.inc(provider, type(error).__name__)
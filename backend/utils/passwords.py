@@ -0,0 +1,184 @@
+"""
+密码哈希
+bcrypt 是刻意设计得很慢的 CPU 密集计算（cost 12 约 0.25 秒）。登录高峰时在请求线程里计算，
+所有其他请求都要排在它后面。
+
+这里把 bcrypt 放到独立的进程池中计算：请求线程只等待结果，
+进程数限制了哈希计算同时占用的 CPU。gevent 部署下改用同样大小的原生线程池
+（bcrypt 计算时释放 GIL，可以并行；不在打过补丁的进程里使用进程池）。等待中的哈希数超过上限时直接拒绝（PasswordHasherBusy），
+不会无限排队。cost 可配置，登录成功时发现旧哈希的 cost 与配置不同会自动重新计算。
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+import bcrypt
+
+from .cooperative import native_threadpool, run_blocking
+from .metrics import password_hash_duration, password_hash_rejected
+from .request_timing import timed
+
+
+class PasswordHasherBusy(Exception):
+    """等待中的哈希计算太多，请求被拒绝"""
+
+
+def _hash(password: bytes, rounds: int) -> bytes:
+    """在进程池中执行：计算哈希"""
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password: bytes, hashed: bytes) -> bool:
+    """在进程池中执行：校验密码"""
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    """从 bcrypt 哈希（$2b$12$...）中取出 cost，格式不对时返回 None"""
+    parts = (hashed or '').split('$')
+    if len(parts) < 4:
+        return None
+    try:
+        return int(parts[2])
+    except ValueError:
+        return None
+
+
+class PasswordHasher:
+    """进程池中的 bcrypt 哈希（线程安全，fork 后在子进程中重新创建进程池）"""
+
+    def __init__(self, rounds: int = None, workers: int = None, max_pending: int = None,
+                 queue_timeout: float = None):
+        """
+        参数:
+            rounds: bcrypt cost（4-31，每加 1 耗时翻倍，默认读取 BCRYPT_ROUNDS）
+            workers: 进程数（默认读取 PASSWORD_HASH_WORKERS；0 表示不用进程池，在当前进程中计算）
+            max_pending: 同时等待的哈希计算上限（默认读取 PASSWORD_HASH_MAX_PENDING，
+                         为 0 时取进程数的 8 倍）
+            queue_timeout: 达到上限后最多再等待多少秒（默认读取 PASSWORD_HASH_QUEUE_TIMEOUT，0 表示立即拒绝）
+        """
+        self.rounds = rounds or int(os.getenv('BCRYPT_ROUNDS', 12))
+        if not 4 <= self.rounds <= 31:
+            raise ValueError(f"BCRYPT_ROUNDS 必须在 4 到 31 之间: {self.rounds}")
+        self.workers = workers if workers is not None else int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+        self.max_pending = max_pending or int(os.getenv('PASSWORD_HASH_MAX_PENDING', 0)) \
+            or max(1, self.workers) * 8
+        self.queue_timeout = queue_timeout if queue_timeout is not None else \
+            float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 0))
+
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._threadpool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {'hashed': 0, 'verified': 0, 'rejected': 0, 'pending': 0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """
+        获取当前进程的进程池（按需创建，gunicorn fork 出的每个 worker 各有一个）
+
+        使用平台默认的启动方式：Linux 上 fork，子进程不重新导入应用，
+        只执行 _hash / _check，第一次提交任务时一次性创建全部子进程。
+        gevent 环境下不创建进程池，改为创建同样大小的原生线程池（self._threadpool）：
+        进程池的管理线程和结果队列在 monkey patch 之后的行为没有保证
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._threadpool = native_threadpool(self.workers)
+                    if self._threadpool is None:
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _reset_executor(self, executor: ProcessPoolExecutor):
+        """子进程异常退出后进程池不可再用，下次调用时重新创建"""
+        with self._lock:
+            if self._executor is executor:
+                self._pid = None
+        executor.shutdown(wait=False)
+
+    def _run(self, operation: str, fn, *args):
+        """占用一个名额执行哈希计算，名额用完时拒绝"""
+        if self.queue_timeout > 0:
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            password_hash_rejected.inc(operation)
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise PasswordHasherBusy('当前登录请求过多，请稍后重试')
+
+        with self._lock:
+            self._stats['pending'] += 1
+        start = time.perf_counter()
+        try:
+            with timed('bcrypt'):
+                if self.workers <= 0:
+                    # gevent 部署下在原生线程池中计算，不阻塞其他协程
+                    return run_blocking(fn, *args)
+                executor = self._get_executor()
+                if self._threadpool is not None:
+                    # gevent 部署：在原生线程中计算，只挂起当前协程
+                    return self._threadpool.apply(fn, args)
+                try:
+                    return executor.submit(fn, *args).result()
+                except BrokenProcessPool:
+                    self._reset_executor(executor)
+                    raise
+        finally:
+            password_hash_duration.observe(time.perf_counter() - start, operation)
+            with self._lock:
+                self._stats['pending'] -= 1
+            self._slots.release()
+
+    def hash(self, password: str) -> str:
+        """
+        计算密码哈希（使用当前配置的 cost）
+
+        异常:
+            PasswordHasherBusy: 等待中的哈希计算已达上限
+        """
+        hashed = self._run('hash', _hash, password.encode('utf-8'), self.rounds)
+        with self._lock:
+            self._stats['hashed'] += 1
+        return hashed.decode('utf-8')
+
+    def verify(self, password: str, hashed: str) -> bool:
+        """
+        校验密码
+
+        异常:
+            PasswordHasherBusy: 等待中的哈希计算已达上限
+        """
+        matched = self._run('verify', _check, password.encode('utf-8'), hashed.encode('utf-8'))
+        with self._lock:
+            self._stats['verified'] += 1
+        return matched
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """哈希的 cost 与当前配置不同（登录成功后需要重新计算）"""
+        return hash_rounds(hashed) != self.rounds
+
+    def stats(self) -> Dict:
+        """计算次数、拒绝次数和当前等待数"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(rounds=self.rounds, workers=self.workers, max_pending=self.max_pending)
+        return stats
+
+    def shutdown(self):
+        """关闭进程池"""
+        with self._lock:
+            executor, self._executor, self._pid = self._executor, None, None
+        if executor is not None:
+            executor.shutdown()
+
+
+# 全局共享的密码哈希
+password_hasher = PasswordHasher()
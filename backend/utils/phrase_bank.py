@@ -0,0 +1,201 @@
+"""
+评语短语库
+降级模式（服务商全部不可用或过载）下，不调用 AI，按学生信息中的关键词拼出一段评语。
+
+所有关键词在导入时编译成一个正则表达式（长的关键词优先，"不够认真" 不会被当成 "认真"），
+生成时只扫描一遍学生信息，再按固定的结构组合句子：开头、优点、建议、结尾。
+同一个学生每次得到的评语相同（按姓名和信息的哈希选择句子），不依赖随机数。
+"""
+
+import re
+import zlib
+from typing import List, Sequence, Tuple
+
+
+# 短语库版本（修改句子或关键词时更新，随评语一起记录）
+PHRASE_BANK_VERSION = 'v1'
+
+PRAISE = 'praise'
+ADVICE = 'advice'
+
+# (类别, 类型, 关键词, 候选句子)
+CATEGORIES = [
+    ('cheerful', PRAISE, ('开朗', '活泼', '阳光', '外向', '乐观', '幽默'), (
+        '你性格开朗活泼，总能把快乐带给身边的同学。',
+        '你阳光乐观，灿烂的笑容常常感染着身边的每一个人。',
+    )),
+    ('quiet', PRAISE, ('文静', '安静', '内向', '腼腆', '稳重', '沉稳'), (
+        '你文静稳重，做事踏实有条理，老师都看在眼里。',
+        '你安静沉稳，不声不响中总能把事情做得妥妥帖帖。',
+    )),
+    ('diligent', PRAISE, ('认真', '踏实', '刻苦', '勤奋', '努力', '专心', '用功'), (
+        '学习上你认真踏实，上课专心听讲，作业一丝不苟。',
+        '你学习刻苦勤奋，肯下功夫，这份踏实是你最宝贵的品质。',
+    )),
+    ('excellent', PRAISE, ('成绩优秀', '成绩优异', '成绩好', '成绩突出', '名列前茅', '优秀', '优异', '学霸'), (
+        '你的成绩一直名列前茅，扎实的基础来自平时一点一滴的积累。',
+        '你各科成绩优异，是同学们学习的好榜样。',
+    )),
+    ('progress', PRAISE, ('进步', '有起色', '突飞猛进'), (
+        '这学期你的进步大家有目共睹，每一分提高都凝聚着你的汗水。',
+        '看到你一天天进步，老师由衷地为你高兴。',
+    )),
+    ('helpful', PRAISE, ('乐于助人', '帮助同学', '助人', '热心', '善良', '有爱心'), (
+        '你热心善良，同学遇到困难时总是第一个伸出援手。',
+        '你乐于助人，在班级里有很好的人缘。',
+    )),
+    ('active', PRAISE, ('积极参加', '积极参与', '积极', '主动', '活动', '热情'), (
+        '你积极参加班级和学校的各项活动，处处能看到你忙碌的身影。',
+        '你做事积极主动，对集体的事情充满热情。',
+    )),
+    ('responsible', PRAISE, ('班长', '班干部', '课代表', '组长', '委员', '责任心', '负责'), (
+        '作为班干部，你认真负责，是老师的得力小助手。',
+        '你有很强的责任心，交给你的任务总能出色地完成。',
+    )),
+    ('sports', PRAISE, ('体育', '运动', '跑步', '篮球', '足球', '跳绳', '游泳', '运动会'), (
+        '运动场上你矫健的身影为班级赢得了荣誉。',
+        '你热爱运动，身体素质好，在运动会上为班级争了光。',
+    )),
+    ('arts', PRAISE, ('画画', '绘画', '美术', '音乐', '唱歌', '舞蹈', '书法', '钢琴', '乐器'), (
+        '你多才多艺，在艺术方面的特长让同学们羡慕不已。',
+        '你的艺术天赋给班级活动增添了许多光彩。',
+    )),
+    ('reading', PRAISE, ('阅读', '读书', '看书', '作文', '写作', '朗读'), (
+        '你爱读书，知识面广，作文常常被当作范文在班上朗读。',
+        '你热爱阅读，书香让你的谈吐和文字都格外出彩。',
+    )),
+    ('thinking', PRAISE, ('数学', '思维', '逻辑', '爱思考', '善于思考', '爱提问', '好奇', '动手能力'), (
+        '你思维敏捷，爱动脑筋，课堂上常有独到的见解。',
+        '你善于思考、勇于提问，这种钻研精神难能可贵。',
+    )),
+    ('polite', PRAISE, ('团结', '礼貌', '尊敬', '懂事', '友善', '诚实', '守纪'), (
+        '你懂礼貌、守纪律，与同学相处融洽。',
+        '你为人诚实友善，尊敬师长，团结同学。',
+    )),
+    ('labor', PRAISE, ('劳动', '值日', '卫生', '勤快'), (
+        '你热爱劳动，值日时总是认认真真，把教室打扫得干干净净。',
+        '你勤快能干，班级的卫生工作少不了你的功劳。',
+    )),
+    ('focus', ADVICE, ('走神', '注意力不集中', '不专心', '上课说话', '爱说话', '小动作', '开小差'), (
+        '如果上课时能更专注一些，少一些小动作，你的收获一定会更大。',
+        '希望你在课堂上集中注意力，把每一分钟都用在学习上。',
+    )),
+    ('careless', ADVICE, ('马虎', '粗心', '字迹潦草', '不细心'), (
+        '做题时再细心一点，认真检查，就能避免许多不必要的失分。',
+        '希望你改掉粗心的小毛病，把字写工整，做完题多检查一遍。',
+    )),
+    ('procrastinate', ADVICE, ('拖拉', '拖延', '不交作业', '作业拖', '不按时'), (
+        '希望你养成按时完成作业的好习惯，今日事今日毕。',
+        '如果能改掉做事拖拉的习惯，你会轻松很多，也会更出色。',
+    )),
+    ('grades', ADVICE, ('成绩一般', '成绩较差', '成绩不理想', '成绩不好', '成绩下滑', '退步', '偏科', '基础薄弱'), (
+        '学习上还需要多下功夫，把基础打牢，相信你的成绩一定会有起色。',
+        '希望你查漏补缺、不偏科，遇到不懂的问题及时向老师和同学请教。',
+    )),
+    ('shy', ADVICE, ('胆小', '不爱发言', '不主动', '不积极', '不自信', '害羞', '缺乏自信'), (
+        '希望你多一些自信，勇敢地举起手来，老师很想听听你的想法。',
+        '你其实很有想法，要相信自己，大胆地在课堂上表达出来。',
+    )),
+    ('effort', ADVICE, ('不认真', '不够认真', '不太认真', '不够努力', '贪玩', '懒散', '不用功'), (
+        '你很聪明，如果能把更多心思放在学习上，一定会有更大的进步。',
+        '希望你收收玩心，端正学习态度，用行动证明自己的实力。',
+    )),
+    ('discipline', ADVICE, ('迟到', '打闹', '调皮', '违反纪律', '不守纪律'), (
+        '希望你更加严格地要求自己，遵守纪律，做同学们的好榜样。',
+        '如果能管住自己、遵守纪律，你会成为更受大家欢迎的人。',
+    )),
+]
+
+OPENINGS = (
+    '{name}同学，这个学期老师见证了你的成长。',
+    '{name}同学，回顾这一学期，你留给老师很多美好的印象。',
+    '{name}同学，你是一个让老师印象深刻的孩子。',
+)
+
+# 没有匹配到关键词、或优点太少时补充的通用句子
+GENERIC = (
+    '你尊敬老师，团结同学，能认真完成老师布置的各项任务。',
+    '在集体生活中，你能与同学和睦相处，积极为班级出力。',
+    '你对待学习有自己的想法，也在一点点积累属于自己的收获。',
+)
+
+CLOSINGS = (
+    '希望你在新的学期里继续努力，老师期待看到一个更加优秀的你！',
+    '相信只要坚持下去，你一定会收获更多的精彩，加油！',
+    '愿你保持这份热情，在新学期里再创佳绩！',
+)
+
+
+class PhraseBank:
+    """编译后的短语库（导入时构建一次，之后只做查找和拼接）"""
+
+    def __init__(self, categories: Sequence[Tuple], openings: Sequence[str], generic: Sequence[str],
+                 closings: Sequence[str], max_praise: int = 4, max_advice: int = 2, min_praise: int = 2):
+        """
+        参数:
+            categories: [(类别, 类型, 关键词, 候选句子), ...]，类型为 PRAISE 或 ADVICE
+            openings: 开头句（变量 {name}）
+            generic: 通用优点句（优点不足 min_praise 条时补充）
+            closings: 结尾句
+            max_praise / max_advice: 最多使用的优点、建议句数
+            min_praise: 至少包含的优点句数
+        """
+        self.categories = {name: (kind, tuple(sentences)) for name, kind, _, sentences in categories}
+        self._keyword_category = {}
+        for name, _, keywords, _ in categories:
+            for keyword in keywords:
+                self._keyword_category.setdefault(keyword, name)
+        keywords = sorted(self._keyword_category, key=len, reverse=True)
+        self._pattern = re.compile('|'.join(map(re.escape, keywords)))
+
+        self._openings = tuple(opening.format for opening in openings)
+        self.generic = tuple(generic)
+        self.closings = tuple(closings)
+        self.max_praise = max_praise
+        self.max_advice = max_advice
+        self.min_praise = min_praise
+
+    def match(self, student_info: str) -> List[str]:
+        """学生信息中出现的类别（按第一次出现的顺序，不重复）"""
+        seen = {}
+        for keyword in self._pattern.findall(student_info or ''):
+            seen.setdefault(self._keyword_category[keyword], None)
+        return list(seen)
+
+    def compose(self, student_name: str, student_info: str) -> str:
+        """
+        拼出一段评语
+
+        参数:
+            student_name: 学生姓名
+            student_info: 学生信息（性格、成绩等标签）
+
+        返回:
+            评语文本
+        """
+        seed = zlib.crc32(f'{student_name}|{student_info}'.encode('utf-8'))
+
+        praise, advice = [], []
+        for index, category in enumerate(self.match(student_info)):
+            kind, sentences = self.categories[category]
+            target = praise if kind == PRAISE else advice
+            target.append(sentences[(seed + index) % len(sentences)])
+        praise = praise[:self.max_praise]
+        advice = advice[:self.max_advice]
+
+        for offset in range(len(self.generic)):
+            if len(praise) >= self.min_praise:
+                break
+            sentence = self.generic[(seed + offset) % len(self.generic)]
+            if sentence not in praise:
+                praise.append(sentence)
+
+        parts = [self._openings[seed % len(self._openings)](name=student_name)]
+        parts += praise
+        parts += advice
+        parts.append(self.closings[seed % len(self.closings)])
+        return ''.join(parts)
+
+
+# 全局共享的短语库
+phrase_bank = PhraseBank(CATEGORIES, OPENINGS, GENERIC, CLOSINGS)
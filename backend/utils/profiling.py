@@ -0,0 +1,90 @@
+"""
+按需采样的 cProfile 性能分析
+按比例随机抽取请求（或带调试请求头的请求）做 cProfile，结果写入磁盘，
+用 python -m pstats 或 snakeviz 查看。
+
+同一时刻只分析一个请求：cProfile 只记录启动它的线程，
+Python 3.12 起同一进程也只允许一个分析器处于启用状态。
+"""
+
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+
+class RequestProfiler:
+    """请求采样分析器"""
+
+    def __init__(self, sample_rate: Optional[float] = None, output_dir: Optional[str] = None,
+                 token: Optional[str] = None):
+        """
+        参数:
+            sample_rate: 随机抽样比例（0~1，默认读取 PROFILE_SAMPLE_RATE，0 表示不抽样）
+            output_dir: 分析结果目录（默认读取 PROFILE_DIR）
+            token: 调试请求头 X-Profile 需要携带的值（默认读取 PROFILE_TOKEN，为空时不接受请求头）
+        """
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+        self.output_dir = output_dir or os.getenv('PROFILE_DIR', 'profiles')
+        self.token = token if token is not None else os.getenv('PROFILE_TOKEN', '')
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or bool(self.token)
+
+    def start(self, header_value: Optional[str] = None) -> Optional[cProfile.Profile]:
+        """
+        决定是否分析当前请求，需要时启动分析器
+
+        参数:
+            header_value: 请求头 X-Profile 的值
+
+        返回:
+            已启动的分析器；不分析（或已有请求在分析）时返回 None
+        """
+        requested = bool(self.token) and header_value == self.token
+        if not requested and not (self.sample_rate > 0 and random.random() < self.sample_rate):
+            return None
+        if not self._lock.acquire(blocking=False):
+            return None
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 其他分析工具已经启用
+            self._lock.release()
+            return None
+        return profile
+
+    def stop(self, profile: cProfile.Profile, name: str, elapsed_ms: float) -> Optional[str]:
+        """
+        停止分析并写入文件
+
+        参数:
+            profile: start() 返回的分析器
+            name: 文件名中的请求描述（如 "POST /api/login"）
+            elapsed_ms: 请求耗时（毫秒），写在文件名中方便挑出慢请求
+
+        返回:
+            分析结果文件路径，写入失败时返回 None
+        """
+        try:
+            profile.disable()
+        finally:
+            self._lock.release()
+
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_') or 'request'
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{int(elapsed_ms)}ms-{os.getpid()}.prof"
+        path = os.path.join(self.output_dir, filename)
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            profile.dump_stats(path)
+        except OSError as e:
+            print(f"[WARN] 写入性能分析结果失败: {str(e)}")
+            return None
+        return path
@@ -0,0 +1,82 @@
+"""
+提示词模板
+所有服务商共用同一套带版本号的模板
+
+布局: 固定不变的 system 消息在前，每个学生不同的信息放在最后的 user 消息里。
+DeepSeek、Kimi 等服务商会缓存请求中相同的前缀，前缀越长越稳定，
+重复部分的输入 token 越便宜、首字返回越快。
+"""
+
+import os
+from typing import Dict, List
+
+
+class PromptTemplate:
+    """一个版本的提示词模板（导入时构建一次，之后只做填充）"""
+
+    def __init__(self, version: str, system: str, user: str):
+        """
+        参数:
+            version: 模板版本号（生成缓存按版本区分，修改内容时必须换新版本号）
+            system: system 消息（不含任何变量，作为可缓存的前缀）
+            user: user 消息模板，变量为 {student_name} 和 {student_info}
+        """
+        self.version = version
+        self.system = system
+        self._format_user = user.format
+        # 固定部分的长度，用于估算 token 数
+        self.static_length = len(system) + len(user)
+
+    def render_user(self, student_name: str, student_info: str) -> str:
+        """填充 user 消息"""
+        return self._format_user(student_name=student_name, student_info=student_info)
+
+    def messages(self, student_name: str, student_info: str) -> List[Dict[str, str]]:
+        """构建 Chat 消息列表：[system, user]"""
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.render_user(student_name, student_info)}
+        ]
+
+    def render(self, student_name: str, student_info: str) -> str:
+        """合并成一段文本（用于不支持 system 消息的场景）"""
+        return f"{self.system}\n\n{self.render_user(student_name, student_info)}"
+
+
+PROMPT_TEMPLATES = {
+    'v2': PromptTemplate(
+        version='v2',
+        system="""你是一位经验丰富的班主任老师，请根据老师提供的学生信息，生成一段真诚、具体、有温度的学生评语。
+
+要求：
+1. 评语要真诚、具体，避免空洞的套话
+2. 突出学生的优点和进步
+3. 如果有不足，要委婉地提出改进建议
+4. 语气要温暖、鼓励，体现对学生的关心
+5. 字数控制在150-200字左右
+6. 直接输出评语内容，不要有其他说明""",
+        user="""学生姓名：{student_name}
+学生情况：{student_info}
+
+请生成评语："""
+    ),
+}
+
+# 当前使用的模板版本（可通过环境变量 PROMPT_VERSION 切换）
+PROMPT_VERSION = os.getenv('PROMPT_VERSION', 'v2')
+
+
+def get_prompt_template(version: str = None) -> PromptTemplate:
+    """
+    获取提示词模板
+
+    参数:
+        version: 模板版本号，默认为当前版本
+
+    返回:
+        PromptTemplate
+    """
+    version = version or PROMPT_VERSION
+    if version not in PROMPT_TEMPLATES:
+        raise ValueError(f"不存在的提示词版本: {version}")
+    return PROMPT_TEMPLATES[version]
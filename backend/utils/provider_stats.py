@@ -0,0 +1,221 @@
+"""
+服务商调用统计
+记录每个服务商最近的调用耗时和健康状态，用于对冲请求、自动路由和熔断
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+
+class LatencyTracker:
+    """按服务商记录最近 N 次成功调用的耗时（线程安全）"""
+
+    def __init__(self, window: int = 200):
+        """
+        参数:
+            window: 每个服务商保留的样本数
+        """
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, latency: float):
+        """记录一次调用耗时（秒）"""
+        with self._lock:
+            samples = self._samples.get(provider)
+            if samples is None:
+                samples = deque(maxlen=self.window)
+                self._samples[provider] = samples
+            samples.append(latency)
+
+    def count(self, provider: str) -> int:
+        """样本数量"""
+        with self._lock:
+            return len(self._samples.get(provider, ()))
+
+    def percentile(self, provider: str, pct: float) -> Optional[float]:
+        """
+        计算耗时分位数
+
+        参数:
+            provider: 服务商标识
+            pct: 分位（0-100）
+
+        返回:
+            分位数（秒），没有样本时返回 None
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(provider, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * pct / 100))
+        return samples[index]
+
+
+# 全局共享的耗时统计
+latency_tracker = LatencyTracker()
+
+
+class ProviderHealth:
+    """
+    服务商健康状态：EWMA 耗时、EWMA 错误率和熔断器（线程安全）
+
+    熔断器状态:
+        closed:    正常
+        open:      连续失败次数达到阈值，请求直接失败，不再等待超时
+        half_open: 冷却时间已过，等待后台探测；探测成功后恢复 closed，失败则重新 open
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, alpha: float = None, failure_threshold: int = None, cooldown: float = None):
+        """
+        参数:
+            alpha: EWMA 平滑系数（越大越看重最近的请求，默认读取 AI_EWMA_ALPHA）
+            failure_threshold: 连续失败多少次后熔断（默认读取 AI_BREAKER_FAILURES）
+            cooldown: 熔断后多久开始探测（秒，默认读取 AI_BREAKER_COOLDOWN）
+        """
+        self.alpha = alpha or float(os.getenv('AI_EWMA_ALPHA', 0.2))
+        self.failure_threshold = failure_threshold or int(os.getenv('AI_BREAKER_FAILURES', 5))
+        self.cooldown = cooldown or float(os.getenv('AI_BREAKER_COOLDOWN', 30))
+        self._providers: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, provider: str) -> Dict:
+        """获取服务商状态（调用方需持有锁）"""
+        state = self._providers.get(provider)
+        if state is None:
+            state = {
+                'state': self.CLOSED,
+                'ewma_latency': None,
+                'ewma_error': 0.0,
+                'consecutive_failures': 0,
+                'opened_at': 0.0,
+                'requests': 0,
+                'failures': 0
+            }
+            self._providers[provider] = state
+        return state
+
+    def record_success(self, provider: str, latency: Optional[float] = None):
+        """记录一次成功调用（latency 为 None 时只更新错误率）"""
+        with self._lock:
+            state = self._get(provider)
+            state['requests'] += 1
+            state['consecutive_failures'] = 0
+            state['ewma_error'] *= (1 - self.alpha)
+            if latency is not None:
+                if state['ewma_latency'] is None:
+                    state['ewma_latency'] = latency
+                else:
+                    state['ewma_latency'] += self.alpha * (latency - state['ewma_latency'])
+            state['state'] = self.CLOSED
+
+    def record_failure(self, provider: str):
+        """记录一次失败调用，连续失败达到阈值时熔断"""
+        with self._lock:
+            state = self._get(provider)
+            state['requests'] += 1
+            state['failures'] += 1
+            state['consecutive_failures'] += 1
+            state['ewma_error'] += self.alpha * (1 - state['ewma_error'])
+            if state['consecutive_failures'] >= self.failure_threshold and state['state'] == self.CLOSED:
+                state['state'] = self.OPEN
+                state['opened_at'] = time.monotonic()
+                print(f"[WARN] {provider} 连续失败 {state['consecutive_failures']} 次，已熔断")
+
+    def is_available(self, provider: str) -> bool:
+        """熔断器关闭时才接受正常请求"""
+        with self._lock:
+            return self._get(provider)['state'] == self.CLOSED
+
+    def due_for_probe(self, provider: str) -> bool:
+        """冷却时间已过的熔断服务商进入 half_open，返回 True 表示需要探测"""
+        with self._lock:
+            state = self._get(provider)
+            if state['state'] == self.OPEN and time.monotonic() - state['opened_at'] >= self.cooldown:
+                state['state'] = self.HALF_OPEN
+                return True
+            return False
+
+    def record_probe(self, provider: str, ok: bool, latency: Optional[float] = None):
+        """记录探测结果：成功则恢复，失败则重新熔断并重新计算冷却时间"""
+        if ok:
+            self.record_success(provider, latency)
+            print(f"[OK] {provider} 探测成功，已恢复")
+            return
+        with self._lock:
+            state = self._get(provider)
+            state['state'] = self.OPEN
+            state['opened_at'] = time.monotonic()
+
+    def score(self, provider: str) -> float:
+        """路由评分（越小越好）：EWMA 耗时按错误率加权，没有样本的服务商优先尝试"""
+        with self._lock:
+            state = self._get(provider)
+            if state['ewma_latency'] is None:
+                return 0.0
+            return state['ewma_latency'] * (1 + 4 * state['ewma_error'])
+
+    def choose(self, candidates: List[str]) -> Optional[str]:
+        """
+        从候选服务商中选出当前最快且健康的一个
+
+        所有候选都已熔断时，返回最早熔断的那个（最接近恢复）
+        """
+        available = [p for p in candidates if self.is_available(p)]
+        if available:
+            return min(available, key=self.score)
+        if not candidates:
+            return None
+        with self._lock:
+            return min(candidates, key=lambda p: self._get(p)['opened_at'])
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """所有服务商的状态副本"""
+        with self._lock:
+            return {provider: dict(state) for provider, state in self._providers.items()}
+
+
+# 全局共享的健康状态
+provider_health = ProviderHealth()
+
+
+class UsageStats:
+    """按服务商累计 token 用量（包括命中服务商前缀缓存的输入 token 数）和重试次数（线程安全）"""
+
+    def __init__(self):
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, usage: Dict[str, int]):
+        """累计一次调用的用量"""
+        with self._lock:
+            totals = self._totals.setdefault(provider, {
+                'requests': 0,
+                'prompt_tokens': 0,
+                'completion_tokens': 0,
+                'cached_tokens': 0,
+                'retries': 0
+            })
+            totals['requests'] += 1
+            for key in ('prompt_tokens', 'completion_tokens', 'cached_tokens', 'retries'):
+                totals[key] += usage.get(key, 0)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """各服务商累计用量，cache_hit_rate 为输入 token 中命中缓存的比例"""
+        with self._lock:
+            result = {provider: dict(totals) for provider, totals in self._totals.items()}
+        for totals in result.values():
+            prompt = totals['prompt_tokens']
+            totals['cache_hit_rate'] = round(totals['cached_tokens'] / prompt, 4) if prompt else 0.0
+        return result
+
+
+# 全局共享的 token 用量统计
+usage_stats = UsageStats()
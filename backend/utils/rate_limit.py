@@ -0,0 +1,321 @@
+"""
+服务商限流
+每个服务商一个令牌桶（每分钟请求数、每分钟 token 数）和一个并发上限，
+超出时调用方短暂排队等待，而不是直接触发服务商的 429
+
+同步调用（线程）和异步客户端（asyncio）共用同一个限流器，额度合并计算；
+请求失败后的重试通过 backoff / backoff_async 等待：等待期间归还并发名额，
+每次重试重新计入 RPM/TPM
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+# 异步等待并发名额时的轮询间隔（秒）：从最小值开始翻倍，不超过最大值
+_ASYNC_POLL_MIN = 0.005
+_ASYNC_POLL_MAX = 0.05
+
+
+class RateLimitTimeout(Exception):
+    """排队等待超时"""
+
+
+class _Lease:
+    """一次 acquire 持有的额度（重试等待期间暂时归还并发名额）"""
+
+    def __init__(self, limiter: 'ProviderLimiter', estimated_tokens: int):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self.active = False     # 是否计入 in_flight 统计
+        self.holding = False    # 是否持有并发名额
+
+
+# 当前线程 / asyncio 任务持有的额度（acquire 嵌套时按顺序排列）
+_leases: contextvars.ContextVar = contextvars.ContextVar('rate_limit_leases', default=())
+
+
+class TokenBucket:
+    """令牌桶：按每分钟速率匀速补充，容量为一分钟的额度"""
+
+    def __init__(self, per_minute: float):
+        """
+        参数:
+            per_minute: 每分钟补充的令牌数
+        """
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        """按经过的时间补充令牌（调用方需持有锁）"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, amount: float, deadline: float):
+        """
+        取出 amount 个令牌，不够时等待补充
+
+        参数:
+            amount: 令牌数（超过容量时按容量计算，避免永远等不到）
+            deadline: 最晚等待到的时间点（time.monotonic()）
+
+        异常:
+            RateLimitTimeout: 在 deadline 之前没有拿到令牌
+        """
+        amount = min(amount, self.capacity)
+        with self._cond:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RateLimitTimeout()
+                self._cond.wait(min(wait, remaining))
+
+    async def acquire_async(self, amount: float, deadline: float):
+        """acquire 的 asyncio 版本：令牌不够时 sleep 到预计补足的时间，不阻塞事件循环"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._cond:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RateLimitTimeout()
+            await asyncio.sleep(min(wait, remaining))
+
+
+class ProviderLimiter:
+    """单个服务商的限流器"""
+
+    def __init__(self, provider: str):
+        """
+        参数:
+            provider: 服务商标识，配置读取 <PROVIDER>_RPM / _TPM / _MAX_INFLIGHT，
+                      未单独配置时使用 AI_RPM / AI_TPM / AI_MAX_INFLIGHT（0 表示不限制）
+        """
+        def config(name, default):
+            value = os.getenv(f'{provider.upper()}_{name}', os.getenv(f'AI_{name}', default))
+            return float(value)
+
+        self.provider = provider
+        rpm = config('RPM', 0)
+        tpm = config('TPM', 0)
+        # 同时进行的请求数上限，HTTP 连接池大小也按它设置（utils.ai_client.get_http_pool_size）
+        self.max_inflight = max(0, int(config('MAX_INFLIGHT', 16)))
+        self.max_wait = float(os.getenv('AI_RATE_LIMIT_MAX_WAIT', 10))
+
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.inflight = threading.BoundedSemaphore(self.max_inflight) if self.max_inflight > 0 else None
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'acquired': 0,
+            'waited': 0,
+            'timeouts': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'in_flight': 0
+        }
+
+    @contextmanager
+    def acquire(self, estimated_tokens: int = 0):
+        """
+        获取一次请求的额度（上下文管理器），退出时释放并发名额
+
+        用法:
+            with limiter.acquire(1200) as wait:
+                ...  # wait 为排队等待的秒数
+
+        异常:
+            RateLimitTimeout: 排队超过 AI_RATE_LIMIT_MAX_WAIT 秒
+        """
+        lease = _Lease(self, estimated_tokens)
+        wait = self._take(lease)
+        _leases.set(_leases.get() + (lease,))
+        try:
+            yield wait
+        finally:
+            # 按对象移除而不是 reset：生成器可能在其他上下文中被关闭
+            _leases.set(tuple(item for item in _leases.get() if item is not lease))
+            self._release(lease)
+
+    @asynccontextmanager
+    async def acquire_async(self, estimated_tokens: int = 0):
+        """
+        acquire 的 asyncio 版本（异步客户端使用），与同步调用共用令牌桶和并发名额
+
+        用法:
+            async with limiter.acquire_async(1200) as wait:
+                ...
+
+        并发名额用完时短间隔轮询等待（名额可能由其他线程释放），不阻塞事件循环
+
+        异常:
+            RateLimitTimeout: 排队超过 AI_RATE_LIMIT_MAX_WAIT 秒
+        """
+        lease = _Lease(self, estimated_tokens)
+        wait = await self._take_async(lease)
+        _leases.set(_leases.get() + (lease,))
+        try:
+            yield wait
+        finally:
+            # 按对象移除而不是 reset：生成器可能在其他上下文中被关闭
+            _leases.set(tuple(item for item in _leases.get() if item is not lease))
+            self._release(lease)
+
+    def backoff(self, delay: float):
+        """
+        重试前等待 delay 秒
+
+        当前线程持有该限流器的额度时，等待期间归还并发名额（其他请求可以使用），
+        等待结束后重新排队，重试的请求同样计入 RPM/TPM；没有持有额度时只等待。
+
+        异常:
+            RateLimitTimeout: 重新排队超时（此时不再持有额度）
+        """
+        lease = self._current_lease()
+        if lease is not None:
+            self._release(lease)
+        time.sleep(delay)
+        if lease is not None:
+            self._take(lease)
+
+    async def backoff_async(self, delay: float):
+        """backoff 的 asyncio 版本"""
+        lease = self._current_lease()
+        if lease is not None:
+            self._release(lease)
+        await asyncio.sleep(delay)
+        if lease is not None:
+            await self._take_async(lease)
+
+    def _current_lease(self) -> Optional[_Lease]:
+        """当前上下文中最内层的、属于本限流器的额度"""
+        for lease in reversed(_leases.get()):
+            if lease.limiter is self and lease.active:
+                return lease
+        return None
+
+    def _take(self, lease: _Lease) -> float:
+        """排队获取一次额度（并发名额、1 个请求、预估 token），返回排队等待的秒数"""
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        try:
+            if self.inflight is not None:
+                if not self.inflight.acquire(timeout=self.max_wait):
+                    raise RateLimitTimeout()
+                lease.holding = True
+            if self.requests is not None:
+                self.requests.acquire(1, deadline)
+            if self.tokens is not None and lease.estimated_tokens:
+                self.tokens.acquire(lease.estimated_tokens, deadline)
+        except RateLimitTimeout:
+            raise self._timeout(lease)
+        return self._acquired(lease, start)
+
+    async def _take_async(self, lease: _Lease) -> float:
+        """_take 的 asyncio 版本：并发名额用完时短间隔轮询等待（名额可能由其他线程释放）"""
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        try:
+            if self.inflight is not None:
+                delay = _ASYNC_POLL_MIN
+                while not self.inflight.acquire(blocking=False):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise RateLimitTimeout()
+                    await asyncio.sleep(min(delay, remaining))
+                    delay = min(delay * 2, _ASYNC_POLL_MAX)
+                lease.holding = True
+            if self.requests is not None:
+                await self.requests.acquire_async(1, deadline)
+            if self.tokens is not None and lease.estimated_tokens:
+                await self.tokens.acquire_async(lease.estimated_tokens, deadline)
+        except RateLimitTimeout:
+            raise self._timeout(lease)
+        except BaseException:
+            # 等待期间任务被取消
+            if lease.holding:
+                lease.holding = False
+                self.inflight.release()
+            raise
+        return self._acquired(lease, start)
+
+    def _timeout(self, lease: _Lease) -> RateLimitTimeout:
+        """排队超时：归还已拿到的并发名额，返回要抛出的异常"""
+        if lease.holding:
+            lease.holding = False
+            self.inflight.release()
+        with self._lock:
+            self._stats['timeouts'] += 1
+        return RateLimitTimeout(
+            f"{self.provider} 请求过多，排队超过 {self.max_wait:g} 秒，请稍后重试"
+        )
+
+    def _acquired(self, lease: _Lease, start: float) -> float:
+        """记录一次成功获取，返回排队等待的秒数"""
+        lease.active = True
+        wait = time.monotonic() - start
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['in_flight'] += 1
+            if wait > 0.001:
+                self._stats['waited'] += 1
+            self._stats['wait_seconds_total'] += wait
+            self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], wait)
+        return wait
+
+    def _release(self, lease: _Lease):
+        """请求结束（或重试前等待）：归还并发名额；已经归还过的额度不重复归还"""
+        if not lease.active:
+            return
+        lease.active = False
+        with self._lock:
+            self._stats['in_flight'] -= 1
+        if lease.holding:
+            lease.holding = False
+            self.inflight.release()
+
+    def stats(self) -> Dict:
+        """排队等待统计"""
+        with self._lock:
+            return dict(self._stats)
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    """获取服务商的限流器（按需创建，进程内共享）"""
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(provider)
+            if limiter is None:
+                limiter = ProviderLimiter(provider)
+                _limiters[provider] = limiter
+    return limiter
+
+
+def get_all_stats() -> Dict[str, Dict]:
+    """所有服务商的限流统计"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.provider: limiter.stats() for limiter in limiters}
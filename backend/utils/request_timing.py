@@ -0,0 +1,108 @@
+"""
+单个请求的分阶段耗时
+请求开始时 start() 创建记录，之后同一上下文中的 JWT 校验、密码校验、SQLite 语句、
+AI 服务商调用各自累加耗时，请求结束时输出为 Server-Timing 响应头和一行日志。
+
+使用 contextvars 保存当前请求的记录：提交到线程池的任务需要用
+contextvars.copy_context().run 包装才能记到同一个请求上。
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+class RequestTimings:
+    """一个请求内各阶段的累计耗时和次数（线程安全，批量生成时多个线程同时记录）"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._phases: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float):
+        """累加一个阶段的耗时"""
+        with self._lock:
+            totals = self._phases.get(phase)
+            if totals is None:
+                self._phases[phase] = [seconds, 1]
+            else:
+                totals[0] += seconds
+                totals[1] += 1
+
+    def elapsed(self) -> float:
+        """请求开始至今的秒数"""
+        return time.perf_counter() - self.start
+
+    def phases(self) -> Dict[str, Dict]:
+        """{阶段: {"ms": 累计毫秒, "count": 次数}}"""
+        with self._lock:
+            return {
+                phase: {'ms': round(seconds * 1000, 2), 'count': count}
+                for phase, (seconds, count) in self._phases.items()
+            }
+
+    def server_timing(self) -> str:
+        """
+        Server-Timing 响应头的值，例如
+            jwt;dur=0.31, db;dur=2.4;desc="count=6", ai;dur=1840.2, total;dur=1851.7
+
+        （响应头只能使用 latin-1 字符，desc 不写中文）
+        """
+        entries = []
+        for phase, values in self.phases().items():
+            entry = f"{phase};dur={values['ms']}"
+            if values['count'] > 1:
+                entry += f";desc=\"count={values['count']}\""
+            entries.append(entry)
+        entries.append(f'total;dur={round(self.elapsed() * 1000, 2)}')
+        return ', '.join(entries)
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('request_timings', default=None)
+
+
+def start() -> contextvars.Token:
+    """开始记录当前请求，返回的 token 交给 finish() 恢复"""
+    return _current.set(RequestTimings())
+
+
+def finish(token: contextvars.Token) -> Optional[RequestTimings]:
+    """结束当前请求的记录，返回记录内容"""
+    timings = _current.get()
+    _current.reset(token)
+    return timings
+
+
+def current() -> Optional[RequestTimings]:
+    """当前请求的记录（不在请求中时为 None）"""
+    return _current.get()
+
+
+def record(phase: str, seconds: float):
+    """把一段耗时记到当前请求上（不在请求中时忽略）"""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+@contextmanager
+def timed(phase: str):
+    """
+    统计一段代码的耗时
+
+    用法:
+        with timed('bcrypt'):
+            bcrypt.checkpw(...)
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - start_time)
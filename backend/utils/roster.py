@@ -0,0 +1,336 @@
+"""
+学生名单导入
+老师手里的学生名单一般是 Excel 或 CSV，这里逐行读取（不把整个文件读进内存），
+识别姓名、学生信息、班级列，校验后交给调用方保存。
+
+- CSV：按 UTF-8 读取，不是 UTF-8 时按 GB18030（兼容 GBK，Excel 中文版默认另存的编码）；
+  遇到无法解码的内容时报错，不用替换字符代替（否则乱码会被当作学生信息导入）
+- XLSX：用标准库 zipfile 打开，iterparse 逐行解析第一个工作表，每行处理完立即释放；
+  共享字符串表（sharedStrings.xml）按序号引用，只能整体保存，同样用 iterparse 解析。
+  读取的每个 XML 部件（工作簿、工作簿关系表、工作表、共享字符串表）解压后的大小
+  都不能超过 ROSTER_XLSX_MAX_XML_MB（防止压缩炸弹），共享字符串占用的内存不会超过这个大小
+- 第一行是表头时按表头找列；没有"学生信息"列时，把其余各列拼成 "表头：内容"；
+  第一行不是表头时，第一列为姓名，第二列为学生信息
+"""
+
+import codecs
+import csv
+import io
+import os
+import posixpath
+import re
+import zipfile
+import zlib
+from typing import Dict, Iterator, List, Optional
+from xml.etree.ElementTree import iterparse
+
+# 学生姓名、学生信息的最大长度（生成评语和导入名单使用同样的校验）
+STUDENT_NAME_MAX_LENGTH = int(os.getenv('STUDENT_NAME_MAX_LENGTH', 50))
+STUDENT_INFO_MAX_LENGTH = int(os.getenv('STUDENT_INFO_MAX_LENGTH', 1000))
+
+# XLSX 中每个 XML 部件解压后的最大大小（MB）
+XLSX_MAX_XML_MB = float(os.getenv('ROSTER_XLSX_MAX_XML_MB', 20))
+
+# 表头别名（比较时去掉空白和 *，不区分大小写）
+NAME_HEADERS = ('student_name', 'name', '姓名', '学生姓名', '学生', '名字')
+INFO_HEADERS = ('student_info', 'info', '学生信息', '学生情况', '情况', '表现', '评价', '描述')
+CLASS_HEADERS = ('class_name', 'class', '班级', '班别')
+# 拼接学生信息时忽略的列
+IGNORED_HEADERS = ('序号', '编号', '学号', 'no', 'id')
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx')
+
+# 探测 CSV 编码时读取的字节数
+_SNIFF_BYTES = 64 * 1024
+
+_SPREADSHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PACKAGE_RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+_CELL_COLUMN = re.compile(r'^([A-Z]+)')
+
+
+class RosterFormatError(ValueError):
+    """名单文件无法读取（格式不支持、文件损坏、行数超过上限）"""
+
+
+def validate_student(student_name, student_info) -> Optional[str]:
+    """
+    校验学生姓名和信息
+
+    返回:
+        不合格时返回错误信息，合格时返回 None
+    """
+    if not isinstance(student_name, str) or not isinstance(student_info, str) \
+            or not student_name.strip() or not student_info.strip():
+        return '学生姓名和信息不能为空'
+    if len(student_name.strip()) > STUDENT_NAME_MAX_LENGTH:
+        return f'学生姓名不能超过 {STUDENT_NAME_MAX_LENGTH} 个字符'
+    if len(student_info.strip()) > STUDENT_INFO_MAX_LENGTH:
+        return f'学生信息不能超过 {STUDENT_INFO_MAX_LENGTH} 个字符'
+    return None
+
+
+def _normalize_header(value: str) -> str:
+    return re.sub(r'[\s*]', '', value or '').lower()
+
+
+# ===== CSV =====
+
+def _detect_encoding(stream) -> str:
+    """读取文件开头判断编码（UTF-8 / GB18030），读完后回到文件开头"""
+    head = stream.read(_SNIFF_BYTES)
+    stream.seek(0)
+    try:
+        # final=False：开头一段可能在多字节字符中间截断
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'gb18030'
+
+
+def iter_csv_rows(stream) -> Iterator[List[str]]:
+    """逐行读取 CSV（stream 为可 seek 的二进制文件对象）"""
+    encoding = _detect_encoding(stream)
+    text = io.TextIOWrapper(stream, encoding=encoding, newline='')
+    try:
+        yield from csv.reader(text)
+    except csv.Error as e:
+        raise RosterFormatError(f'CSV 文件格式错误: {e}')
+    except UnicodeDecodeError:
+        raise RosterFormatError(f"CSV 文件编码无法识别（按 {'UTF-8' if encoding == 'utf-8-sig' else 'GBK'} "
+                                f"读取失败），请另存为 UTF-8 编码的 CSV")
+    finally:
+        # 不关闭调用方的文件对象
+        text.detach()
+
+
+# ===== XLSX =====
+
+def _column_index(reference: str) -> Optional[int]:
+    """单元格引用（如 C12）对应的列号（从 0 开始）"""
+    match = _CELL_COLUMN.match(reference or '')
+    if match is None:
+        return None
+    index = 0
+    for letter in match.group(1):
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def _element_text(element) -> str:
+    """元素下所有 <t> 文本（富文本单元格由多段组成）"""
+    return ''.join(node.text or '' for node in element.iter(_SPREADSHEET_NS + 't'))
+
+
+def _first_sheet_path(archive: zipfile.ZipFile, max_bytes: int) -> str:
+    """工作簿中第一个工作表的路径（工作簿和关系表解压后超过 max_bytes 时抛出 RosterFormatError）"""
+    try:
+        sheet_id = None
+        for _, element in iterparse(_open_part(archive, 'xl/workbook.xml', max_bytes)):
+            if element.tag == _SPREADSHEET_NS + 'sheet':
+                sheet_id = element.get(_RELATIONSHIP_NS + 'id')
+                break
+            element.clear()
+        for _, element in iterparse(_open_part(archive, 'xl/_rels/workbook.xml.rels', max_bytes)):
+            if element.tag == _PACKAGE_RELATIONSHIP_NS + 'Relationship' and element.get('Id') == sheet_id:
+                target = element.get('Target')
+                return target.lstrip('/') if target.startswith('/') else posixpath.normpath('xl/' + target)
+            element.clear()
+    except KeyError:
+        pass
+    return 'xl/worksheets/sheet1.xml'
+
+
+def _open_part(archive: zipfile.ZipFile, name: str, max_bytes: int):
+    """
+    打开压缩包中的 XML 部件，解压后的大小超过 max_bytes 时抛出 RosterFormatError
+
+    按目录中记录的大小检查即可：zipfile 读出的数据不会超过记录的大小（多出的部分会被截断并校验失败）
+    """
+    info = archive.getinfo(name)
+    if info.file_size > max_bytes:
+        raise RosterFormatError(f'XLSX 文件内容过大（解压后超过 {max_bytes // (1024 * 1024)} MB）')
+    return archive.open(info)
+
+
+def _shared_strings(archive: zipfile.ZipFile, max_bytes: int) -> List[str]:
+    """共享字符串表（单元格按序号引用），解压后超过 max_bytes 时抛出 RosterFormatError"""
+    try:
+        source = _open_part(archive, 'xl/sharedStrings.xml', max_bytes)
+    except KeyError:
+        return []
+    strings = []
+    for _, element in iterparse(source):
+        if element.tag == _SPREADSHEET_NS + 'si':
+            strings.append(_element_text(element))
+            element.clear()
+    return strings
+
+
+def iter_xlsx_rows(stream, max_xml_bytes: Optional[int] = None) -> Iterator[List[str]]:
+    """
+    逐行读取 XLSX 的第一个工作表（stream 为可 seek 的二进制文件对象）
+
+    max_xml_bytes: 每个 XML 部件解压后的最大字节数（默认 ROSTER_XLSX_MAX_XML_MB）
+    """
+    if max_xml_bytes is None:
+        max_xml_bytes = int(XLSX_MAX_XML_MB * 1024 * 1024)
+    try:
+        archive = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile:
+        raise RosterFormatError('不是有效的 XLSX 文件')
+
+    with archive:
+        try:
+            shared = _shared_strings(archive, max_xml_bytes)
+            sheet = _open_part(archive, _first_sheet_path(archive, max_xml_bytes), max_xml_bytes)
+        except KeyError:
+            raise RosterFormatError('XLSX 文件中没有工作表')
+        except (SyntaxError, zipfile.BadZipFile, zlib.error) as e:
+            raise RosterFormatError(f'XLSX 文件格式错误: {e}')
+
+        try:
+            sheet_data = None
+            for event, element in iterparse(sheet, events=('start', 'end')):
+                if event == 'start':
+                    if element.tag == _SPREADSHEET_NS + 'sheetData':
+                        sheet_data = element
+                    continue
+                if element.tag != _SPREADSHEET_NS + 'row':
+                    continue
+                values = []
+                for cell in element.iter(_SPREADSHEET_NS + 'c'):
+                    cell_type = cell.get('t')
+                    if cell_type == 'inlineStr':
+                        value = _element_text(cell)
+                    else:
+                        value_element = cell.find(_SPREADSHEET_NS + 'v')
+                        value = (value_element.text or '') if value_element is not None else ''
+                        if cell_type == 's' and value:
+                            value = shared[int(value)]
+                    column = _column_index(cell.get('r'))
+                    if column is not None and column > len(values):
+                        values.extend([''] * (column - len(values)))
+                    values.append(value)
+                # 处理完一行立即从树中移除，内存占用与行数无关
+                if sheet_data is not None:
+                    sheet_data.clear()
+                else:
+                    element.clear()
+                yield values
+        except (SyntaxError, IndexError, ValueError, zipfile.BadZipFile, zlib.error) as e:
+            raise RosterFormatError(f'XLSX 文件格式错误: {e}')
+
+
+# ===== 列识别 =====
+
+class RosterReader:
+    """
+    读取名单文件，逐个产出学生
+
+    读取过程中记录不合格的行（最多保留 max_errors 条明细）
+    """
+
+    def __init__(self, filename: str, stream, max_rows: int = 10000, max_errors: int = 50,
+                 max_class_length: int = 50):
+        """
+        参数:
+            filename: 上传的文件名（按扩展名判断格式）
+            stream: 可 seek 的二进制文件对象
+            max_rows: 最多读取的数据行数，超过时抛出 RosterFormatError
+            max_errors: 最多保留的错误明细条数
+            max_class_length: 班级名称最多保留的字符数
+        """
+        extension = os.path.splitext(filename or '')[1].lower()
+        if extension not in SUPPORTED_EXTENSIONS:
+            raise RosterFormatError(f"只支持 {' / '.join(SUPPORTED_EXTENSIONS)} 文件")
+        self.extension = extension
+        self.stream = stream
+        self.max_rows = max_rows
+        self.max_errors = max_errors
+        self.max_class_length = max_class_length
+        self.rows = 0
+        self.invalid = 0
+        self.errors: List[Dict] = []
+
+    def _rows(self) -> Iterator[List[str]]:
+        if self.extension == '.csv':
+            return iter_csv_rows(self.stream)
+        return iter_xlsx_rows(self.stream)
+
+    def _reject(self, line: int, message: str):
+        self.invalid += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': line, 'message': message})
+
+    def __iter__(self) -> Iterator[Dict]:
+        """
+        逐个产出合格的学生: {"student_name", "student_info", "class_name"}
+
+        class_name 为名单中的班级列（没有时为 None）
+        """
+        columns = None
+        for line, values in enumerate(self._rows(), start=1):
+            values = [str(value).strip() for value in values]
+            if not any(values):
+                continue
+
+            if columns is None:
+                columns = self._detect_columns(values)
+                if columns['header']:
+                    continue
+
+            self.rows += 1
+            if self.rows > self.max_rows:
+                raise RosterFormatError(f'名单最多 {self.max_rows} 行')
+
+            student = self._student(values, columns)
+            student['class_name'] = (student['class_name'] or '')[:self.max_class_length] or None
+            error = validate_student(student['student_name'], student['student_info'])
+            if error:
+                self._reject(line, error)
+                continue
+            yield student
+
+    @staticmethod
+    def _detect_columns(values: List[str]) -> Dict:
+        """根据第一行判断各列的含义"""
+        headers = [_normalize_header(value) for value in values]
+
+        def find(aliases):
+            for index, header in enumerate(headers):
+                if header in aliases:
+                    return index
+            return None
+
+        name = find(NAME_HEADERS)
+        if name is None:
+            # 没有表头：第一列姓名，第二列学生信息
+            return {'header': False, 'name': 0, 'info': [1], 'class': None, 'titles': None}
+
+        info = find(INFO_HEADERS)
+        class_column = find(CLASS_HEADERS)
+        if info is not None:
+            info_columns = [info]
+        else:
+            info_columns = [index for index, header in enumerate(headers)
+                            if index not in (name, class_column) and header and header not in IGNORED_HEADERS]
+        return {'header': True, 'name': name, 'info': info_columns, 'class': class_column,
+                'titles': values if info is None else None}
+
+    @staticmethod
+    def _student(values: List[str], columns: Dict) -> Dict:
+        def cell(index):
+            return values[index] if index is not None and index < len(values) else ''
+
+        if columns['titles'] is not None:
+            # 没有"学生信息"列：把其余各列拼成 "表头：内容"
+            info = '，'.join(f"{columns['titles'][index]}：{cell(index)}"
+                            for index in columns['info'] if cell(index))
+        else:
+            info = cell(columns['info'][0])
+        return {
+            'student_name': cell(columns['name']),
+            'student_info': info,
+            'class_name': cell(columns['class']) or None
+        }
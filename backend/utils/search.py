@@ -0,0 +1,76 @@
+"""
+评语全文检索的查询解析和高亮
+comments_fts 使用 trigram 分词（中文没有空格分词，按连续三个字符建索引），
+只有不少于 3 个字符的词能走全文索引；更短的词（如两个字的姓名）用 LIKE 在该用户的评语中过滤。
+
+用户输入按空白拆成多个词，全部命中才算匹配；每个词都作为短语加引号，
+FTS5 的查询语法字符（AND、OR、*、引号等）不会被解释。
+"""
+
+import html
+import re
+from typing import List, NamedTuple
+
+# trigram 分词能检索的最短词长
+MIN_INDEXED_LENGTH = 3
+
+# 一次查询最多使用的词数
+MAX_TERMS = 8
+
+# 高亮时先插入不会出现在正文中的控制字符，转义 HTML 后再换成标签
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+
+class SearchQuery(NamedTuple):
+    """解析后的查询"""
+    terms: List[str]            # 全部检索词（去重，保持顺序）
+    match: str                  # FTS5 MATCH 表达式（没有可索引的词时为空字符串）
+    like_terms: List[str]       # 需要用 LIKE 过滤的短词
+
+
+def parse_query(text: str) -> SearchQuery:
+    """
+    解析用户输入的检索词
+
+    参数:
+        text: 用户输入（空白分隔多个词）
+
+    返回:
+        SearchQuery；没有有效检索词时 terms 为空列表
+    """
+    terms = []
+    for term in (text or '').split():
+        term = term.replace(_MARK_START, '').replace(_MARK_END, '')
+        if term and term not in terms:
+            terms.append(term)
+    terms = terms[:MAX_TERMS]
+
+    indexed = [term for term in terms if len(term) >= MIN_INDEXED_LENGTH]
+    match = ' AND '.join('"' + term.replace('"', '""') + '"' for term in indexed)
+    like_terms = [term for term in terms if len(term) < MIN_INDEXED_LENGTH]
+    return SearchQuery(terms, match, like_terms)
+
+
+def like_pattern(term: str) -> str:
+    """LIKE 的 %term% 模式（转义 % 和 _，配合 ESCAPE '\\'）"""
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+class Highlighter:
+    """把文本中出现的检索词包上 <mark> 标签，其余内容做 HTML 转义"""
+
+    def __init__(self, terms: List[str], start: str = '<mark>', end: str = '</mark>'):
+        # 长的词优先，重叠时标记更完整的片段
+        terms = sorted(terms, key=len, reverse=True)
+        self._pattern = re.compile('|'.join(map(re.escape, terms)), re.IGNORECASE) if terms else None
+        self.start = start
+        self.end = end
+
+    def __call__(self, text: str) -> str:
+        if not text:
+            return text
+        if self._pattern is not None:
+            text = self._pattern.sub(lambda m: _MARK_START + m.group(0) + _MARK_END, text)
+        return html.escape(text).replace(_MARK_START, self.start).replace(_MARK_END, self.end)
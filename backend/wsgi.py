@@ -0,0 +1,10 @@
+"""
+WSGI 入口（生产环境）
+启动: gunicorn -c gunicorn.conf.py wsgi:app
+
+本地开发仍然可以使用 python app.py
+"""
+
+from app import app
+
+__all__ = ['app']
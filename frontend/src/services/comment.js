@@ -3,7 +3,7 @@
  */
 
 import api from './api';
-import { API_ENDPOINTS } from '../utils/config';
+import { API_BASE_URL, API_ENDPOINTS, STORAGE_KEYS } from '../utils/config';
 
 /**
  * 生成评语
@@ -11,20 +11,105 @@ import { API_ENDPOINTS } from '../utils/config';
  * @param {string} data.student_name - 学生姓名
  * @param {string} data.student_info - 学生情况
  * @param {string} data.ai_model - AI 模型
+ * @param {boolean} [data.force_fresh] - 跳过缓存，重新生成一个新版本
  * @returns {Promise}
  */
 export const generateComment = (data) => {
     return api.post(API_ENDPOINTS.generateComment, data);
 };
 
+/**
+ * 流式生成评语（Server-Sent Events，边生成边显示）
+ * EventSource 不支持 POST 和自定义请求头，这里用 fetch 读取事件流
+ * @param {Object} data - 与 generateComment 相同
+ * @param {Function} onToken - 每收到一段文本时调用 onToken(text)
+ * @returns {Promise<{comment: string, comment_id: number}>}
+ * 失败时（包括已经输出部分文本之后）抛出错误，评语没有保存，调用方应丢弃已经通过 onToken 显示的文本
+ */
+export const streamComment = async (data, onToken) => {
+    const token = localStorage.getItem(STORAGE_KEYS.token);
+    const response = await fetch(API_BASE_URL + API_ENDPOINTS.streamComment, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            Authorization: `Bearer ${token}`,
+        },
+        body: JSON.stringify(data),
+    });
+
+    if (!response.ok) {
+        const result = await response.json().catch(() => ({}));
+        throw new Error(result.message || `请求失败: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // 事件之间以空行分隔
+        let index;
+        while ((index = buffer.indexOf('\n\n')) !== -1) {
+            const raw = buffer.slice(0, index);
+            buffer = buffer.slice(index + 2);
+
+            const event = raw.match(/^event: (.*)$/m)?.[1];
+            const payload = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || '{}');
+            if (event === 'token') onToken(payload.text);
+            else if (event === 'done') return payload;
+            else if (event === 'error') throw new Error(payload.message);
+        }
+    }
+    throw new Error('连接中断');
+};
+
+/**
+ * 提交后台生成任务（立即返回 job_id，之后轮询 getCommentJob）
+ * @param {Object} data - 与 generateComment 相同
+ * @returns {Promise}
+ */
+export const submitCommentJob = (data) => {
+    return api.post(API_ENDPOINTS.generateComment, { ...data, async: true });
+};
+
+/**
+ * 查询后台生成任务状态
+ * @param {number} id - 任务 ID
+ * @returns {Promise}
+ */
+export const getCommentJob = (id) => {
+    return api.get(API_ENDPOINTS.commentJob(id));
+};
+
+/**
+ * 批量生成评语（整个班级一次提交，服务端并发调用 AI）
+ * @param {Array<{student_name: string, student_info: string}>} students - 学生列表
+ * @param {string} aiModel - AI 模型
+ * @returns {Promise}
+ */
+export const batchGenerateComments = (students, aiModel = 'deepseek') => {
+    return api.post(API_ENDPOINTS.batchGenerate, {
+        students,
+        ai_model: aiModel,
+    }, {
+        // 整批耗时约等于最慢的一次 AI 调用，超过默认的 30 秒超时
+        timeout: 120000,
+    });
+};
+
 /**
  * 获取评语历史记录
- * @param {number} limit - 获取数量限制
+ * @param {number} limit - 获取数量限制（服务端最多 100）
+ * @param {Object|null} cursor - 上一页返回的 next_cursor，第一页传 null
  * @returns {Promise}
  */
-export const getCommentHistory = (limit = 50) => {
+export const getCommentHistory = (limit = 50, cursor = null) => {
     return api.get(API_ENDPOINTS.commentHistory, {
-        params: { limit },
+        params: { limit, ...(cursor || {}) },
     });
 };
 
@@ -16,6 +16,9 @@ export const API_ENDPOINTS = {
 
     // 评语相关
     generateComment: '/api/comment/generate',
+    streamComment: '/api/comment/generate/stream',
+    batchGenerate: '/api/comment/batch',
+    commentJob: (id) => `/api/comment/jobs/${id}`,
     commentHistory: '/api/comment/history',
     deleteComment: (id) => `/api/comment/${id}`,
 };
@@ -33,6 +36,7 @@ export const AI_MODELS = [
     { value: 'zhipu', label: '智谱 AI' },
     { value: 'qwen', label: '通义千问' },
     { value: 'kimi', label: 'Kimi' },
+    { value: 'auto', label: '自动选择（当前最快）' },
 ];
 
 export { API_BASE_URL };